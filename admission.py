@@ -0,0 +1,146 @@
+import time
+import asyncio
+from collections import deque
+from typing import Callable, Optional
+
+
+# ─── Admission control in front of the model ─────────────────────────
+# At most max_active requests are scored at once; up to max_queue more
+# wait for a slot in arrival order, and a request that found the queue
+# full or waited deadline_ms without getting a slot is turned away
+# (Overloaded) before it touches any vehicle window, so the client can
+# simply retry it. Everything runs on the event loop, so no locks.
+#
+# Degraded mode: once degrade_at requests are waiting, `degraded` flips
+# on (and on_switch is called) so the caller can score with a cheaper
+# model; it flips back when the queue is down to degrade_at / 2 and
+# nothing has pushed it past degrade_at for hold_s, so one drained
+# burst does not make it flap. If the queue drains before hold_s is up,
+# a timer re-checks then, so an idle gate does not stay degraded.
+class Overloaded(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason                 # "queue_full" | "deadline"
+
+
+class AdmissionGate:
+    def __init__(self,
+                 max_active: int,
+                 max_queue: int = 256,
+                 deadline_ms: float = 250.0,
+                 degrade_at: int = 0,
+                 hold_s: float = 5.0,
+                 on_switch: Optional[Callable[[bool], None]] = None):
+        if max_active < 1:
+            raise ValueError("max_active must be >= 1")
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.deadline = deadline_ms / 1000.0
+        self.degrade_at = degrade_at         # 0 = never degrade
+        self.hold = hold_s
+        self.on_switch = on_switch
+        self.active = 0
+        self.degraded = False
+        self._waiters: deque = deque()       # futures, oldest first
+        self._hold_until = 0.0
+        self._recheck: Optional[asyncio.TimerHandle] = None
+
+        self.admitted = 0
+        self.queued_total = 0
+        self.rejected = {"queue_full": 0, "deadline": 0}
+        self.switches = 0
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> float:
+        # takes a slot; returns the seconds spent waiting for it
+        if self.active < self.max_active and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            self._update_mode()
+            return 0.0
+        if len(self._waiters) >= self.max_queue:
+            self.rejected["queue_full"] += 1
+            raise Overloaded("queue_full")
+
+        t0 = time.perf_counter()
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        self.queued_total += 1
+        self._update_mode()
+        try:
+            await asyncio.wait_for(fut, self.deadline)
+        except asyncio.TimeoutError:
+            self._forget(fut)
+            if not (fut.done() and not fut.cancelled()):
+                self.rejected["deadline"] += 1
+                raise Overloaded("deadline") from None
+            # the slot arrived together with the timeout: keep it
+        except asyncio.CancelledError:
+            self._forget(fut)
+            if fut.done() and not fut.cancelled():
+                self.release()               # handed a slot nobody will use
+            raise
+        finally:
+            self._update_mode()
+        self.admitted += 1
+        return time.perf_counter() - t0
+
+    def release(self) -> None:
+        # the slot passes straight to the oldest waiter still waiting
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                self._update_mode()
+                return
+        self.active -= 1
+        self._update_mode()
+
+    def _forget(self, fut: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(fut)
+        except ValueError:                   # already popped by release()
+            pass
+
+    def _update_mode(self) -> None:
+        if self.degrade_at <= 0:
+            return
+        depth = len(self._waiters)
+        now = time.monotonic()
+        if depth >= self.degrade_at:
+            self._hold_until = now + self.hold
+            if not self.degraded:
+                self._switch(True)
+        elif self.degraded and depth <= self.degrade_at // 2:
+            if now >= self._hold_until:
+                self._switch(False)
+            elif self._recheck is None:
+                self._recheck = asyncio.get_running_loop().call_later(
+                    self._hold_until - now, self._recheck_mode)
+
+    def _recheck_mode(self) -> None:
+        self._recheck = None
+        self._update_mode()
+
+    def _switch(self, degraded: bool) -> None:
+        self.degraded = degraded
+        self.switches += 1
+        if self.on_switch is not None:
+            self.on_switch(degraded)
+
+    def stats(self) -> dict:
+        return {
+            "max_active": self.max_active,
+            "max_queue": self.max_queue,
+            "deadline_ms": self.deadline * 1000,
+            "degrade_at": self.degrade_at,
+            "active": self.active,
+            "queued": len(self._waiters),
+            "degraded": self.degraded,
+            "admitted": self.admitted,
+            "queued_total": self.queued_total,
+            "rejected": dict(self.rejected),
+            "switches": self.switches,
+        }
@@ -0,0 +1,317 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import datetime
+import platform
+import subprocess
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from generateTelemetry import simulate_kinematics, haversine_dist, make_windows
+from vehicleState import FeatureBuilder, N_FEATURES
+from predictors import bench_ms
+
+# ─── Benchmark harness for the /predict service ─────────────────────
+#   python benchmark.py                        in-process app, load + micro
+#   python benchmark.py --url http://127.0.0.1:8000 --suites load
+#   python benchmark.py --out new.json --baseline old.json
+#
+# Load: every synthetic vehicle replays its own GPS stream in time order
+# (next fix only after the previous answer, like a real tracker), at most
+# --concurrency vehicles in flight. In-process runs talk to main.app
+# through httpx's ASGI transport, so they include routing, validation and
+# serialisation but no socket. Latencies are per HTTP request.
+# Micro: FeatureBuilder.add_point(+features), make_windows per window and
+# predict_proba of every available predictor at batch sizes 1 … 4096.
+BATCH_SIZES = (1, 4, 16, 64, 256, 1024, 4096)
+
+
+# ─── Synthetic fleet ─────────────────────────────────────────────────
+def synthetic_streams(n_vehicles: int, n_points: int, seed: int = 0,
+                      start: datetime.datetime = datetime.datetime(2025, 1, 1, 8)) -> list:
+    # one (lat, lon, timestamp) list per vehicle, same kinematics as the
+    # training data, each vehicle starting somewhere in a ~20 km square
+    streams = []
+    for v in range(n_vehicles):
+        rng = np.random.default_rng([seed, v])
+        lat0, lon0 = 45.0 + rng.uniform(-0.1, 0.1), 9.0 + rng.uniform(-0.1, 0.1)
+        _, _, _, lats, lons = simulate_kinematics(n_points, 1.0, lat0, lon0, rng=rng)
+        t0 = start + datetime.timedelta(seconds=int(rng.integers(0, 3600)))
+        streams.append([(float(la), float(lo), t0 + datetime.timedelta(seconds=k))
+                        for k, (la, lo) in enumerate(zip(lats, lons))])
+    return streams
+
+
+def _summary(latencies_s: list, elapsed: float, n_points: int, statuses: dict) -> dict:
+    lat = np.asarray(latencies_s) * 1000
+    return {
+        "requests": len(lat),
+        "points": n_points,
+        "elapsed_s": elapsed,
+        "requests_per_s": len(lat) / elapsed,
+        "points_per_s": n_points / elapsed,
+        "latency_ms": {
+            "mean": float(lat.mean()),
+            "p50": float(np.percentile(lat, 50)),
+            "p95": float(np.percentile(lat, 95)),
+            "p99": float(np.percentile(lat, 99)),
+            "max": float(lat.max()),
+        },
+        "status": {str(k): v for k, v in sorted(statuses.items())},
+    }
+
+
+# ─── Load test ───────────────────────────────────────────────────────
+async def run_load(client, streams: list, concurrency: int, batch: int = 0) -> dict:
+    # batch == 0: one /predict per fix; batch > 0: /predict_batch with that
+    # many consecutive fixes of one vehicle per request
+    sem = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], {}
+
+    async def drive(vehicle_id: int, points: list):
+        async with sem:
+            step = batch or 1
+            for i in range(0, len(points), step):
+                recs = [{"latitude": la, "longitude": lo, "timestamp": ts.isoformat(),
+                         "vehicle_id": vehicle_id} for la, lo, ts in points[i:i + step]]
+                t = time.perf_counter()
+                if batch:
+                    r = await client.post("/predict_batch", json={"records": recs})
+                else:
+                    r = await client.post("/predict", json=recs[0])
+                latencies.append(time.perf_counter() - t)
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(drive(v, s) for v, s in enumerate(streams)))
+    elapsed = time.perf_counter() - t0
+    return _summary(latencies, elapsed, sum(map(len, streams)), statuses)
+
+
+async def load_suite(args) -> dict:
+    import httpx
+
+    streams = synthetic_streams(args.vehicles, args.points, args.seed)
+    warm = synthetic_streams(min(args.vehicles, 8), 8, args.seed + 1)
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60)
+        app_stop = None
+    else:
+        import main
+        main._load_artifacts()               # ASGITransport does not run lifespan,
+        main._start_gate()                   # so the startup hooks are called here
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app),
+                                   base_url="http://bench", timeout=60)
+        app_stop = main._stop_batcher
+
+    results = {}
+    try:
+        async with client:
+            # warm-up on negative vehicle ids; every measured run gets its own
+            # id range so all of its vehicles start from an empty window
+            await run_load(_Offset(client, -len(warm)), warm, len(warm))
+            runs = [(f"predict_c{c}", c, 0) for c in args.concurrency]
+            if args.batch:
+                runs += [(f"batch{args.batch}_c{c}", c, args.batch) for c in args.concurrency]
+            for i, (key, c, batch) in enumerate(runs):
+                offset = i * len(streams)
+                results[key] = await run_load(_Offset(client, offset), streams, c, batch)
+                _print_load(key, results[key])
+    finally:
+        if app_stop is not None:
+            await app_stop()
+    return {"target": args.url or "in-process", "vehicles": args.vehicles,
+            "points_per_vehicle": args.points, "runs": results}
+
+
+class _Offset:
+    # shifts vehicle ids so every run starts from empty vehicle windows
+    def __init__(self, client, offset: int):
+        self.client, self.offset = client, offset
+
+    async def post(self, path: str, json: dict):
+        if "records" in json:
+            for r in json["records"]:
+                r["vehicle_id"] += self.offset
+        else:
+            json["vehicle_id"] += self.offset
+        return await self.client.post(path, json=json)
+
+
+def _print_load(key: str, r: dict) -> None:
+    lat = r["latency_ms"]
+    print(f"{key:>16}: {r['requests_per_s']:8.0f} req/s {r['points_per_s']:8.0f} pts/s | "
+          f"p50 {lat['p50']:7.2f} ms  p95 {lat['p95']:7.2f} ms  p99 {lat['p99']:7.2f} ms "
+          f"| {r['status']}")
+
+
+# ─── Microbenchmarks ─────────────────────────────────────────────────
+def bench_add_point(n: int = 20_000) -> dict:
+    (points,) = synthetic_streams(1, n, seed=7)
+    fb = FeatureBuilder()
+    t = time.perf_counter()
+    for la, lo, ts in points:
+        fb.add_point(la, lo, ts)
+    t_add = time.perf_counter() - t
+
+    fb = FeatureBuilder()
+    row = np.empty(N_FEATURES)
+    t = time.perf_counter()
+    for la, lo, ts in points:
+        fb.add_point(la, lo, ts)
+        fb.features(out=row)
+    t_both = time.perf_counter() - t
+    return {"points": n, "add_point_us": t_add / n * 1e6,
+            "add_point_features_us": t_both / n * 1e6}
+
+
+def _telemetry_frame(n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(11)
+    speeds, _, _, lats, lons = simulate_kinematics(n, rng=rng)
+    df = pd.DataFrame({"lat": lats, "lon": lons, "speed": speeds})
+    df["acceleration"] = df["speed"].diff().fillna(0)
+    df["jerk"] = df["acceleration"].diff().fillna(0)
+    df["dist"] = haversine_dist(df["lat"], df["lon"],
+                                df["lat"].shift(), df["lon"].shift()).fillna(0)
+    return df
+
+
+def bench_make_windows(n: int = 5_000) -> dict:
+    df = _telemetry_frame(n)
+    out = {"rows": n}
+    for w in (2, 4, 8):
+        t = time.perf_counter()
+        make_windows(df, w)
+        out[f"w{w}_us_per_row"] = (time.perf_counter() - t) / n * 1e6
+    return out
+
+
+def _predictors() -> dict:
+    # every predictor the current bundle (or legacy pickle) can build
+    from modelBundle import ModelBundle, PREDICTORS
+    bundle = ModelBundle.current(os.getenv("BUNDLE_ROOT", "artifacts"))
+    if bundle is not None:
+        out = {}
+        for kind in PREDICTORS:
+            try:
+                out[kind] = bundle.predictor(kind)
+            except ValueError:
+                pass
+        return out
+    if os.path.exists("temp_scal.pkl"):
+        from joblib import load
+        from predictors import FusedEnsemble
+        scaler = load("temp_scal.pkl")
+        return {"ensemble": scaler, "fused": FusedEnsemble.from_temp_scaler(scaler)}
+    return {}
+
+
+def bench_predict_proba(batch_sizes=BATCH_SIZES, reps: int = 10) -> dict:
+    predictors = _predictors()
+    if not predictors:
+        print("no model bundle or temp_scal.pkl here, skipping predict_proba")
+        return {}
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(max(batch_sizes), N_FEATURES))
+    out = {}
+    for name, p in predictors.items():
+        out[name] = {}
+        for n in batch_sizes:
+            ms = bench_ms(p.predict_proba, np.ascontiguousarray(X[:n]), reps)
+            out[name][str(n)] = {"ms": ms, "us_per_row": ms * 1000 / n}
+        print(f"{'predict_proba ' + name:>22}: " +
+              " ".join(f"b{n}={out[name][str(n)]['ms']:.2f}ms" for n in batch_sizes))
+    return out
+
+
+def micro_suite(args) -> dict:
+    out = {"add_point": bench_add_point(args.micro_points)}
+    print(f"{'add_point':>22}: {out['add_point']['add_point_us']:.2f} µs, "
+          f"+features {out['add_point']['add_point_features_us']:.2f} µs")
+    out["make_windows"] = bench_make_windows(args.micro_rows)
+    print(f"{'make_windows':>22}: " + " ".join(
+        f"w{w}={out['make_windows'][f'w{w}_us_per_row']:.1f}µs/row" for w in (2, 4, 8)))
+    out["predict_proba"] = bench_predict_proba(reps=args.reps)
+    return out
+
+
+# ─── Baseline comparison ─────────────────────────────────────────────
+def _flatten(d: dict, prefix: str = "") -> dict:
+    flat = {}
+    for k, v in d.items():
+        key = f"{prefix}.{k}" if prefix else str(k)
+        if isinstance(v, dict):
+            flat.update(_flatten(v, key))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            flat[key] = float(v)
+    return flat
+
+
+def compare(current: dict, baseline: dict) -> list:
+    # (metric, baseline, current, ratio) for the headline numbers only
+    cur, base = _flatten(current), _flatten(baseline)
+    keep = ("latency_ms.p50", "latency_ms.p99", "points_per_s", "_us", ".ms")
+    rows = []
+    for k in sorted(cur.keys() & base.keys()):
+        if k.startswith("meta.") or not any(s in k for s in keep) or not base[k]:
+            continue
+        rows.append((k, base[k], cur[k], cur[k] / base[k]))
+    return rows
+
+
+def _meta(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": commit, "python": sys.version.split()[0],
+            "platform": platform.platform(), "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")}}
+
+
+def main(argv: Optional[list] = None):
+    ap = argparse.ArgumentParser(description="Load and latency benchmarks for the predictor")
+    ap.add_argument("--suites", default="load,micro", help="comma list of: load, micro")
+    ap.add_argument("--url", default=None, help="running service; default is in-process")
+    ap.add_argument("--vehicles", type=int, default=50)
+    ap.add_argument("--points", type=int, default=60, help="fixes per vehicle")
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    ap.add_argument("--batch", type=int, default=32,
+                    help="also run /predict_batch with this many fixes per call (0 = off)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--micro-points", type=int, default=20_000)
+    ap.add_argument("--micro-rows", type=int, default=5_000)
+    ap.add_argument("--reps", type=int, default=10)
+    ap.add_argument("--out", default="bench.json")
+    ap.add_argument("--baseline", default=None, help="earlier --out file to compare against")
+    args = ap.parse_args(argv)
+
+    suites = {s.strip() for s in args.suites.split(",")}
+    report = {"meta": _meta(args)}
+    if "load" in suites:
+        report["load"] = asyncio.run(load_suite(args))
+    if "micro" in suites:
+        report["micro"] = micro_suite(args)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\n{'metric':<58} {'baseline':>12} {'current':>12} {'ratio':>7}")
+        for k, b, c, r in compare(report, baseline):
+            print(f"{k:<58} {b:12.3f} {c:12.3f} {r:7.2f}")
+
+
+if __name__ == "__main__":
+    main()
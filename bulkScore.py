@@ -0,0 +1,493 @@
+import os
+import time
+import queue
+import argparse
+import pathlib
+import multiprocessing as mp
+from collections import OrderedDict
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+from featureSpec import (N_FEATURES, WINDOWS, batch_features, check_layout,
+                         point_kinematics)
+from vehicleState import FeatureBuilder
+from trainingData import is_csv, open_columnar
+from workerPool import shard_of
+
+# ─── Offline bulk scoring of stored GPS history ──────────────────────
+# Reads a CSV or Parquet/Arrow trip file (or a directory of part files)
+# in chunks and scores every point exactly as /predict would have, had
+# the points arrived one by one in time order per vehicle:
+#   - each chunk is sorted by (vehicle, timestamp); the last
+#     max(WINDOWS) - 1 points of every vehicle are carried into the next
+#     chunk, so windows span chunk boundaries like FeatureBuilder's ring;
+#   - the features of a whole chunk are computed with shifted numpy
+#     arrays (no per-point Python), then scored in one predict_proba call;
+#   - vehicles are sharded over worker processes (workerPool.shard_of),
+#     and each worker writes its own part-NNN.parquet.
+# Memory is bounded by the chunk size plus a few points per vehicle, and
+# the carried vehicles are bounded like the service's VehicleStateStore:
+#   - a vehicle silent for more than IDLE_S (data time, i.e. timestamps)
+#     starts a new track, as /predict would after its state expired
+#     (STATE_TTL_S), so once the newest timestamp read is IDLE_S past a
+#     vehicle's last point its carry can go without changing anything;
+#   - at most MAX_VEHICLES carries are kept, least recently seen dropped
+#     first (inputs sorted per vehicle never let the data clock expire
+#     anything; a vehicle dropped this way that comes back restarts).
+# Points of a vehicle must not go back in time across chunks (true for
+# files written in time order, per vehicle or for the whole fleet). A fix
+# that repeats the vehicle's previous one (same timestamp and position)
+# gets that fix's scores and does not enter the windows, as /predict
+# answers a re-sent fix from its prediction cache.
+CHUNK_ROWS   = 1_000_000
+BUNDLE_ROOT  = os.getenv("BUNDLE_ROOT", "artifacts")
+IDLE_S       = float(os.getenv("STATE_TTL_S", 900))
+MAX_VEHICLES = int(os.getenv("BULK_MAX_VEHICLES", 1_000_000))
+COLUMNS      = ("vehicle_id", "timestamp", "latitude", "longitude")
+_KEEP        = max(WINDOWS) - 1
+_CARRY       = ("lat", "lon", "t", "speed", "acc", "jerk", "dist", "head", "hc")
+_QUEUE_DEPTH = 2                             # chunks in flight per worker
+
+
+# ─── Vectorised FeatureBuilder ──────────────────────────────────────
+def trip_features(ext: dict, pos: np.ndarray, new: np.ndarray) -> tuple:
+    # ext: per-point arrays of one or more vehicles, each vehicle's points
+    # contiguous and in time order ("lat", "lon", "t" in ns; carried points
+    # also hold their derived "speed" … "hc"). pos: index of every point in
+    # its vehicle's whole history. new: points still to be derived.
+    # Fills the derived columns of the new points in place and returns
+    # (X of the new points in FEATURE_COLUMNS order, ready mask).
+    point_kinematics(ext, pos, new)
+    return batch_features(ext, pos, new), pos[new] >= 1
+
+
+class TripFeatures:
+    # Chunk-by-chunk driver of trip_features for a stream of points from
+    # any number of vehicles, carrying each vehicle's last points over.
+    # idle_s = None never splits tracks nor expires carries.
+    def __init__(self, idle_s: Optional[float] = IDLE_S, max_vehicles: int = MAX_VEHICLES):
+        if max_vehicles < 1:
+            raise ValueError("max_vehicles must be >= 1")
+        self.idle_ns = None if idle_s is None else int(idle_s * 1e9)
+        self.max_vehicles = max_vehicles
+        # vehicle -> (arrays, points seen, features of the last point or
+        # None if it was not scored), least recently seen first
+        self.carry: "OrderedDict" = OrderedDict()
+        self.clock = np.iinfo(np.int64).min  # newest timestamp read
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+
+    def __len__(self) -> int:
+        return len(self.carry)
+
+    def add_chunk(self, vehicle, t, lat, lon) -> tuple:
+        # Returns (order, X, ready): the chunk's rows in processing order,
+        # their features, and whether /predict would have scored them.
+        codes, uniques = pd.factorize(vehicle)
+        n_new = len(codes)
+        hist = [(j, self.carry[v]) for j, v in enumerate(uniques) if v in self.carry]
+
+        h_codes = np.concatenate([np.full(len(a["t"]), j) for j, (a, _, _) in hist]
+                                 or [np.empty(0, np.int64)])
+        cols = {"lat": lat, "lon": lon, "t": t}
+        ext = {}
+        for name in _CARRY:
+            h = [a[name] for _, (a, _, _) in hist]
+            v = cols[name] if name in cols else np.zeros(n_new, dtype=np.float64)
+            ext[name] = np.concatenate(h + [np.asarray(v)])
+        vid = np.concatenate([h_codes, codes])
+        is_new = np.concatenate([np.zeros(len(h_codes), bool), np.ones(n_new, bool)])
+        src = np.concatenate([np.arange(len(h_codes)), np.arange(n_new)])
+
+        order = np.lexsort((src, ext["t"], is_new, vid))
+        ext = {name: v[order] for name, v in ext.items()}
+        vid, is_new, src = vid[order], is_new[order], src[order]
+
+        # repeats of the vehicle's previous fix are left out of the tracks
+        # and get the features of the fix they repeat (ref) afterwards
+        dup = np.zeros(len(vid), dtype=bool)
+        dup[1:] = ((vid[1:] == vid[:-1]) & (ext["t"][1:] == ext["t"][:-1])
+                   & (ext["lat"][1:] == ext["lat"][:-1]) & (ext["lon"][1:] == ext["lon"][:-1]))
+        dup &= is_new
+        ref = np.cumsum(~dup) - 1
+        out_new, out_src = is_new, src
+        if dup.any():
+            ext = {name: v[~dup] for name, v in ext.items()}
+            vid, is_new = vid[~dup], is_new[~dup]
+
+        # position of every point in its track: a track is a vehicle's run
+        # of points without a gap of more than idle_ns; the first track of
+        # a carried vehicle continues its history
+        first = np.r_[True, vid[1:] != vid[:-1]]
+        starts = np.flatnonzero(first)
+        brk = first.copy()
+        if self.idle_ns is not None:
+            brk[1:] |= np.diff(ext["t"]) > self.idle_ns
+        seg = np.flatnonzero(brk)
+        block = np.repeat(np.arange(len(seg)), np.diff(np.r_[seg, len(vid)]))
+        base = np.zeros(len(uniques), dtype=np.int64)
+        for j, (a, seen, _) in hist:
+            base[j] = seen - len(a["t"])
+        pos = np.arange(len(vid)) - seg[block] + np.where(first[seg], base[vid[seg]], 0)[block]
+
+        # features of every kept point: derived for the new ones, the
+        # carried last point's from the carry (a repeat may point at it)
+        X = np.full((len(vid), N_FEATURES), np.nan)
+        ready = np.zeros(len(vid), dtype=bool)
+        X[is_new], ready[is_new] = trip_features(ext, pos, is_new)
+        row0 = np.zeros(len(uniques), dtype=np.int64)
+        row0[vid[starts]] = starts
+        for j, (a, _, last) in hist:
+            if last is not None:
+                i = row0[j] + len(a["t"]) - 1
+                X[i], ready[i] = last, True
+
+        ends = np.r_[starts[1:], len(vid)]
+        for j, b in zip(vid[starts], ends):
+            k = max(seg[block[b - 1]], b - _KEEP)
+            v = uniques[j]
+            self.carry[v] = ({name: ext[name][k:b].copy() for name in _CARRY},
+                             int(pos[b - 1]) + 1,
+                             X[b - 1].copy() if ready[b - 1] else None)
+            self.carry.move_to_end(v)
+        if n_new:
+            self.clock = max(self.clock, int(np.max(t)))
+        self._evict()
+        sel = ref[out_new]
+        return out_src[out_new], X[sel], ready[sel]
+
+    def _evict(self) -> None:
+        if self.idle_ns is not None:
+            cutoff = self.clock - self.idle_ns
+            idle = [v for v, (a, _, _) in self.carry.items() if a["t"][-1] < cutoff]
+            for v in idle:
+                del self.carry[v]
+            self.evicted_idle += len(idle)
+        while len(self.carry) > self.max_vehicles:
+            self.carry.popitem(last=False)
+            self.evicted_lru += 1
+
+
+# ─── Input ───────────────────────────────────────────────────────────
+def _to_ns(ts: pd.Series) -> np.ndarray:
+    # wall-clock nanoseconds, as FeatureBuilder sees datetime fields:
+    # tz-aware values keep their own local time, epoch numbers are UTC
+    if pd.api.types.is_numeric_dtype(ts):
+        ts = pd.to_datetime(ts, unit="s")
+    elif not pd.api.types.is_datetime64_any_dtype(ts):
+        ts = pd.to_datetime(ts, format="ISO8601")
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_localize(None)
+    return ts.to_numpy("datetime64[ns]").astype(np.int64)
+
+
+def read_chunks(path, columns=COLUMNS, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    path = pathlib.Path(path)
+    if is_csv(path):
+        yield from pd.read_csv(path, usecols=list(columns), chunksize=chunk_rows)
+        return
+    for batch in open_columnar(path).to_batches(columns=list(columns),
+                                                batch_size=chunk_rows):
+        yield batch.to_pandas()
+
+
+# ─── Model ───────────────────────────────────────────────────────────
+def load_predictor(kind: str = "fused", root: str = BUNDLE_ROOT, version=None):
+    # (predictor, classes, version): the bundle the service would serve,
+    # or temp_scal.pkl / label_encoder.pkl without one
+    from predictors import TempScaler, FusedEnsemble  # noqa: F401  (pickles)
+    from modelBundle import ModelBundle
+    bundle = ModelBundle(os.path.join(root, version)) if version else ModelBundle.current(root)
+    if bundle is not None:
+        predictor, classes, version = bundle.predictor(kind), bundle.classes, bundle.version
+    else:
+        from joblib import load
+        scaler = load("temp_scal.pkl")
+        predictor = FusedEnsemble.from_temp_scaler(scaler) if kind == "fused" else scaler
+        classes, version = list(load("label_encoder.pkl").classes_), "legacy"
+    if predictor.feature_names is not None:
+        check_layout(predictor.feature_names, f"model {version}")
+    return predictor, list(classes), version
+
+
+def _set_threads(predictor, n: int) -> None:
+    for part in ("cheap", "full"):           # CascadePredictor
+        if hasattr(predictor, part):
+            _set_threads(getattr(predictor, part), n)
+    if hasattr(predictor, "booster"):
+        predictor.booster.set_param({"nthread": n})
+    for m in getattr(predictor, "models", ()):
+        (m.get_booster() if hasattr(m, "get_booster") else m).set_param({"nthread": n})
+
+
+# ─── Scoring ─────────────────────────────────────────────────────────
+class PartWriter:
+    def __init__(self, path, classes):
+        self.path = path
+        self.classes = classes
+        self.rows = 0
+        self._writer = None
+
+    def write(self, rows, vehicle, t, P, ready):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        n = len(rows)
+        codes = np.full(n, -1, dtype=np.int8)
+        codes[ready] = P.argmax(axis=1)
+        proba = np.full((n, len(self.classes)), np.nan, dtype=np.float32)
+        proba[ready] = P
+        normal = self.classes.index("Normal")
+        cols = {
+            "row": pa.array(rows, pa.int64()),
+            "vehicle_id": pa.array(vehicle),
+            "timestamp": pa.array(t.astype("datetime64[ns]")),
+            "predicted_event": pa.DictionaryArray.from_arrays(
+                pa.array(codes, pa.int8(), mask=~ready), pa.array(self.classes)),
+            "aggressive_score": pa.array(1.0 - proba[:, normal], mask=~ready),
+        }
+        for j, c in enumerate(self.classes):
+            cols[f"proba_{c}"] = pa.array(proba[:, j], mask=~ready)
+        table = pa.table(cols)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, table.schema, compression="zstd")
+        self._writer.write_table(table)
+        self.rows += n
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class Scorer:
+    # features + model + part file for the vehicles of one shard
+    def __init__(self, out_path, kind, root, version, nthread,
+                 idle_s=IDLE_S, max_vehicles=MAX_VEHICLES):
+        self.predictor, self.classes, self.version = load_predictor(kind, root, version)
+        if nthread:
+            _set_threads(self.predictor, nthread)
+        self.trips = TripFeatures(idle_s, max_vehicles)
+        self.out = PartWriter(out_path, self.classes)
+        self.t_features = self.t_predict = self.t_write = 0.0
+
+    def score(self, rows, vehicle, t, lat, lon):
+        t0 = time.perf_counter()
+        order, X, ready = self.trips.add_chunk(vehicle, t, lat, lon)
+        t1 = time.perf_counter()
+        P = self.predictor.predict_proba(X[ready]) if ready.any() else np.empty((0, len(self.classes)))
+        t2 = time.perf_counter()
+        self.out.write(rows[order], np.asarray(vehicle)[order], t[order], P, ready)
+        self.t_features += t1 - t0
+        self.t_predict += t2 - t1
+        self.t_write += time.perf_counter() - t2
+
+    def close(self) -> dict:
+        self.out.close()
+        return {"path": str(self.out.path), "rows": self.out.rows, "vehicles": len(self.trips),
+                "evicted_idle": self.trips.evicted_idle, "evicted_lru": self.trips.evicted_lru,
+                "features_s": self.t_features, "predict_s": self.t_predict,
+                "write_s": self.t_write}
+
+
+def _put(q, msg, proc) -> None:
+    # blocks while the worker is behind, but not on a worker that died
+    while True:
+        try:
+            q.put(msg, timeout=1.0)
+            return
+        except queue.Full:
+            if not proc.is_alive():
+                raise RuntimeError(f"bulk scoring failed: {proc.name} exited "
+                                   f"with code {proc.exitcode}") from None
+
+
+def _collect(results, procs, parts) -> list:
+    # one stats dict per worker; a worker gone without reporting (killed
+    # for memory, crashed) raises instead of being waited on forever
+    stats, suspect = {}, set()
+    while len(stats) < len(procs):
+        try:
+            s = results.get(timeout=1.0)
+            stats[s["path"]] = s
+            continue
+        except queue.Empty:
+            pass
+        dead = {i for i, p in enumerate(procs) if not p.is_alive() and parts[i] not in stats}
+        # a report can still be in flight from a worker that just exited
+        # normally: only fail on one that is still missing a second later
+        if dead & suspect:
+            p = procs[min(dead & suspect)]
+            raise RuntimeError(f"bulk scoring failed: {p.name} exited with code {p.exitcode}")
+        suspect = dead
+    return list(stats.values())
+
+
+def _worker_main(q, results, out_path, kind, root, version, nthread, idle_s, max_vehicles):
+    try:
+        scorer = Scorer(out_path, kind, root, version, nthread, idle_s, max_vehicles)
+        while (msg := q.get()) is not None:
+            scorer.score(*msg)
+        results.put(scorer.close())
+    except BaseException as exc:
+        results.put({"path": str(out_path), "error": repr(exc)})
+        while q.get() is not None:          # keep the reader from blocking on us
+            pass
+
+
+def score_file(src, out_dir, kind="fused", root=BUNDLE_ROOT, version=None, workers=1,
+               chunk_rows=CHUNK_ROWS, columns=COLUMNS, idle_s=IDLE_S,
+               max_vehicles=MAX_VEHICLES) -> list:
+    # Scores every point of src into out_dir/part-NNN.parquet (one part per
+    # worker) and returns one stats dict per part.
+    os.makedirs(out_dir, exist_ok=True)
+    vcol, tcol, latcol, loncol = columns
+    parts = [os.path.join(out_dir, f"part-{i:03d}.parquet") for i in range(workers)]
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    if workers == 1:
+        scorer = Scorer(parts[0], kind, root, version, threads, idle_s, max_vehicles)
+        send = lambda i, msg: scorer.score(*msg)    # noqa: E731
+    else:
+        ctx = mp.get_context("spawn")
+        results = ctx.Queue()
+        queues = [ctx.Queue(_QUEUE_DEPTH) for _ in range(workers)]
+        procs = [ctx.Process(target=_worker_main, daemon=True, name=f"bulk-score-{i}",
+                             args=(queues[i], results, parts[i], kind, root, version, threads,
+                                   idle_s, max_vehicles))
+                 for i in range(workers)]
+        for p in procs:
+            p.start()
+        send = lambda i, msg: _put(queues[i], msg, procs[i])    # noqa: E731
+
+    try:
+        row0 = 0
+        for df in read_chunks(src, columns, chunk_rows):
+            rows = np.arange(row0, row0 + len(df), dtype=np.int64)
+            row0 += len(df)
+            vehicle = df[vcol].to_numpy()
+            t = _to_ns(df[tcol])
+            lat = df[latcol].to_numpy(np.float64)
+            lon = df[loncol].to_numpy(np.float64)
+            if workers == 1:
+                send(0, (rows, vehicle, t, lat, lon))
+                continue
+            codes, uniques = pd.factorize(vehicle)
+            shard = np.array([shard_of(u.item() if hasattr(u, "item") else u, workers)
+                              for u in uniques], dtype=np.int64)[codes]
+            for i in range(workers):
+                sel = shard == i
+                if sel.any():
+                    send(i, (rows[sel], vehicle[sel], t[sel], lat[sel], lon[sel]))
+
+        if workers == 1:
+            return [scorer.close()]
+        for q, p in zip(queues, procs):
+            _put(q, None, p)
+        stats = _collect(results, procs, parts)
+    except BaseException:
+        if workers > 1:                      # the others would wait for input forever
+            for q, p in zip(queues, procs):
+                q.cancel_join_thread()       # chunks still buffered for a dead reader
+                p.terminate()
+                p.join()
+        raise
+    for p in procs:
+        p.join()
+    errors = [s for s in stats if "error" in s]
+    if errors:
+        raise RuntimeError(f"bulk scoring failed: {errors}")
+    return sorted(stats, key=lambda s: s["path"])
+
+
+# ─── Parity check against the serving FeatureBuilder ─────────────────
+def check(src, n, chunk_rows, columns=COLUMNS, idle_s=IDLE_S) -> float:
+    # features of the first n points, bulk path (in chunks of chunk_rows)
+    # vs. one FeatureBuilder per vehicle fed point by point (a fresh one
+    # after a gap of more than idle_s, as the service's store would; a
+    # repeated fix gets the previous answer, as from the prediction cache)
+    vcol, tcol, latcol, loncol = columns
+    df = next(read_chunks(src, columns, n))
+    t = _to_ns(df[tcol])
+    vehicle = df[vcol].to_numpy()
+    lat, lon = df[latcol].to_numpy(np.float64), df[loncol].to_numpy(np.float64)
+
+    trips = TripFeatures(idle_s)
+    bulk = np.full((len(df), N_FEATURES), np.nan)
+    for a in range(0, len(df), chunk_rows):
+        sl = slice(a, a + chunk_rows)
+        order, X, ready = trips.add_chunk(vehicle[sl], t[sl], lat[sl], lon[sl])
+        bulk[a + order[ready]] = X[ready]
+
+    ref = np.full((len(df), N_FEATURES), np.nan)
+    builders: dict = {}
+    last: dict = {}
+    idle_ns = None if idle_s is None else int(idle_s * 1e9)
+    for i in np.lexsort((np.arange(len(df)), t, pd.factorize(vehicle)[0])):
+        p = last.get(vehicle[i])
+        if p is not None and (t[p], lat[p], lon[p]) == (t[i], lat[i], lon[i]):
+            ref[i] = ref[p]
+            continue
+        if idle_ns is not None and p is not None and t[i] - t[p] > idle_ns:
+            del builders[vehicle[i]]
+        last[vehicle[i]] = i
+        fb = builders.setdefault(vehicle[i], FeatureBuilder())
+        fb.add_point(lat[i], lon[i], pd.Timestamp(t[i]).to_pydatetime())
+        if len(fb) >= 2:
+            fb.features(out=ref[i])
+
+    if not np.array_equal(np.isnan(bulk), np.isnan(ref)):
+        raise SystemExit("bulk and FeatureBuilder disagree on which points are scored")
+    ok = ~np.isnan(ref)
+    diff = np.abs(bulk[ok] - ref[ok]) / np.maximum(1.0, np.abs(ref[ok]))
+    return float(diff.max()) if len(diff) else 0.0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Score stored GPS history with the current model")
+    ap.add_argument("src", help="CSV file, or Parquet/Arrow file or directory")
+    ap.add_argument("--out", default="scored", help="output directory of part-NNN.parquet")
+    ap.add_argument("--predictor", default="fused",
+                    choices=("fused", "ensemble", "cascade", "student", "single"))
+    ap.add_argument("--bundle-root", default=BUNDLE_ROOT)
+    ap.add_argument("--version", default=None, help="bundle version (default: CURRENT)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="scoring processes, vehicles sharded by vehicle_id")
+    ap.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    ap.add_argument("--columns", default=",".join(COLUMNS),
+                    help="input names of vehicle_id,timestamp,latitude,longitude")
+    ap.add_argument("--idle-s", type=float, default=IDLE_S,
+                    help="a gap longer than this starts a new track (default STATE_TTL_S); "
+                         "0 never splits")
+    ap.add_argument("--max-vehicles", type=int, default=MAX_VEHICLES,
+                    help="vehicles whose last points are kept between chunks")
+    ap.add_argument("--check", type=int, metavar="N", default=0,
+                    help="compare features of the first N points with FeatureBuilder and exit")
+    args = ap.parse_args(argv)
+    columns = tuple(args.columns.split(","))
+    if len(columns) != 4:
+        ap.error("--columns needs four names")
+    idle_s = args.idle_s or None
+
+    if args.check:
+        diff = check(args.src, args.check, min(args.chunk_rows, max(1, args.check // 3)), columns,
+                     idle_s)
+        print(f"{args.check} points: max relative feature difference vs FeatureBuilder {diff:.2e}")
+        return
+
+    t = time.perf_counter()
+    stats = score_file(args.src, args.out, args.predictor, args.bundle_root, args.version,
+                       args.workers, args.chunk_rows, columns, idle_s, args.max_vehicles)
+    total = time.perf_counter() - t
+    rows = sum(s["rows"] for s in stats)
+    for s in stats:
+        print(f"  {s['path']}: {s['rows']:,} points, {s['vehicles']:,} vehicles carried "
+              f"({s['evicted_idle']:,} expired, {s['evicted_lru']:,} dropped)  "
+              f"(features {s['features_s']:.1f} s, predict {s['predict_s']:.1f} s, "
+              f"write {s['write_s']:.1f} s)")
+    print(f"{rows:,} points in {total:.1f} s = {rows / total * 60:,.0f} points/min "
+          f"on {args.workers} worker(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import threading
+from typing import Optional, Sequence
+
+import numpy as np
+
+# ─── Constant-memory drift sketches ──────────────────────────────────
+# The training script bins every model input at BINS quantiles of the
+# held-out test split, and the bundle ships those edges with the
+# reference count of every bin (drift_reference.json), plus the class
+# mix the model predicts on those rows. The service drops each
+# scored row into the same bins — one comparison against a (features ×
+# edges) matrix and one bincount, whatever the traffic — and keeps two
+# rotating windows of `window` rows, so the live distribution covers the
+# last window … 2 × window rows in a fixed (features × bins) array.
+#
+# Bins per feature: BINS quantile bins (fewer where the reference has
+# repeated values, e.g. straightness = 0), then one for NaN (head_var_*
+# of a track's first point). From the binned counts:
+#   psi  Σ (live - ref) · ln(live / ref) over bin shares (ε-smoothed);
+#        < 0.1 stable, 0.1 – 0.25 moderate, > 0.25 drifted (rule of thumb)
+#   ks   largest gap between the two CDFs at the bin edges
+#   p50  medians, interpolated inside the bin (the ref min / max bound the
+#        outer bins)
+# The thresholds assume the reference looks like live traffic. A
+# class-balanced training table (generateTelemetry's single-vehicle
+# output) over-represents the rare events, and the features that follow
+# them, against a real fleet: PSI then sits above PSI_WARN even with no
+# drift. Such a reference is marked class_balanced, and /drift reports
+# it; train on unbalanced data (fleet mode) for alerts that mean drift.
+BINS      = 20
+EPS       = 1e-4
+PSI_WARN  = 0.1
+PSI_ALERT = 0.25
+
+
+def _binned(X: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    # bin index of every value: #edges below it (edges end in an inf column,
+    # so the first edge not below it exists), NaN → last bin
+    X = np.asarray(X, dtype=np.float64)
+    idx = (X[:, :, None] > edges[None, :, :]).argmin(axis=2)
+    idx[np.isnan(X)] = edges.shape[1]
+    return idx
+
+
+def _count(X: np.ndarray, edges: np.ndarray, chunk: int = 65_536) -> np.ndarray:
+    n_feat, n_bins = edges.shape[0], edges.shape[1] + 1
+    offsets = np.arange(n_feat) * n_bins
+    counts = np.zeros(n_feat * n_bins, dtype=np.int64)
+    for a in range(0, len(X), chunk):
+        flat = (_binned(X[a:a + chunk], edges) + offsets).ravel()
+        counts += np.bincount(flat, minlength=len(counts))
+    return counts.reshape(n_feat, n_bins)
+
+
+def build_reference(X, pred_codes, classes: Sequence[str], columns: Sequence[str],
+                    bins: int = BINS, class_balanced: bool = False) -> dict:
+    # JSON-ready reference sketch of the features X and of the model's
+    # predicted classes (codes into `classes`) for the same rows
+    X = np.asarray(X, dtype=np.float64)
+    qs = np.nanquantile(X, np.linspace(0, 1, bins + 1), axis=0).T      # (features, bins + 1)
+    edges = np.full((X.shape[1], bins), np.inf)
+    for j, q in enumerate(qs):
+        inner = np.unique(q[1:-1])
+        edges[j, :len(inner)] = inner
+    return {"bins": bins,
+            "columns": list(columns),
+            "edges": [[float(e) for e in row if np.isfinite(e)] for row in edges],
+            "min": [float(v) for v in qs[:, 0]],
+            "max": [float(v) for v in qs[:, -1]],
+            "counts": _count(X, edges).tolist(),
+            "classes": [str(c) for c in classes],
+            "class_counts": np.bincount(np.asarray(pred_codes),
+                                        minlength=len(classes)).tolist(),
+            "class_balanced": bool(class_balanced)}
+
+
+def _shares(counts: np.ndarray) -> np.ndarray:
+    total = counts.sum(axis=-1, keepdims=True)
+    p = counts / np.maximum(total, 1)
+    p = np.maximum(p, EPS)
+    return p / p.sum(axis=-1, keepdims=True)
+
+
+def psi(ref: np.ndarray, live: np.ndarray) -> np.ndarray:
+    p, q = _shares(ref), _shares(live)
+    return ((q - p) * np.log(q / p)).sum(axis=-1)
+
+
+def ks(ref: np.ndarray, live: np.ndarray) -> np.ndarray:
+    p = ref / np.maximum(ref.sum(axis=-1, keepdims=True), 1)
+    q = live / np.maximum(live.sum(axis=-1, keepdims=True), 1)
+    return np.abs(np.cumsum(q - p, axis=-1)).max(axis=-1)
+
+
+def _median(counts: np.ndarray, edges: list, lo: float, hi: float) -> Optional[float]:
+    n = counts[:-1].sum()                    # NaN bin excluded
+    if n == 0:
+        return None
+    bounds = [lo] + edges + [hi]
+    used = counts[:len(bounds) - 1]
+    cum = np.cumsum(used)
+    b = int(np.searchsorted(cum, n / 2))
+    before = cum[b - 1] if b else 0
+    frac = (n / 2 - before) / max(used[b], 1)
+    return float(bounds[b] + frac * (bounds[b + 1] - bounds[b]))
+
+
+def report(reference: dict, live: dict) -> dict:
+    # per-feature and class-mix divergence of live counts (DriftMonitor.counts())
+    # from the reference; features sorted by psi, worst first
+    ref_f = np.asarray(reference["counts"])
+    live_f = np.asarray(live["features"])
+    f_psi, f_ks = psi(ref_f, live_f), ks(ref_f, live_f)
+    features = {}
+    for j in np.argsort(-f_psi):
+        edges = reference["edges"][j]
+        lo, hi = reference["min"][j], reference["max"][j]
+        features[reference["columns"][j]] = {
+            "psi": float(f_psi[j]),
+            "ks": float(f_ks[j]),
+            "nan_rate": float(live_f[j, -1] / max(live_f[j].sum(), 1)),
+            "nan_rate_ref": float(ref_f[j, -1] / max(ref_f[j].sum(), 1)),
+            "p50": _median(live_f[j], edges, lo, hi),
+            "p50_ref": _median(ref_f[j], edges, lo, hi),
+        }
+    ref_c = np.asarray(reference["class_counts"])
+    live_c = np.asarray(live["classes"])
+    worst = float(f_psi.max()) if len(f_psi) else 0.0
+    return {
+        "rows": int(live["rows"]),
+        "status": ("insufficient_data" if live["rows"] < 10 * reference["bins"] else
+                   "drifted" if worst > PSI_ALERT else
+                   "moderate" if worst > PSI_WARN else "stable"),
+        "max_psi": worst,
+        "reference_class_balanced": bool(reference.get("class_balanced", False)),
+        "classes": {
+            "psi": float(psi(ref_c, live_c)),
+            "share": {c: float(s) for c, s in zip(reference["classes"],
+                                                 live_c / max(live_c.sum(), 1))},
+            "share_ref": {c: float(s) for c, s in zip(reference["classes"],
+                                                     ref_c / max(ref_c.sum(), 1))},
+        },
+        "features": features,
+    }
+
+
+def merge(lives: Sequence[dict]) -> dict:
+    # counts of several monitors (one per worker process) as one
+    return {"rows": sum(l["rows"] for l in lives),
+            "features": np.sum([l["features"] for l in lives], axis=0).tolist(),
+            "classes": np.sum([l["classes"] for l in lives], axis=0).tolist()}
+
+
+class DriftMonitor:
+    def __init__(self, reference: dict, window: int = 50_000):
+        self.reference = reference
+        self.window = window
+        n_feat = len(reference["columns"])
+        n_bins = reference["bins"] + 1                       # + NaN bin
+        self._edges = np.full((n_feat, reference["bins"]), np.inf)
+        for j, row in enumerate(reference["edges"]):
+            self._edges[j, :len(row)] = row
+        self._offsets = np.arange(n_feat) * n_bins
+        self._size = n_feat * n_bins
+        self._shape = (n_feat, n_bins)
+        n_class = len(reference["classes"])
+        # [previous window, current window]
+        self._feat = [np.zeros(self._size, dtype=np.int64) for _ in range(2)]
+        self._cls = [np.zeros(n_class, dtype=np.int64) for _ in range(2)]
+        self._rows = [0, 0]
+        self._lock = threading.Lock()
+
+    def update(self, X: np.ndarray, codes: np.ndarray) -> None:
+        # X: scored feature rows, codes: their predicted class indices
+        flat = (_binned(X, self._edges) + self._offsets).ravel()
+        with self._lock:
+            if self._rows[1] >= self.window:
+                self._feat = [self._feat[1], np.zeros(self._size, dtype=np.int64)]
+                self._cls = [self._cls[1], np.zeros_like(self._cls[1])]
+                self._rows = [self._rows[1], 0]
+            feat, cls = self._feat[1], self._cls[1]
+            if len(X) == 1:
+                feat[flat] += 1                  # one row: every index distinct
+                cls[codes[0]] += 1
+            else:
+                feat += np.bincount(flat, minlength=self._size)
+                cls += np.bincount(codes, minlength=len(cls))
+            self._rows[1] += len(X)
+
+    def counts(self) -> dict:
+        with self._lock:
+            return {"rows": sum(self._rows),
+                    "features": (self._feat[0] + self._feat[1]).reshape(self._shape).tolist(),
+                    "classes": (self._cls[0] + self._cls[1]).tolist()}
+
+    def report(self) -> dict:
+        return report(self.reference, self.counts())
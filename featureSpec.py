@@ -0,0 +1,438 @@
+import json
+import math
+import pathlib
+import argparse
+from typing import NamedTuple, Optional, Sequence
+
+import numpy as np
+
+# ─── Feature specification ───────────────────────────────────────────
+# Every model input is declared once below. Two executors are compiled
+# from the declaration:
+#   - batch_features(): whole arrays at a time (telemetry generation,
+#     bulk scoring), every window as shifted numpy slices;
+#   - PLAN, consumed by vehicleState.FeatureBuilder: O(1) running sums /
+#     sliding Welford stats per window, updated point by point (serving).
+# The column order is pinned by feature_manifest.json; the training data,
+# the bundles and both executors are checked against it, and
+# `python featureSpec.py --check N` runs the parity checks.
+R_EARTH = 6_371_000.0
+WINDOWS = (2, 4, 8)
+DAY     = 86_400
+MANIFEST_PATH = pathlib.Path(__file__).with_name("feature_manifest.json")
+
+# Per-point series the features are computed from (besides lat / lon):
+#   acc, jerk   acceleration and its derivative
+#   dist        haversine distance from the previous point, 0 for the first
+#   hc          heading change from the previous point, wrapped to [-180, 180)
+#   tod         seconds since midnight of the point's timestamp
+SOURCES = ("acc", "jerk", "dist", "hc", "tod")
+
+
+class Windowed(NamedTuple):
+    # one column per window, "<name>_<w>s", over the last w points of the
+    # track (fewer at its start)
+    name: str
+    source: str
+    stat: str               # mean | sum | var (ddof=1, NaN for one point) | straightness
+
+
+class Point(NamedTuple):
+    name: str
+    source: str
+    fn: str = "value"       # value | day_sin | day_cos
+
+
+STATS = ("mean", "sum", "var", "straightness")
+POINT_FNS = ("value", "day_sin", "day_cos")
+
+# Blocks of adjacent columns; a block of Windowed features repeats for
+# every window, windows outermost. This is telemetry.csv's layout.
+FEATURE_SPEC = (
+    (Windowed("acc_mean", "acc", "mean"),
+     Windowed("jerk_mean", "jerk", "mean"),
+     Windowed("dist_sum", "dist", "sum"),
+     Windowed("straightness", "dist", "straightness")),     # line of sight / path
+    (Point("heading_change", "hc"),),
+    (Windowed("head_mean", "hc", "mean"),
+     Windowed("head_var", "hc", "var")),
+    (Point("tod_sin", "tod", "day_sin"),
+     Point("tod_cos", "tod", "day_cos")),
+)
+
+
+class Column(NamedTuple):
+    name: str
+    feature: object         # the Windowed / Point it comes from
+    window: Optional[int]
+
+
+def _layout() -> tuple:
+    cols = []
+    for block in FEATURE_SPEC:
+        if isinstance(block[0], Windowed):
+            cols += [Column(f"{f.name}_{w}s", f, w) for w in WINDOWS for f in block]
+        else:
+            cols += [Column(f.name, f, None) for f in block]
+    for c in cols:
+        f = c.feature
+        if f.source not in SOURCES:
+            raise ValueError(f"{c.name}: unknown source {f.source!r}")
+        if isinstance(f, Windowed) and f.stat not in STATS:
+            raise ValueError(f"{c.name}: unknown stat {f.stat!r}")
+        if isinstance(f, Windowed) and f.stat == "straightness" and f.source != "dist":
+            raise ValueError(f"{c.name}: straightness is a ratio of distances")
+        if isinstance(f, Point) and f.fn not in POINT_FNS:
+            raise ValueError(f"{c.name}: unknown point function {f.fn!r}")
+    names = [c.name for c in cols]
+    if len(set(names)) != len(names):
+        raise ValueError("duplicate feature names in FEATURE_SPEC")
+    return tuple(cols)
+
+
+LAYOUT          = _layout()
+FEATURE_COLUMNS = tuple(c.name for c in LAYOUT)
+N_FEATURES      = len(FEATURE_COLUMNS)
+COLUMN_INDEX    = {c: i for i, c in enumerate(FEATURE_COLUMNS)}
+
+
+# ─── Geometry ────────────────────────────────────────────────────────
+def haversine_scalar(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    l1, l2 = math.radians(lat1), math.radians(lat2)
+    dphi = l2 - l1
+    dlambda = math.radians(lon2 - lon1)
+    a = (math.sin(dphi / 2) ** 2 +
+         math.cos(l1) * math.cos(l2) * math.sin(dlambda / 2) ** 2)
+    return 2 * R_EARTH * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def bearing_deg(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    y = math.sin(math.radians(lon2 - lon1)) * math.cos(math.radians(lat2))
+    x = (math.cos(math.radians(lat1)) * math.sin(math.radians(lat2))
+         - math.sin(math.radians(lat1)) * math.cos(math.radians(lat2))
+           * math.cos(math.radians(lon2 - lon1)))
+    return (math.degrees(math.atan2(y, x)) + 360) % 360
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    l1, l2 = np.radians(lat1), np.radians(lat2)
+    dphi = l2 - l1
+    dlambda = np.radians(lon2 - lon1)
+    a = (np.sin(dphi / 2) ** 2 +
+         np.cos(l1) * np.cos(l2) * np.sin(dlambda / 2) ** 2)
+    return 2 * R_EARTH * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def bearing(lat1, lon1, lat2, lon2):
+    l1, l2 = np.radians(lat1), np.radians(lat2)
+    dlambda = np.radians(lon2 - lon1)
+    y = np.sin(dlambda) * np.cos(l2)
+    x = np.cos(l1) * np.sin(l2) - np.sin(l1) * np.cos(l2) * np.cos(dlambda)
+    return (np.degrees(np.arctan2(y, x)) + 360) % 360
+
+
+# ─── Vectorised executor ─────────────────────────────────────────────
+# Arrays hold one or more tracks, each track's points contiguous and in
+# time order; pos[i] is point i's index in its track's whole history.
+# Windows are clipped where pos says the track starts, so a chunk only
+# needs the last max(WINDOWS) - 1 points of the previous one prepended
+# (with their positions) to see exactly the same points.
+def shift(x, k, pos, fill=0.0):
+    # x[i - k] where point i has at least k earlier points in its track
+    out = np.full_like(x, fill)
+    out[k:] = x[:-k]
+    out[pos < k] = fill
+    return out
+
+
+def rolling_sum(x, pos, w):
+    s = x.copy()
+    for k in range(1, w):
+        s += shift(x, k, pos)
+    return s
+
+
+def track_positions(n: int, start: int = 0) -> np.ndarray:
+    return np.arange(start, start + n, dtype=np.int64)
+
+
+def batch_features(pts: dict, pos: Optional[np.ndarray] = None, rows=None,
+                   columns: Optional[Sequence[str]] = None) -> np.ndarray:
+    # pts: "lat", "lon" and the SOURCES series the columns need, as
+    # equal-length arrays; pos defaults to a single track starting at the
+    # first point. Returns the feature rows of `rows` (a mask or slice,
+    # default all points), all FEATURE_COLUMNS or just `columns`, in order.
+    lat, lon = pts["lat"], pts["lon"]
+    n = len(lat)
+    pos = track_positions(n) if pos is None else pos
+    rows = slice(None) if rows is None else rows
+    layout = LAYOUT if columns is None else [LAYOUT[COLUMN_INDEX[c]] for c in columns]
+    out = np.empty((len(np.arange(n)[rows]), len(layout)))
+
+    sums, counts = {}, {}
+
+    def count(w):
+        if w not in counts:
+            counts[w] = np.minimum(pos + 1, w)
+        return counts[w]
+
+    def total(src, w):
+        if (src, w) not in sums:
+            sums[src, w] = rolling_sum(pts[src], pos, w)
+        return sums[src, w]
+
+    for j, col in enumerate(layout):
+        f, w = col.feature, col.window
+        if isinstance(f, Point):
+            x = pts[f.source][rows]
+            if f.fn == "day_sin":
+                x = np.sin(2 * np.pi * x / DAY)
+            elif f.fn == "day_cos":
+                x = np.cos(2 * np.pi * x / DAY)
+            out[:, j] = x
+        elif f.stat == "sum":
+            out[:, j] = total(f.source, w)[rows]
+        elif f.stat == "mean":
+            out[:, j] = (total(f.source, w) / count(w))[rows]
+        elif f.stat == "var":
+            x, c = pts[f.source], count(w)
+            mean = total(f.source, w) / c
+            m2 = (x - mean) ** 2
+            for k in range(1, w):
+                dev = shift(x, k, pos, np.nan) - mean
+                m2 += np.where(pos >= k, dev * dev, 0.0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                out[:, j] = np.where(c > 1, m2 / (c - 1), np.nan)[rows]
+        else:                                               # straightness
+            path = total(f.source, w)
+            start = np.arange(n) - (count(w) - 1)
+            direct = haversine(lat[start], lon[start], lat, lon)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                out[:, j] = np.where(path == 0, 0.0, direct / path)[rows]
+    return out
+
+
+def point_kinematics(ext: dict, pos: np.ndarray, new: np.ndarray) -> None:
+    # Serving's per-point series from raw fixes, what FeatureBuilder.add_point
+    # derives: ext holds "lat", "lon", "t" (ns) for every point and "speed",
+    # "acc", "jerk", "dist", "head", "hc" — filled in place for the `new`
+    # points, already set for the rest. dt = 0 counts as 1 s; a track's
+    # first point gets zeros. Also sets "tod".
+    lat, lon, t = ext["lat"], ext["lon"], ext["t"]
+    first = new & (pos == 0)
+    step = new & (pos > 0)
+
+    dt = (t - shift(t, 1, pos, t[0])) / 1e9
+    dt[dt == 0] = 1.0
+    plat, plon = shift(lat, 1, pos, np.nan), shift(lon, 1, pos, np.nan)
+    with np.errstate(invalid="ignore"):
+        d = haversine(plat, plon, lat, lon)
+        head = bearing(plat, plon, lat, lon)
+    for name, values in (("dist", d), ("speed", d / dt), ("head", head)):
+        ext[name][step] = values[step]
+        ext[name][first] = 0.0
+    # each of these depends on the previous point's value of the one before
+    for name, src in (("acc", "speed"), ("jerk", "acc")):
+        values = (ext[src] - shift(ext[src], 1, pos)) / dt
+        ext[name][step] = values[step]
+        ext[name][first] = 0.0
+    raw = ext["head"] - shift(ext["head"], 1, pos)
+    ext["hc"][step] = ((raw + 180) % 360 - 180)[step]
+    ext["hc"][first] = 0.0
+    ext["tod"] = ((t // 1_000_000_000) % DAY).astype(np.float64)
+
+
+# ─── Incremental plan ────────────────────────────────────────────────
+# What FeatureBuilder keeps per window and how each column is read off
+# it. A source with a var column gets a sliding Welford mean / M2 (its
+# mean column reads the Welford mean); other mean / sum / straightness
+# sources get a running sum; straightness also counts non-zero distances.
+OP_MEAN, OP_SUM, OP_STRAIGHT, OP_WMEAN, OP_WVAR = range(5)
+
+
+class IncrementalPlan(NamedTuple):
+    sum_sources: tuple      # running window sum, per source
+    nz_sources: tuple       # running count of non-zero values
+    var_sources: tuple      # sliding Welford mean / M2
+    window_ops: tuple       # per window: ((column, op, index into its stat list), ...)
+    point_ops: tuple        # ((column, source, fn), ...)
+
+
+def _plan() -> IncrementalPlan:
+    windowed = [c for c in LAYOUT if isinstance(c.feature, Windowed)]
+    var_src = tuple(dict.fromkeys(c.feature.source for c in windowed
+                                  if c.feature.stat == "var"))
+    sum_src = tuple(dict.fromkeys(c.feature.source for c in windowed
+                                  if c.feature.source not in var_src
+                                  or c.feature.stat in ("sum", "straightness")))
+    nz_src = tuple(dict.fromkeys(c.feature.source for c in windowed
+                                 if c.feature.stat == "straightness"))
+    ops = []
+    for w in WINDOWS:
+        row = []
+        for j, c in enumerate(LAYOUT):
+            f = c.feature
+            if c.window != w:
+                continue
+            if f.stat == "var":
+                row.append((j, OP_WVAR, var_src.index(f.source)))
+            elif f.stat == "mean" and f.source in var_src:
+                row.append((j, OP_WMEAN, var_src.index(f.source)))
+            elif f.stat == "mean":
+                row.append((j, OP_MEAN, sum_src.index(f.source)))
+            elif f.stat == "sum":
+                row.append((j, OP_SUM, sum_src.index(f.source)))
+            else:
+                row.append((j, OP_STRAIGHT, sum_src.index(f.source)))
+        ops.append(tuple(row))
+    points = tuple((j, c.feature.source, c.feature.fn) for j, c in enumerate(LAYOUT)
+                   if isinstance(c.feature, Point))
+    return IncrementalPlan(sum_src, nz_src, var_src, tuple(ops), points)
+
+
+PLAN = _plan()
+
+
+# ─── Feature-order manifest ──────────────────────────────────────────
+def manifest() -> dict:
+    return {"windows": list(WINDOWS),
+            "columns": list(FEATURE_COLUMNS),
+            "spec": [[c.name, c.feature.source,
+                      getattr(c.feature, "stat", None) or c.feature.fn] for c in LAYOUT]}
+
+
+def check_layout(columns, where: str) -> None:
+    # raise if `columns` is not the model input layout, in order
+    columns = list(columns)
+    if columns != list(FEATURE_COLUMNS):
+        missing = [c for c in FEATURE_COLUMNS if c not in columns]
+        extra = [c for c in columns if c not in FEATURE_COLUMNS]
+        why = (f"missing {missing}, unexpected {extra}" if missing or extra
+               else "same names in another order")
+        raise ValueError(f"{where}: feature columns differ from featureSpec ({why})")
+
+
+def check_manifest(path=MANIFEST_PATH) -> None:
+    stored = json.loads(pathlib.Path(path).read_text(encoding="utf-8"))
+    check_layout(stored["columns"], str(path))
+    if stored != manifest():
+        raise ValueError(f"{path}: feature definitions changed but the column order "
+                         f"did not; rerun with --write-manifest if that is intended")
+
+
+# ─── Parity checks ───────────────────────────────────────────────────
+def _tracks(n_vehicles: int, n_points: int, seed: int = 0) -> list:
+    # (lat, lon, t ns) per vehicle: simulated driving plus the awkward
+    # cases — repeated timestamps, standing still, one-point tracks
+    from generateTelemetry import simulate_kinematics
+    tracks = []
+    for v in range(n_vehicles):
+        rng = np.random.default_rng([seed, v])
+        n = 1 if v == 0 else n_points
+        _, _, _, lat, lon = simulate_kinematics(n, 1.0, 45.0 + rng.uniform(-.1, .1),
+                                                9.0 + rng.uniform(-.1, .1), rng=rng)
+        stop = rng.random(n) < 0.05
+        for i in np.flatnonzero(stop):
+            if i:
+                lat[i], lon[i] = lat[i - 1], lon[i - 1]
+        step = rng.choice([0, 1, 1, 1, 2], size=n) * 1_000_000_000
+        t = 1_735_718_400_000_000_000 + int(rng.integers(0, DAY)) * 1_000_000_000 + step.cumsum()
+        tracks.append((lat, lon, t))
+    return tracks
+
+
+def incremental_features(lat, lon, t) -> np.ndarray:
+    # one FeatureBuilder fed point by point; NaN rows where /predict would
+    # not score (the first point)
+    import datetime
+    from vehicleState import FeatureBuilder
+    fb = FeatureBuilder()
+    X = np.full((len(lat), N_FEATURES), np.nan)
+    epoch = datetime.datetime(1970, 1, 1)
+    for i in range(len(lat)):
+        fb.add_point(float(lat[i]), float(lon[i]),
+                     epoch + datetime.timedelta(microseconds=int(t[i]) // 1000))
+        if len(fb) >= 2:
+            fb.features(out=X[i])
+    return X
+
+
+def vectorised_features(lat, lon, t, chunk: int) -> np.ndarray:
+    # batch_features over chunks of one track, carrying the last points
+    keep = max(WINDOWS) - 1
+    X = np.full((len(lat), N_FEATURES), np.nan)
+    derived = ("speed", "acc", "jerk", "dist", "head", "hc")
+    hist = {name: np.empty(0) for name in ("lat", "lon", "t") + derived}
+    hist["t"] = hist["t"].astype(np.int64)
+    for a in range(0, len(lat), chunk):
+        b = min(a + chunk, len(lat))
+        h = len(hist["lat"])
+        ext = {name: np.concatenate([hist[name], v]) for name, v in
+               (("lat", lat[a:b]), ("lon", lon[a:b]), ("t", t[a:b]))}
+        for name in derived:
+            ext[name] = np.concatenate([hist[name], np.zeros(b - a)])
+        pos = track_positions(h + b - a, a - h)
+        new = pos >= a
+        point_kinematics(ext, pos, new)
+        rows = new & (pos >= 1)
+        X[pos[rows]] = batch_features(ext, pos, rows)
+        hist = {name: ext[name][-keep:] for name in hist}
+    return X
+
+
+def check(n_points: int, chunk: int, rtol: float = 1e-9, bundle_root: Optional[str] = None):
+    check_manifest()
+    print(f"layout: {N_FEATURES} columns match {MANIFEST_PATH.name}")
+
+    worst = 0.0
+    for lat, lon, t in _tracks(8, n_points):
+        a = incremental_features(lat, lon, t)
+        b = vectorised_features(lat, lon, t, chunk)
+        if not np.array_equal(np.isnan(a), np.isnan(b)):
+            raise SystemExit("executors disagree on missing values")
+        ok = ~np.isnan(a)
+        if ok.any():
+            rel = np.abs(a - b) / np.maximum(np.abs(a), 1.0)
+            for j in np.flatnonzero((np.where(ok, rel, 0) > rtol).any(axis=0)):
+                raise SystemExit(f"{FEATURE_COLUMNS[j]} differs by "
+                                 f"{np.nanmax(rel[:, j]):.2e} > {rtol}")
+            worst = max(worst, float(rel[ok].max()))
+    print(f"executors: 8 tracks × {n_points} points, chunks of {chunk}: "
+          f"worst rel diff {worst:.1e}")
+
+    if bundle_root is not None:
+        from modelBundle import ModelBundle
+        bundle = ModelBundle.current(bundle_root)
+        if bundle is None:
+            print(f"bundle: none under {bundle_root}")
+        else:
+            check_layout(bundle.feature_order, f"bundle {bundle.version}")
+            names = bundle.predictor("fused").feature_names
+            if names is not None:
+                check_layout(names, f"bundle {bundle.version} booster")
+            print(f"bundle {bundle.version}: feature order matches")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Feature spec: layout manifest and executor parity")
+    ap.add_argument("--check", type=int, metavar="N", default=0,
+                    help="compare both executors on synthetic tracks of N points")
+    ap.add_argument("--chunk", type=int, default=0, help="vectorised chunk size (default N/3)")
+    ap.add_argument("--bundle-root", default="artifacts",
+                    help="also check the current bundle's feature order")
+    ap.add_argument("--write-manifest", action="store_true",
+                    help=f"rewrite {MANIFEST_PATH.name} from FEATURE_SPEC")
+    args = ap.parse_args(argv)
+
+    if args.write_manifest:
+        MANIFEST_PATH.write_text(json.dumps(manifest(), indent=2) + "\n", encoding="utf-8")
+        print(f"Wrote {MANIFEST_PATH}")
+    if args.check:
+        check(args.check, args.chunk or max(1, args.check // 3), bundle_root=args.bundle_root)
+    if not args.check and not args.write_manifest:
+        for i, c in enumerate(FEATURE_COLUMNS):
+            print(f"{i:3d}  {c}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import threading
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+import xgboost as xgb
+
+# ─── Quantized fold matrices, shared by every trial and stage ────────
+# XGBClassifier.fit re-ingests its pandas slices and re-sketches the
+# histogram cut points on every call. Here each CV fold is turned into a
+# QuantileDMatrix once per (fold, max_bin) — class-weight sample weights
+# attached — and every later xgb.train on that fold (all Optuna trials,
+# then the top-K ensemble, which uses the same split) reuses it. The
+# validation matrix is built with ref=train so it shares the fold's cuts.
+DEFAULT_MAX_BIN = 256
+
+# Optuna parameter names (kept short in the study) → native XGBoost names
+_NATIVE_NAMES = {
+    "lr"    : "eta",
+    "col_bt": "colsample_bytree",
+    "mcw"   : "min_child_weight",
+    "grow"  : "grow_policy",
+}
+
+
+def booster_params(params: dict, n_class: int, seed: int,
+                   nthread: int = -1) -> Tuple[dict, int]:
+    # (native params, num_boost_round) for a set of study / trial params
+    p = {_NATIVE_NAMES.get(k, k): v for k, v in params.items()}
+    rounds = int(p.pop("n_estimators"))
+    p.update(tree_method="hist",
+             objective="multi:softprob",
+             num_class=n_class,
+             eval_metric="mlogloss",
+             seed=seed,
+             nthread=nthread)
+    p.setdefault("max_bin", DEFAULT_MAX_BIN)
+    return p, rounds
+
+
+def weighted_matrix(X, y, row_w, max_bin: int = DEFAULT_MAX_BIN,
+                    ref: Optional[xgb.DMatrix] = None) -> xgb.QuantileDMatrix:
+    y = np.asarray(y)
+    return xgb.QuantileDMatrix(X, y, weight=None if row_w is None else row_w[y],
+                               max_bin=max_bin, ref=ref)
+
+
+def fit_booster(params: dict, rounds: int, dtrain: xgb.DMatrix,
+                dvalid: Optional[xgb.DMatrix] = None,
+                early_stopping_rounds: Optional[int] = None) -> xgb.Booster:
+    # Trained booster, trimmed to best_iteration when early stopping kicked
+    # in, so predictions need no iteration_range and the number of trees
+    # kept is booster.num_boosted_rounds().
+    booster = xgb.train(params, dtrain, num_boost_round=rounds,
+                        evals=[(dvalid, "valid")] if dvalid is not None else (),
+                        early_stopping_rounds=early_stopping_rounds if dvalid is not None else None,
+                        verbose_eval=False)
+    if early_stopping_rounds and dvalid is not None:
+        best = booster.best_iteration
+        if best + 1 < booster.num_boosted_rounds():
+            booster = booster[: best + 1]
+    return booster
+
+
+class Fold:
+    def __init__(self, dtrain, dvalid, X_valid, y_valid, valid_idx):
+        self.dtrain = dtrain
+        self.dvalid = dvalid
+        self.X_valid = X_valid            # raw rows, for inplace_predict
+        self.y_valid = y_valid
+        self.valid_idx = valid_idx
+
+
+class FoldMatrices:
+    def __init__(self, X, y, row_w, folds: Iterable):
+        # X: DataFrame (its column names end up in the boosters),
+        # row_w: per-class weight, indexed by the label codes in y
+        self.X = X
+        self.y = np.asarray(y)
+        self.row_w = row_w
+        self.folds = [(np.asarray(tr), np.asarray(va)) for tr, va in folds]
+        self._cache = {}
+        self._lock = threading.Lock()     # trials may run on several threads
+
+    def __len__(self) -> int:
+        return len(self.folds)
+
+    def get(self, k: int, max_bin: int = DEFAULT_MAX_BIN) -> Fold:
+        with self._lock:
+            fold = self._cache.get((k, max_bin))
+            if fold is None:
+                fold = self._cache[(k, max_bin)] = self._build(k, max_bin)
+            return fold
+
+    def _build(self, k: int, max_bin: int) -> Fold:
+        tr, va = self.folds[k]
+        dtrain = weighted_matrix(self.X.iloc[tr], self.y[tr], self.row_w, max_bin)
+        X_va, y_va = self.X.iloc[va], self.y[va]
+        dvalid = weighted_matrix(X_va, y_va, None, max_bin, ref=dtrain)
+        return Fold(dtrain, dvalid, X_va, y_va, va)
+
+    def train(self, k: int, params: dict, rounds: int,
+              early_stopping_rounds: Optional[int] = None) -> Tuple[xgb.Booster, Fold]:
+        fold = self.get(k, params.get("max_bin", DEFAULT_MAX_BIN))
+        booster = fit_booster(params, rounds, fold.dtrain,
+                              fold.dvalid if early_stopping_rounds else None,
+                              early_stopping_rounds)
+        return booster, fold
@@ -1,18 +1,436 @@
+import os
+import time
+import argparse
+import tempfile
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
 
+from featureSpec import (WINDOWS, FEATURE_COLUMNS, COLUMN_INDEX, batch_features,
+                         track_positions, haversine)
+
+R_EARTH = 6_371_000
+SEG_LEN = 500                       # meters per road "zone"
+ZONE_LIMITS = [10, 15, 20, 25]
+ZONE_P = [.2, .3, .3, .2]
+CLASSES = ["HardAccel", "HardBrake", "HighJerk", "Normal", "Speeding"]
+_NORMAL = CLASSES.index("Normal")
+
+# telemetry.csv layout (minus EventType) is featureSpec's; every column but
+# heading_change gets the 20 % noise, drawn in column order
+OUTPUT_COLUMNS = list(FEATURE_COLUMNS)
+NOISY_COLUMNS = [c for c in OUTPUT_COLUMNS if c != "heading_change"]
+_COL = COLUMN_INDEX
+_HEAD_VAR = [c for c in OUTPUT_COLUMNS if c.startswith("head_var_")]
 
-def haversine_dist(lat1, lon1, lat2, lon2):
-    R = 6_371_000.0
-    l1, l2 = np.deg2rad(lat1), np.deg2rad(lat2)
-    dphi = l2 - l1
-    dlambda = np.deg2rad(lon2 - lon1)
-    a = (np.sin(dphi / 2) ** 2 +
-         np.cos(l1) * np.cos(l2) * np.sin(dlambda / 2) ** 2)
-    return 2 * R * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+haversine_dist = haversine
 
 
 def make_windows(df, w):
+    # the acc / jerk / dist / straightness columns of window w as a frame
+    cols = [f"{name}_{w}s" for name in ("acc_mean", "jerk_mean", "dist_sum", "straightness")]
+    pts = {"lat": df["lat"].to_numpy(), "lon": df["lon"].to_numpy(),
+           "acc": df["acceleration"].to_numpy(), "jerk": df["jerk"].to_numpy(),
+           "dist": df["dist"].to_numpy()}
+    return pd.DataFrame(batch_features(pts, columns=cols), index=df.index, columns=cols)
+
+
+# ─── Random streams ──────────────────────────────────────────────────
+# The original generator drew everything from the global legacy RNG, one
+# whole column at a time: speeds, heading changes, zone limits, the two
+# sensor-noise columns, then mask + noise per feature column, then the four
+# event thresholds. _plan replays that sequence once (drawing and throwing
+# values away, chunk by chunk) and keeps a RandomState positioned at the
+# start of every column, so each chunk can take its slice of every column
+# and get exactly the numbers the one-shot version used.
+def _fork(rs):
+    s = np.random.RandomState()
+    s.set_state(rs.get_state())
+    return s
+
+
+def _skip(draw, n, chunk):
+    for a in range(0, n, chunk):
+        draw(min(chunk, n - a))
+
+
+class _Plan:
+    # the original single vehicle
+    lat0, lon0, t0 = 45.0, 9.0, 0
+    speed_mean, speed_sd = 15, 5
+
+    def __init__(self, n, dt, seed, chunk):
+        rs = np.random.RandomState(seed)
+        self.speeds = _fork(rs)
+        _skip(rs.standard_normal, n, chunk)
+        self.headings = _fork(rs)
+        _skip(rs.standard_normal, n, chunk)
+
+        # zone count needs the total distance, so run the kinematics once
+        n_zones, state = 0, None
+        speeds_rs, headings_rs = _fork(self.speeds), _fork(self.headings)
+        for a in range(0, n, chunk):
+            k = _Kinematics(*_draw_motion(min(chunk, n - a), speeds_rs, headings_rs), dt, state)
+            zone = (k.cum_dist // SEG_LEN).astype(int)
+            prev = state.zone if state is not None else -1
+            n_zones += int((zone[0] != prev) + np.count_nonzero(np.diff(zone)))
+            state = k.carry(zone[-1])
+        self.zone_limits = rs.choice(ZONE_LIMITS, size=n_zones, p=ZONE_P)
+
+        self.acc_noise = _fork(rs)
+        _skip(rs.standard_normal, n, chunk)
+        self.jerk_noise = _fork(rs)
+        _skip(rs.standard_normal, n, chunk)
+
+        self.masks, self.noise = [], []
+        for _ in NOISY_COLUMNS:
+            self.masks.append(_fork(rs))
+            n_masked = 0
+            for a in range(0, n, chunk):
+                n_masked += int(np.count_nonzero(rs.random(min(chunk, n - a)) < 0.2))
+            self.noise.append(_fork(rs))
+            _skip(rs.standard_normal, n_masked, chunk)
+
+        self.th_brake = _fork(rs)
+        _skip(rs.standard_normal, n, chunk)
+        self.th_accel = _fork(rs)
+        _skip(rs.standard_normal, n, chunk)
+        self.th_jerk = _fork(rs)
+        _skip(rs.standard_normal, n, chunk)
+        self.overspeed = _fork(rs)
+
+
+class _VehiclePlan:
+    # One fleet vehicle: its own start point, clock offset, speed profile
+    # and speed-limit mix, and one Generator per column. Everything is
+    # spawned from the vehicle's SeedSequence, so a vehicle's rows do not
+    # depend on which process simulates it or on the chunk size.
+    def __init__(self, seq, n, dt):
+        streams = iter([np.random.default_rng(s) for s in seq.spawn(10 + 2 * len(NOISY_COLUMNS))])
+        profile = next(streams)
+        self.lat0 = 45.0 + profile.normal(0, 0.5)
+        self.lon0 = 9.0 + profile.normal(0, 0.5)
+        self.t0 = int(profile.integers(0, 86_400))
+        self.speed_mean = profile.uniform(8, 22)
+        self.speed_sd = profile.uniform(3, 7)
+        zone_p = profile.dirichlet(np.array(ZONE_P) * 10)
+        # enough zones for a vehicle flat out at the 60 m/s cap
+        self.zone_limits = next(streams).choice(ZONE_LIMITS, size=int(n * 60 * dt / SEG_LEN) + 2,
+                                                p=zone_p)
+        self.speeds, self.headings = next(streams), next(streams)
+        self.acc_noise, self.jerk_noise = next(streams), next(streams)
+        self.masks = [next(streams) for _ in NOISY_COLUMNS]
+        self.noise = [next(streams) for _ in NOISY_COLUMNS]
+        self.th_brake, self.th_accel = next(streams), next(streams)
+        self.th_jerk, self.overspeed = next(streams), next(streams)
+
+
+# ─── One chunk of the track ──────────────────────────────────────────
+class _Carry:
+    # last values of the previous chunk that the next one continues from
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+def _draw_motion(m, speeds_rs, headings_rs, speed_mean=15, speed_sd=5):
+    speeds = np.clip(speeds_rs.normal(speed_mean, speed_sd, size=m), 0, 60)
+    # Heading change - heavy vehicles wiggle more at low speed, less at high
+    heading_sigma = np.clip(30 - 0.4 * speeds, 5, 25)
+    return speeds, headings_rs.normal(0, heading_sigma)
+
+
+class _Kinematics:
+    def __init__(self, speeds, heading_changes, dt, prev=None, lat0=45.0, lon0=9.0):
+        if prev is None:
+            head_cum = np.cumsum(heading_changes)
+        else:
+            head_cum = np.cumsum(np.concatenate([[prev.head_cum], heading_changes]))[1:]
+        headings = np.mod(head_cum, 360)
+
+        # Integrate displacement on a sphere: each step is a local tangent
+        # offset, and a running sum over [previous position, steps...] adds
+        # them in the same order as the point-by-point loop
+        d = speeds * dt                      # meters in this step
+        br = np.deg2rad(headings)
+        dlat = np.rad2deg(d * np.cos(br) / R_EARTH)
+        if prev is None:
+            dlat[0] = lat0
+            lats = np.cumsum(dlat)
+            lat_prev = np.concatenate([[lat0], lats[:-1]])
+        else:
+            lats = np.cumsum(np.concatenate([[prev.lat], dlat]))[1:]
+            lat_prev = np.concatenate([[prev.lat], lats[:-1]])
+        dlon = np.rad2deg(d * np.sin(br) / (R_EARTH * np.cos(np.deg2rad(lat_prev))))
+        if prev is None:
+            dlon[0] = lon0
+            lons = np.cumsum(dlon)
+            lon_prev = np.concatenate([[np.nan], lons[:-1]])
+        else:
+            lons = np.cumsum(np.concatenate([[prev.lon], dlon]))[1:]
+            lon_prev = np.concatenate([[prev.lon], lons[:-1]])
+
+        if prev is None:
+            acc = np.concatenate([[0.0], np.diff(speeds)]) / dt
+            jerk = np.concatenate([[0.0], np.diff(acc)]) / dt
+            lat_prev[0] = np.nan
+            dist = haversine_dist(lats, lons, lat_prev, lon_prev)
+            dist[0] = 0.0
+            cum_dist = np.cumsum(dist)
+        else:
+            acc = np.diff(np.concatenate([[prev.speed], speeds])) / dt
+            jerk = np.diff(np.concatenate([[prev.acc], acc])) / dt
+            dist = haversine_dist(lats, lons, lat_prev, lon_prev)
+            cum_dist = np.cumsum(np.concatenate([[prev.cum_dist], dist]))[1:]
+
+        self.speeds, self.heading_changes = speeds, heading_changes
+        self.headings = headings
+        self.head_cum, self.lats, self.lons = head_cum, lats, lons
+        self.acc, self.jerk, self.dist, self.cum_dist = acc, jerk, dist, cum_dist
+
+    def carry(self, zone):
+        return _Carry(head_cum=self.head_cum[-1], lat=self.lats[-1], lon=self.lons[-1],
+                      speed=self.speeds[-1], acc=self.acc[-1],
+                      cum_dist=self.cum_dist[-1], zone=zone)
+
+
+def simulate_kinematics(n, dt=1.0, lat0=45.0, lon0=9.0, rng=np.random):
+    # rng: the np.random module (seeded by the caller) or a Generator
+    speeds, heading_changes = _draw_motion(n, rng, rng)
+    k = _Kinematics(speeds, heading_changes, dt, lat0=lat0, lon0=lon0)
+    return speeds, heading_changes, k.headings, k.lats, k.lons
+
+
+def _chunk(plan, m, dt, row0, prev, hist):
+    # Features and labels of rows row0 .. row0+m-1 (before balancing) as an
+    # (m, len(OUTPUT_COLUMNS)) array plus class codes. `prev` / `hist` carry
+    # the kinematics and the last points of the previous chunk.
+    k = _Kinematics(*_draw_motion(m, plan.speeds, plan.headings, plan.speed_mean, plan.speed_sd),
+                    dt, prev, plan.lat0, plan.lon0)
+    zone = (k.cum_dist // SEG_LEN).astype(int)
+    speed_limit = plan.zone_limits[zone]
+
+    acc = k.acc + plan.acc_noise.normal(0, 0.2, m)
+    jerk = k.jerk + plan.jerk_noise.normal(0, 0.2, m)
+
+    # windows run over [last points of the previous chunk, this chunk]
+    h = len(hist["lat"])
+    ext = {name: np.concatenate([hist[name], v]) for name, v in
+           (("lat", k.lats), ("lon", k.lons), ("acc", acc), ("jerk", jerk),
+            ("dist", k.dist), ("hc", k.heading_changes))}
+    step_ms = int(dt * 1000)
+    tod_sec = (np.arange(row0, row0 + m, dtype=np.int64) * step_ms // 1000 + plan.t0) % 86_400
+    ext["tod"] = np.concatenate([np.zeros(h), tod_sec])
+
+    X = batch_features(ext, track_positions(h + m, row0 - h), slice(h, None))
+    if row0 == 0 and m > 1:
+        for col in _HEAD_VAR:
+            X[0, _COL[col]] = X[1, _COL[col]]   # the one-point window is back-filled
+
+    for col, mask_rs, noise_rs in zip(NOISY_COLUMNS, plan.masks, plan.noise):
+        mask = mask_rs.random(m) < 0.2
+        X[mask, _COL[col]] += noise_rs.normal(0, 0.5, int(mask.sum()))
+
+    labels = _tag_events(plan, k.speeds, acc, jerk, speed_limit)
+
+    keep = max(WINDOWS) - 1
+    hist = {name: v[-keep:] for name, v in ext.items() if name != "tod"}
+    return X, labels, k.carry(zone[-1]), hist
+
+
+def _tag_events(plan, speed, acc, jerk, speed_limit):
+    ev = np.full(len(speed), _NORMAL, dtype=np.int8)
+
+    # Noise grows slightly with speed  → harder to “learn the rule”.
+    sigma_acc = 0.6 + 0.03 * speed
+    sigma_jerk = 0.6 + 0.03 * speed
+
+    th_brake = -3.47 + plan.th_brake.normal(0, sigma_acc)
+    th_accel = 3.47 + plan.th_accel.normal(0, sigma_acc)
+    th_jerk = 5.56 + plan.th_jerk.normal(0, sigma_jerk)
+    overspeed_ratio = 1.2 + plan.overspeed.normal(0, 0.08, len(speed))
+
+    ev[acc < th_brake] = CLASSES.index("HardBrake")
+    ev[(acc > th_accel) & (ev == _NORMAL)] = CLASSES.index("HardAccel")
+    ev[(np.abs(jerk) > th_jerk) & (ev == _NORMAL)] = CLASSES.index("HighJerk")
+    ev[((speed / (speed_limit + 1e-3)) > overspeed_ratio) & (ev == _NORMAL)] = \
+        CLASSES.index("Speeding")
+    return ev
+
+
+# ─── Whole pipeline, chunk by chunk ─────────────────────────────────
+def generate_telemetry(n=120_000, chunk_rows=1_000_000, dt=1.0, seed=42, tmp_dir=None,
+                       timings=None):
+    # Yields the balanced, shuffled telemetry table as DataFrames of at most
+    # chunk_rows rows. Raw rows go to a temporary memmap (~170 B/row on
+    # disk); RAM holds one chunk plus the int64 row ids the balancing
+    # sample/shuffle needs (8 B per balanced row).
+    timings = timings if timings is not None else {}
+    t = time.perf_counter()
+    plan = _Plan(n, dt, seed, chunk_rows)
+    timings["plan_s"] = time.perf_counter() - t
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        t = time.perf_counter()
+        X = np.lib.format.open_memmap(os.path.join(tmp, "rows.npy"), mode="w+",
+                                      dtype=np.float64, shape=(n, len(OUTPUT_COLUMNS)))
+        labels = np.lib.format.open_memmap(os.path.join(tmp, "labels.npy"), mode="w+",
+                                           dtype=np.int8, shape=(n,))
+        prev, hist = None, {name: np.empty(0) for name in
+                            ("lat", "lon", "acc", "jerk", "dist", "hc")}
+        for a in range(0, n, chunk_rows):
+            m = min(chunk_rows, n - a)
+            X[a:a + m], labels[a:a + m], prev, hist = _chunk(plan, m, dt, a, prev, hist)
+        timings["rows_s"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        rows = _balanced_order(labels, chunk_rows)
+        timings["balance_s"] = time.perf_counter() - t
+
+        names = np.array(CLASSES, dtype=object)
+        timings["gather_s"] = 0.0
+        for a in range(0, len(rows), chunk_rows):
+            t = time.perf_counter()
+            idx = rows[a:a + chunk_rows]
+            order = np.argsort(idx, kind="stable")    # read the memmap front to back
+            block = np.empty((len(idx), X.shape[1]))
+            block[order] = X[idx[order]]
+            df = pd.DataFrame(block, columns=OUTPUT_COLUMNS)
+            df["EventType"] = names[labels[idx]]
+            timings["gather_s"] += time.perf_counter() - t
+            yield df
+        del X, labels
+
+
+def _balanced_order(labels, chunk_rows):
+    # Same selection as subset.sample(min_x, random_state=42) per class and
+    # a final sample(frac=1, random_state=42): both are RandomState(42)
+    # choices over positions, so only row ids are needed, never the rows.
+    counts = np.zeros(len(CLASSES), dtype=np.int64)
+    for a in range(0, len(labels), chunk_rows):
+        counts += np.bincount(labels[a:a + chunk_rows], minlength=len(CLASSES))
+    min_x = int(min(counts[CLASSES.index("HardAccel")], counts[CLASSES.index("HardBrake")]))
+
+    picked = []
+    for code in range(len(CLASSES)):
+        members = np.flatnonzero(np.asarray(labels) == code)
+        sel = np.random.RandomState(42).choice(len(members), size=min_x,
+                                               replace=len(members) < min_x)
+        picked.append(members[sel])
+    rows = np.concatenate(picked)
+    return rows[np.random.RandomState(42).choice(len(rows), size=len(rows), replace=False)]
+
+
+def write_csv(chunks, path):
+    n = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        for i, df in enumerate(chunks):
+            df.to_csv(f, header=i == 0, index=False)
+            n += len(df)
+    return n
+
+
+# ─── Columnar output ─────────────────────────────────────────────────
+# float32 features and a dictionary-encoded label: ~80-115 B/row (zstd)
+# instead of ~400 B/row of CSV text, and no float parsing on load.
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+class ColumnarWriter:
+    def __init__(self, path, fmt="parquet", with_vehicle=False):
+        import pyarrow as pa
+        self._pa = pa
+        fields = [pa.field("vehicle_id", pa.int32())] if with_vehicle else []
+        fields += [pa.field(c, pa.float32()) for c in OUTPUT_COLUMNS]
+        fields.append(pa.field("EventType", pa.dictionary(pa.int8(), pa.string())))
+        self.schema = pa.schema(fields)
+        self._classes = pa.array(CLASSES)
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        elif fmt == "arrow":
+            import pyarrow.ipc as ipc
+            self._writer = ipc.new_file(path, self.schema,
+                                        options=ipc.IpcWriteOptions(compression="zstd"))
+        else:
+            raise ValueError(f"unknown format {fmt!r}, expected one of {sorted(FORMATS)}")
+        self.rows = 0
+
+    def write(self, X, labels, vehicle_id=None):
+        pa = self._pa
+        cols = [] if vehicle_id is None else [pa.array(np.full(len(X), vehicle_id, np.int32))]
+        cols += [pa.array(X[:, j].astype(np.float32)) for j in range(X.shape[1])]
+        cols.append(pa.DictionaryArray.from_arrays(pa.array(labels, pa.int8()), self._classes))
+        self._writer.write_table(pa.Table.from_arrays(cols, schema=self.schema))
+        self.rows += len(X)
+
+    def write_frame(self, df):
+        codes = pd.Categorical(df["EventType"], categories=CLASSES).codes
+        self.write(df[OUTPUT_COLUMNS].to_numpy(), codes)
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ─── Fleet mode ──────────────────────────────────────────────────────
+# M independent vehicles, each simulated in chunks from its own spawned
+# SeedSequence. Vehicles are grouped into fixed-size part files and the
+# parts are farmed out to a process pool; since neither the seeds nor the
+# grouping depend on the pool, any worker count writes the same files.
+# Fleet rows are written as simulated (time order per vehicle, no class
+# balancing); the trainer weights classes itself.
+def _vehicle_chunks(seq, n, dt, chunk_rows):
+    plan = _VehiclePlan(seq, n, dt)
+    prev, hist = None, {name: np.empty(0) for name in ("lat", "lon", "acc", "jerk", "dist", "hc")}
+    for a in range(0, n, chunk_rows):
+        X, labels, prev, hist = _chunk(plan, min(chunk_rows, n - a), dt, a, prev, hist)
+        yield X, labels
+
+
+def _write_part(path, fmt, vehicles, seqs, n, dt, chunk_rows):
+    t = time.perf_counter()
+    counts = np.zeros(len(CLASSES), dtype=np.int64)
+    with ColumnarWriter(path, fmt, with_vehicle=True) as out:
+        for vehicle_id, seq in zip(vehicles, seqs):
+            for X, labels in _vehicle_chunks(seq, n, dt, chunk_rows):
+                out.write(X, labels, vehicle_id)
+                counts += np.bincount(labels, minlength=len(CLASSES))
+    return out.rows, counts, time.perf_counter() - t
+
+
+def generate_fleet(out_dir, n_vehicles, rows_per_vehicle, fmt="parquet", workers=None,
+                   vehicles_per_file=None, chunk_rows=1_000_000, dt=1.0, seed=42):
+    os.makedirs(out_dir, exist_ok=True)
+    seqs = np.random.SeedSequence(seed).spawn(n_vehicles)
+    # ~2M rows per part file unless told otherwise
+    per_file = vehicles_per_file or max(1, 2_000_000 // rows_per_vehicle)
+    parts = [(os.path.join(out_dir, f"part-{k:05d}{FORMATS[fmt]}"), fmt,
+              list(range(a, min(a + per_file, n_vehicles))), seqs[a:a + per_file],
+              rows_per_vehicle, dt, min(chunk_rows, rows_per_vehicle))
+             for k, a in enumerate(range(0, n_vehicles, per_file))]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = [_write_part(*p) for p in parts]
+    else:
+        with ProcessPoolExecutor(workers, mp_context=mp.get_context("spawn")) as ex:
+            results = list(ex.map(_write_part, *zip(*parts)))
+    rows = sum(r[0] for r in results)
+    counts = sum(r[1] for r in results)
+    return rows, dict(zip(CLASSES, counts.tolist())), [p[0] for p in parts]
+
+
+# ─── Row-by-row reference (the original implementation) ─────────────
+# Kept only to check the vectorised generator against: python
+# generateTelemetry.py --check 20000
+def _make_windows_rowwise(df, w):
     out = pd.DataFrame(index=df.index)
 
     out[f"acc_mean_{w}s"] = df["acceleration"].rolling(w, 1).mean().bfill().ffill()
@@ -35,10 +453,8 @@ def make_windows(df, w):
     return out
 
 
-def tag_events(df):
+def _tag_events_rowwise(df):
     ev = np.full(len(df), "Normal", dtype=object)
-
-    # Noise grows slightly with speed  → harder to “learn the rule”.
     sigma_acc = 0.6 + 0.03 * df["speed"]
     sigma_jerk = 0.6 + 0.03 * df["speed"]
 
@@ -49,41 +465,31 @@ def tag_events(df):
 
     m = df["acceleration"] < th_brake
     ev[m] = "HardBrake"
-
     m = (df["acceleration"] > th_accel) & (ev == "Normal")
     ev[m] = "HardAccel"
-
     m = (df["jerk"].abs() > th_jerk) & (ev == "Normal")
     ev[m] = "HighJerk"
-
     m = ((df["speed"] /
           (df["speed_limit"] + 1e-3)) > overspeed_ratio) & (ev == "Normal")
     ev[m] = "Speeding"
-
     return ev
 
 
-def main():
-    np.random.seed(42)
-
-    N = 120_000
-    dt = 1.0
+def reference_telemetry(N=120_000, dt=1.0, seed=42):
+    np.random.seed(seed)
 
     speeds = np.clip(np.random.normal(15, 5, size=N), 0, 60)
-
-    # Heading change - heavy vehicles wiggle more at low speed, less at high
     heading_sigma = np.clip(30 - 0.4 * speeds, 5, 25)
     heading_changes = np.random.normal(0, heading_sigma)
     headings = np.mod(np.cumsum(heading_changes), 360)
 
-    # Integrate displacement on a sphere
     lats = np.zeros(N)
     lons = np.zeros(N)
-    lats[0], lons[0] = 45.0, 9.0 # arbitrary
+    lats[0], lons[0] = 45.0, 9.0
 
     R = 6_371_000
     for i in range(1, N):
-        d = speeds[i] * dt          # meters in this second
+        d = speeds[i] * dt
         br = np.deg2rad(headings[i])
         dlat = d * np.cos(br) / R
         dlon = d * np.sin(br) / (R * np.cos(np.deg2rad(lats[i - 1])))
@@ -91,39 +497,28 @@ def main():
         lons[i] = lons[i - 1] + np.rad2deg(dlon)
 
     times = pd.date_range("2025-01-01", periods=N, freq=f"{int(dt * 1000)}ms")
-    df = pd.DataFrame({
-        "timestamp": times,
-        "lat": lats,
-        "lon": lons,
-        "heading": headings,
-        "speed": speeds
-    })
-
+    df = pd.DataFrame({"timestamp": times, "lat": lats, "lon": lons,
+                       "heading": headings, "speed": speeds})
     df["acceleration"] = df["speed"].diff().fillna(0) / dt
     df["jerk"] = df["acceleration"].diff().fillna(0) / dt
-
     df["dist"] = haversine_dist(df["lat"], df["lon"],
                                 df["lat"].shift(), df["lon"].shift()).fillna(0)
 
-    SEG_LEN = 500 # meters per road "zone"
     zone_id = (df["dist"].cumsum() // SEG_LEN).astype(int)
-    zone_limits = np.random.choice([10, 15, 20, 25],
-                                   size=zone_id.nunique(),
-                                   p=[.2, .3, .3, .2])
+    zone_limits = np.random.choice(ZONE_LIMITS, size=zone_id.nunique(), p=ZONE_P)
     df["speed_limit"] = zone_limits[zone_id.values]
 
     for col in ["acceleration", "jerk"]:
         df[col] += np.random.normal(0, 0.2, N)
 
     feats = []
-
-    for w in [2, 4, 8]:
-        W = make_windows(df, w=w)
+    for w in WINDOWS:
+        W = _make_windows_rowwise(df, w=w)
         df = pd.concat([df, W], axis=1)
         feats.extend(W.columns)
 
     df["heading_change"] = heading_changes
-    for w in [2, 4, 8]:
+    for w in WINDOWS:
         mean_col = f"head_mean_{w}s"
         var_col = f"head_var_{w}s"
         df[mean_col] = df["heading_change"].rolling(w, 1).mean().bfill().ffill()
@@ -141,27 +536,110 @@ def main():
         mask = np.random.rand(N) < 0.2
         df.loc[mask, col] += np.random.normal(0, 0.5, mask.sum())
 
-    df["EventType"] = tag_events(df)
+    df["EventType"] = _tag_events_rowwise(df)
 
     counts = df["EventType"].value_counts()
     min_x = counts[["HardAccel", "HardBrake"]].min()
-    target_counts = {k: min_x for k in
-                     ["HardAccel", "HardBrake", "HighJerk", "Normal", "Speeding"]}
-
     balanced = []
-    for lbl, tgt in target_counts.items():
+    for lbl in CLASSES:
         subset = df[df["EventType"] == lbl]
-        balanced.append(subset.sample(tgt, replace=len(subset) < tgt,
+        balanced.append(subset.sample(min_x, replace=len(subset) < min_x,
                                       random_state=42))
     df = pd.concat(balanced).sample(frac=1, random_state=42).reset_index(drop=True)
 
     drop_cols = ["timestamp", "lat", "lon", "heading",
                  "speed", "speed_limit", "acceleration", "jerk", "dist"]
-    df = df.drop(columns=drop_cols)
-
-    df.to_csv("telemetry.csv", index=False)
-    print(f"Wrote telemetry.csv  ({df.shape[0]} rows)")
-    print("Class distribution:\n", df["EventType"].value_counts())
+    return df.drop(columns=drop_cols)
+
+
+def check(n, chunk_rows, rtol=1e-9):
+    # vectorised + chunked vs row-wise: same rows, same labels; rolling
+    # means/sums/variances may differ in the last bits because pandas keeps
+    # running (compensated) sums across the whole column
+    t = time.perf_counter()
+    ref = reference_telemetry(n)
+    t_ref = time.perf_counter() - t
+    t = time.perf_counter()
+    new = pd.concat(generate_telemetry(n, chunk_rows=chunk_rows), ignore_index=True)
+    t_new = time.perf_counter() - t
+
+    assert list(new.columns) == list(ref.columns), "column layout differs"
+    assert len(new) == len(ref), f"{len(new)} rows vs {len(ref)}"
+    assert (new["EventType"].values == ref["EventType"].values).all(), "labels differ"
+    worst = 0.0
+    for col in OUTPUT_COLUMNS:
+        a, b = new[col].to_numpy(), ref[col].to_numpy()
+        exact = np.array_equal(a, b, equal_nan=True)
+        rel = float(np.nanmax(np.abs(a - b) / np.maximum(np.abs(b), 1.0)))
+        worst = max(worst, rel)
+        print(f"  {col:<18} {'identical' if exact else f'max rel diff {rel:.1e}'}")
+        if rel > rtol:
+            raise SystemExit(f"{col} differs by {rel:.2e} > {rtol}")
+    print(f"{n} rows, chunks of {chunk_rows}: labels and row selection identical, "
+          f"worst rel diff {worst:.1e}")
+    print(f"row-wise {t_ref:.2f} s ({n / t_ref:,.0f} rows/s) | "
+          f"vectorised {t_new:.2f} s ({n / t_new:,.0f} rows/s) | x{t_ref / t_new:.0f}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Generate synthetic driving telemetry")
+    ap.add_argument("--rows", type=int, default=120_000,
+                    help="rows to simulate (per vehicle in fleet mode)")
+    ap.add_argument("--chunk-rows", type=int, default=1_000_000)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", default=None,
+                    help="output file, or directory in fleet mode "
+                         "(default telemetry.csv / telemetry_fleet)")
+    ap.add_argument("--format", choices=["csv", *FORMATS], default=None,
+                    help="default: csv for one vehicle, parquet for a fleet")
+    ap.add_argument("--tmp-dir", default=None, help="where the raw-row memmap goes")
+    ap.add_argument("--vehicles", type=int, default=0,
+                    help="fleet mode: simulate this many independent vehicles")
+    ap.add_argument("--workers", type=int, default=None, help="fleet processes (default: all CPUs)")
+    ap.add_argument("--vehicles-per-file", type=int, default=None)
+    ap.add_argument("--check", type=int, metavar="N", default=0,
+                    help="compare N rows against the row-wise reference and exit")
+    args = ap.parse_args(argv)
+
+    if args.check:
+        check(args.check, min(args.chunk_rows, max(args.check // 7, 1_000)))
+        return
+
+    if args.vehicles:
+        fmt = args.format or "parquet"
+        if fmt == "csv":
+            ap.error("fleet mode writes parquet or arrow")
+        out = args.out or "telemetry_fleet"
+        t = time.perf_counter()
+        rows, counts, files = generate_fleet(out, args.vehicles, args.rows, fmt, args.workers,
+                                             args.vehicles_per_file, args.chunk_rows,
+                                             seed=args.seed)
+        total = time.perf_counter() - t
+        size = sum(os.path.getsize(f) for f in files)
+        print(f"Wrote {out}/  ({rows:,} rows, {args.vehicles} vehicles, {len(files)} files, "
+              f"{size / 2**20:,.0f} MiB = {size / rows:.0f} B/row)")
+        print(f"{rows / total:,.0f} rows/s  ({total:.1f} s)")
+        print("Class distribution:", counts)
+        return
+
+    fmt = args.format or "csv"
+    out = args.out or "telemetry" + (FORMATS.get(fmt, ".csv"))
+    timings = {}
+    t = time.perf_counter()
+    chunks = generate_telemetry(args.rows, args.chunk_rows, seed=args.seed,
+                                tmp_dir=args.tmp_dir, timings=timings)
+    if fmt == "csv":
+        n_out = write_csv(chunks, out)
+    else:
+        with ColumnarWriter(out, fmt) as w:
+            for df in chunks:
+                w.write_frame(df)
+        n_out = w.rows
+    total = time.perf_counter() - t
+    print(f"Wrote {out}  ({n_out} rows)")
+    print(f"{args.rows:,} raw rows in {total:.1f} s = {args.rows / total:,.0f} rows/s  ("
+          + ", ".join(f"{k[:-2]} {v:.1f} s" for k, v in timings.items())
+          + f", {fmt} {total - sum(timings.values()):.1f} s)")
 
 
 if __name__ == "__main__":
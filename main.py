@@ -1,191 +1,793 @@
-import math
+import os
+import json
+import time
+import queue
+import random
+import asyncio
+import contextlib
+import logging
 import datetime
-from typing import List
+import threading
+import logging.handlers
+from typing import NamedTuple, Optional
 
 import numpy as np
-import pandas as pd
 from joblib import load
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.exception_handlers import request_validation_exception_handler
 from pydantic import BaseModel, Field
-from scipy.special import softmax
-from scipy.optimize import minimize
-from functools import partial
+
+from metrics import Registry, RequestTimer, render
+from admission import AdmissionGate, Overloaded
+from microBatch import MicroBatcher
+from workerPool import ShardedPool
+from modelBundle import ModelBundle, current_version
+from predictionCache import PredictionCache, cache_key, HIT, PENDING
+from predictors import TempScaler, FusedEnsemble, CascadePredictor  # noqa: F401
+from vehicleState import VehicleStateStore, N_FEATURES
+from featureSpec import check_layout
+from driftSketch import DriftMonitor, merge as merge_drift, report as drift_report
 
 # ─── 1) Pydantic models ──────────────────────────────────────────────
 class GpsPayload(BaseModel):
     latitude: float
     longitude: float
     timestamp: datetime.datetime
+    vehicle_id: Optional[int] = None
+    driver_id: Optional[str] = None
 
 class PredictionResponse(BaseModel):
     predicted_event: str
     aggressive_score: float = Field(..., ge=0.0, le=1.0)
     proba: list[float]
 
-# ─── 2) Utility functions (from generateTelemetry.py) ───────────────
-def haversine_dist(lat1, lon1, lat2, lon2):
-    R = 6_371_000.0
-    l1, l2 = np.deg2rad(lat1), np.deg2rad(lat2)
-    dphi = l2 - l1
-    dlambda = np.deg2rad(lon2 - lon1)
-    a = (np.sin(dphi / 2) ** 2 +
-         np.cos(l1) * np.cos(l2) * np.sin(dlambda / 2) ** 2)
-    return 2 * R * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
-
-def make_windows(df: pd.DataFrame, w: int) -> pd.DataFrame:
-    out = pd.DataFrame(index=df.index)
-    out[f"acc_mean_{w}s"] = df["acceleration"].rolling(w, 1).mean().bfill().ffill()
-    out[f"jerk_mean_{w}s"] = df["jerk"].rolling(w, 1).mean().bfill().ffill()
-    out[f"dist_sum_{w}s"]  = df["dist"].rolling(w, 1).sum().bfill().ffill()
-
-    def straightness(x):
-        if x.sum() == 0:
-            return 0.0
-        i0, i1 = x.index[0], x.index[-1]
-        direct = haversine_dist(
-            df.loc[i0, "lat"], df.loc[i0, "lon"],
-            df.loc[i1, "lat"], df.loc[i1, "lon"]
-        )
-        return direct / x.sum()
-
-    out[f"straightness_{w}s"] = (
-        df["dist"]
-          .rolling(w, 1)
-          .apply(straightness, raw=False)
-          .bfill().ffill()
-    )
-    return out
-
-# ─── 3) TempScaler (must match your train script) ────────────────────
-def _nll(proba: np.ndarray, y_true: np.ndarray) -> float:
-    eps = 1e-9
-    row_idx = np.arange(len(y_true))
-    return -np.log(proba[row_idx, y_true] + eps).mean()
-
-class TempScaler:
-    def __init__(self, models):
-        self.models = models
-        self.T = 1.0
-
-    def _avg_proba(self, X):
-        return np.mean([m.predict_proba(X) for m in self.models], axis=0)
-
-    def _avg_logits(self, X):
-        eps = 1e-9
-        return np.log(self._avg_proba(X) + eps)
-
-    def fit(self, X_val, y_val):
-        logits = self._avg_logits(X_val)
-        obj = partial(
-            lambda t, lg, y: _nll(softmax(lg / t, axis=1), y),
-            lg=logits,
-            y=y_val,
-        )
-        result = minimize(obj, x0=[1.0], bounds=[(0.05, 10.0)])
-        self.T = float(result.x[0])
-        return self
-
-    def predict_proba(self, X):
-        logits = self._avg_logits(X) / self.T
-        return softmax(logits, axis=1)
-
-    def predict(self, X):
-        return self.predict_proba(X).argmax(axis=1)
-
-# ─── 4) Feature‐builder maintains last N points ───────────────────────
-class FeatureBuilder:
-    def __init__(self, max_window: int = 8):
-        self.max_window = max_window
-        self.records: List[dict] = []
-
-    def add_point(self, lat: float, lon: float, ts: datetime.datetime) -> pd.DataFrame:
-        rec = {"lat": lat, "lon": lon, "timestamp": ts}
-        if not self.records:
-            # initialize dynamic fields to zero on first point
-            rec.update(speed=0.0, acceleration=0.0,
-                       jerk=0.0, dist=0.0,
-                       heading=0.0, heading_change=0.0)
-        else:
-            prev = self.records[-1]
-            dt = (ts - prev["timestamp"]).total_seconds() or 1.0
-            d = haversine_dist(prev["lat"], prev["lon"], lat, lon)
-            speed = d / dt
-            acc   = (speed - prev["speed"]) / dt
-            j     = (acc - prev["acceleration"]) / dt
-
-            # compute bearing / heading
-            y = math.sin(math.radians(lon - prev["lon"])) * math.cos(math.radians(lat))
-            x = (math.cos(math.radians(prev["lat"])) * math.sin(math.radians(lat))
-                 - math.sin(math.radians(prev["lat"])) * math.cos(math.radians(lat))
-                   * math.cos(math.radians(lon - prev["lon"])))
-            heading = (math.degrees(math.atan2(y, x)) + 360) % 360
-            raw_delta = heading - prev["heading"]
-            heading_change = (raw_delta + 180) % 360 - 180
-
-            rec.update(speed=speed, acceleration=acc, jerk=j,
-                       dist=d, heading=heading,
-                       heading_change=heading_change)
-
-        self.records.append(rec)
-        if len(self.records) > self.max_window:
-            self.records.pop(0)
-        return pd.DataFrame(self.records)
-
-# ─── 5) FastAPI app and startup hook ─────────────────────────────────
+MAX_BATCH = int(os.getenv("PREDICT_MAX_BATCH", 4096))
+
+class BatchPayload(BaseModel):
+    records: list[GpsPayload] = Field(..., max_length=MAX_BATCH)
+
+class BatchItem(BaseModel):
+    predicted_event: Optional[str] = None
+    aggressive_score: Optional[float] = Field(None, ge=0.0, le=1.0)
+    proba: Optional[list[float]] = None
+    error: Optional[str] = None
+
+class BatchPredictionResponse(BaseModel):
+    results: list[BatchItem]
+
+# ─── 2) Predictor ─────────────────────────────────────────────────────
+# Models come from the versioned bundle under BUNDLE_ROOT (see
+# modelBundle.py); PREDICTOR picks which predictor is built from it:
+#   "fused"    every ensemble member scored in one booster pass
+#   "ensemble" the plain TempScaler over the per-fold boosters
+#   "cascade"  one calibrated fold model, fused ensemble only when unsure
+#   "student"  the single distilled model
+#   "single"   one calibrated fold model (the cascade's first stage)
+# Without a bundle, "fused" / "ensemble" fall back to temp_scal.pkl and
+# label_encoder.pkl (TempScaler is imported so those pickles still load).
+PREDICTOR      = os.getenv("PREDICTOR", "fused")
+BUNDLE_ROOT    = os.getenv("BUNDLE_ROOT", "artifacts")
+BUNDLE_WATCH_S = float(os.getenv("BUNDLE_WATCH_S", 0))   # 0 = no watcher
+FUSED_PATH     = os.getenv("FUSED_PATH", "temp_scal_fused.ubj")
+
+class ServingModel(NamedTuple):
+    predictor: object
+    classes: np.ndarray
+    normal_idx: int
+    version: str
+    drift: Optional[DriftMonitor] = None
+    fallback: Optional[object] = None        # DEGRADED_PREDICTOR, see section 3
+
+def _load_legacy_predictor():
+    if PREDICTOR == "fused":
+        if os.path.exists(FUSED_PATH):
+            return FusedEnsemble.load(FUSED_PATH)
+        return FusedEnsemble.from_temp_scaler(load("temp_scal.pkl"))
+    if PREDICTOR == "ensemble":
+        return load("temp_scal.pkl")
+    raise RuntimeError(f"PREDICTOR={PREDICTOR!r} needs a model bundle under {BUNDLE_ROOT}/")
+
+def _load_model(version: Optional[str] = None) -> ServingModel:
+    if version is not None:
+        bundle = ModelBundle(os.path.join(BUNDLE_ROOT, version))
+    else:
+        bundle = ModelBundle.current(BUNDLE_ROOT)
+
+    drift = fallback = None
+    if bundle is not None:
+        check_layout(bundle.feature_order, f"bundle {bundle.version}")
+        predictor, classes, version = bundle.predictor(PREDICTOR), bundle.classes, bundle.version
+        reference = bundle.drift_reference() if DRIFT_WINDOW > 0 else None
+        if reference is not None:
+            check_layout(reference["columns"], f"bundle {version} drift reference")
+            drift = DriftMonitor(reference, DRIFT_WINDOW)
+        if ADMIT_CONCURRENCY > 0 and DEGRADED_PREDICTOR not in ("", PREDICTOR):
+            fallback = bundle.predictor(DEGRADED_PREDICTOR)
+            _check_feature_order(fallback, f"{version} ({DEGRADED_PREDICTOR})")
+    else:
+        predictor = _load_legacy_predictor()
+        classes, version = load("label_encoder.pkl").classes_, "legacy"
+    _check_feature_order(predictor, version)
+    classes = np.asarray(classes)
+    return ServingModel(predictor, classes, list(classes).index("Normal"), version,
+                        drift, fallback)
+
+def _check_feature_order(predictor, version):
+    # boosters fitted on a DataFrame remember their column names; refuse to
+    # serve if they disagree with featureSpec's layout (what FeatureBuilder emits)
+    if predictor.feature_names is not None:
+        check_layout(predictor.feature_names, f"model {version}")
+
+# ─── 3) Per-vehicle feature state ───────────────────────────────────
+# Every vehicle keeps its own ring buffer of the last MAX_WINDOW points;
+# idle vehicles expire after STATE_TTL_S and the store never holds more
+# than STATE_MAX_VEHICLES windows (least recently used go first).
+MAX_WINDOW         = 8
+STATE_MAX_VEHICLES = int(os.getenv("STATE_MAX_VEHICLES", 20_000))
+STATE_TTL_S        = float(os.getenv("STATE_TTL_S", 900))
+
+# Opt-in coalescing of concurrent /predict calls into one ensemble call:
+# a batch closes after COALESCE_MAX_BATCH rows or COALESCE_MAX_WAIT_MS.
+COALESCE             = os.getenv("COALESCE", "0") == "1"
+COALESCE_MAX_BATCH   = int(os.getenv("COALESCE_MAX_BATCH", 64))
+COALESCE_MAX_WAIT_MS = float(os.getenv("COALESCE_MAX_WAIT_MS", 2.0))
+
+# Re-sent fixes (same vehicle, timestamp and position) get the first
+# answer back without touching the window or the model. Up to
+# PRED_CACHE_MAX results are kept for PRED_CACHE_TTL_S; 0 disables.
+PRED_CACHE_MAX   = int(os.getenv("PRED_CACHE_MAX", 100_000))
+PRED_CACHE_TTL_S = float(os.getenv("PRED_CACHE_TTL_S", 300))
+
+# /stream/{vehicle_id}: at most STREAM_QUEUE received points wait to be
+# scored per connection (then the socket stops being read, which pushes
+# back on the client); a client that does not take its results within
+# STREAM_SEND_TIMEOUT_S is disconnected.
+STREAM_QUEUE          = int(os.getenv("STREAM_QUEUE", 256))
+STREAM_SEND_TIMEOUT_S = float(os.getenv("STREAM_SEND_TIMEOUT_S", 10))
+
+# SERVE_WORKERS > 1 turns this process into a front that only parses and
+# routes: vehicle windows and models live in that many worker processes,
+# each vehicle pinned to one of them (see workerPool.py).
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", 1))
+
+# Every scored row also goes into the drift sketches of the model's bundle
+# (driftSketch.py): live feature / class-mix histograms over the last
+# DRIFT_WINDOW … 2 × DRIFT_WINDOW rows, compared with the training data
+# on /drift. 0 disables; bundles without drift_reference.json have none.
+DRIFT_WINDOW = int(os.getenv("DRIFT_WINDOW", 50_000))
+
+# Admission control for /predict and /predict_batch (admission.py): at
+# most ADMIT_CONCURRENCY requests are scored at once and up to ADMIT_QUEUE
+# more wait for a slot; one that finds the queue full, or waits longer
+# than ADMIT_DEADLINE_MS, gets 503 with Retry-After: ADMIT_RETRY_AFTER_S
+# before its point reaches the vehicle window. While DEGRADE_QUEUE or more
+# requests are waiting, bundles are scored with DEGRADED_PREDICTOR instead
+# of PREDICTOR ("" keeps PREDICTOR and only sheds load). With
+# SERVE_WORKERS > 1 the gate sits in the front and the mode is pushed to
+# the workers. ADMIT_CONCURRENCY=0 disables all of it.
+ADMIT_CONCURRENCY   = int(os.getenv("ADMIT_CONCURRENCY", 32))
+ADMIT_QUEUE         = int(os.getenv("ADMIT_QUEUE", 256))
+ADMIT_DEADLINE_MS   = float(os.getenv("ADMIT_DEADLINE_MS", 250))
+ADMIT_RETRY_AFTER_S = int(os.getenv("ADMIT_RETRY_AFTER_S", 1))
+DEGRADE_QUEUE       = int(os.getenv("DEGRADE_QUEUE", 64))
+DEGRADE_HOLD_S      = float(os.getenv("DEGRADE_HOLD_S", 5))
+DEGRADED_PREDICTOR  = os.getenv("DEGRADED_PREDICTOR", "single")
+
+# Prediction logging is sampled: PREDICT_LOG_SAMPLE is the fraction of
+# predictions logged (0 = off). Records go through a queue to a listener
+# thread, so a slow stdout never holds up a request.
+PREDICT_LOG_SAMPLE = float(os.getenv("PREDICT_LOG_SAMPLE", 0))
+log = logging.getLogger("predictor")
+
+# ─── 4) FastAPI app and startup hook ─────────────────────────────────
 app = FastAPI(title="Aggressive‐Driver Predictor")
+states: Optional[VehicleStateStore] = None
+model: Optional[ServingModel] = None
+batcher: Optional[MicroBatcher] = None
+pool: Optional[ShardedPool] = None
+cache: Optional[PredictionCache] = None
+gate: Optional[AdmissionGate] = None
+degraded = False
+
+# Served on /metrics. Stages: parse (body + validation), queue (waiting
+# for an admission slot), add_point, features, predict_proba, decode,
+# serialize; "pool" is the round trip to the sharded workers, whose own
+# stage timings carry a worker label.
+registry = Registry()
+STAGE = registry.histogram("predictor_stage_seconds",
+                           "Time spent in each stage of a prediction request", ("stage",))
+REQUEST = registry.histogram("predictor_request_seconds",
+                             "End-to-end latency of prediction requests", ("path", "status"))
+PREDICTIONS = registry.counter("predictor_predictions",
+                               "Predictions returned, by predicted class", ("class",))
+REJECTED = registry.counter("predictor_rejected",
+                            "Requests or points that got no prediction", ("reason",))
+registry.gauge("predictor_vehicle_states", "Vehicles holding a feature window",
+               lambda: len(states) if states is not None else None)
+registry.gauge("predictor_cache_entries", "Results held by the prediction cache",
+               lambda: len(cache) if cache is not None else None)
+registry.gauge("predictor_streams_active", "Open /stream connections",
+               lambda: stream_stats["active"])
+registry.gauge("predictor_admission_active", "Requests holding an admission slot",
+               lambda: gate.active if gate is not None else None)
+registry.gauge("predictor_admission_queued", "Requests waiting for an admission slot",
+               lambda: len(gate) if gate is not None else None)
+registry.gauge("predictor_degraded", "1 while requests are scored with DEGRADED_PREDICTOR",
+               lambda: int(degraded))
+MODE_SWITCHES = registry.counter("predictor_mode_switches",
+                                 "Switches between full and degraded scoring, by new mode",
+                                 ("mode",))
+registry.gauge("predictor_drift_psi", "PSI of live feature values vs the training data",
+               lambda: _drift_psi(), ("feature",))
+app.add_middleware(RequestTimer, histogram=REQUEST, paths=("/predict", "/predict_batch"))
+
+@app.exception_handler(RequestValidationError)
+async def _count_invalid(request: Request, exc: RequestValidationError):
+    REJECTED.inc("invalid_payload")
+    return await request_validation_exception_handler(request, exc)
+
+def _observe_parse(request: Request) -> None:
+    t_start = request.scope.get("t_start")
+    if t_start is not None:
+        STAGE.observe(time.perf_counter() - t_start, "parse")
+
+def _start_log_listener() -> None:
+    if PREDICT_LOG_SAMPLE <= 0 or log.handlers:
+        return
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s [predict] %(message)s"))
+    logging.handlers.QueueListener(q, handler).start()
+    log.addHandler(logging.handlers.QueueHandler(q))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+def _log_sample(res: tuple) -> None:
+    if PREDICT_LOG_SAMPLE > 0 and random.random() < PREDICT_LOG_SAMPLE:
+        log.info("lbl=%r score=%.3f proba=%s", *res)
+
+def set_degraded(flag: bool) -> None:
+    global degraded
+    degraded = flag
+
+def _switch_mode(flag: bool) -> None:
+    set_degraded(flag)
+    MODE_SWITCHES.inc("degraded" if flag else "full")
+    if pool is not None:
+        pool.tell("mode", flag)
+
+def _scoring(m: ServingModel):
+    # the predictor requests are scored with right now
+    return m.fallback if degraded and m.fallback is not None else m.predictor
+
+@contextlib.asynccontextmanager
+async def _admitted():
+    if gate is None:
+        yield
+        return
+    try:
+        waited = await gate.acquire()
+    except Overloaded as exc:
+        REJECTED.inc(f"overloaded_{exc.reason}")
+        raise HTTPException(503, f"overloaded ({exc.reason}), retry later",
+                            headers={"Retry-After": str(ADMIT_RETRY_AFTER_S)}) from None
+    STAGE.observe(waited, "queue")
+    try:
+        yield
+    finally:
+        gate.release()
 
 @app.on_event("startup")
 def _load_artifacts():
-    global builder, calibrator, label_encoder
-    builder       = FeatureBuilder(max_window=8)
-    calibrator    = load("temp_scal.pkl")
-    label_encoder = load("label_encoder.pkl")
+    global states, model, batcher, pool, cache
+    _start_log_listener()
+    if SERVE_WORKERS > 1:
+        pool = ShardedPool(SERVE_WORKERS).start()
+        return
+    states = VehicleStateStore(max_vehicles=STATE_MAX_VEHICLES,
+                               ttl_seconds=STATE_TTL_S,
+                               max_window=MAX_WINDOW)
+    if PRED_CACHE_MAX > 0:
+        cache = PredictionCache(max_entries=PRED_CACHE_MAX, ttl_seconds=PRED_CACHE_TTL_S)
+    model  = _load_model()
+    if COALESCE:
+        batcher = MicroBatcher(lambda X: _scoring(model).predict_proba(X), N_FEATURES,
+                               max_batch=COALESCE_MAX_BATCH,
+                               max_wait_ms=COALESCE_MAX_WAIT_MS)
+    if BUNDLE_WATCH_S > 0:
+        threading.Thread(target=_watch_bundle, daemon=True).start()
 
+# only the process that takes HTTP requests (the front, with a pool) has
+# a gate: pool workers run _load_artifacts() but no startup hooks
+@app.on_event("startup")
+def _start_gate():
+    global gate
+    if ADMIT_CONCURRENCY > 0:
+        gate = AdmissionGate(ADMIT_CONCURRENCY, ADMIT_QUEUE, ADMIT_DEADLINE_MS,
+                             DEGRADE_QUEUE, DEGRADE_HOLD_S, on_switch=_switch_mode)
+
+@app.on_event("shutdown")
+async def _stop_batcher():
+    if batcher is not None:
+        await batcher.stop()
+    if pool is not None:
+        pool.close()
+
+# Hot reload: a new ServingModel is built off the request path and then swapped in
+# with a single assignment; requests already running keep the reference
+# they started with and finish on the old model.
+_reload_lock  = threading.Lock()
+reload_status = {"state": "idle", "version": None, "error": None}
+
+def _reload(version: Optional[str] = None) -> bool:
+    # True once the requested bundle is the one being served; False if
+    # another reload was running or the load failed
+    global model
+    if not _reload_lock.acquire(blocking=False):
+        return False
+    try:
+        reload_status.update(state="loading", version=version or "CURRENT", error=None)
+        model = _load_model(version)
+        reload_status.update(state="idle", version=model.version)
+        return True
+    except Exception as exc:
+        reload_status.update(state="failed", error=repr(exc))
+        return False
+    finally:
+        _reload_lock.release()
+
+def _watch_bundle():
+    seen = current_version(BUNDLE_ROOT)
+    while True:
+        time.sleep(BUNDLE_WATCH_S)
+        latest = current_version(BUNDLE_ROOT)
+        # only a successful load marks it seen: a busy lock (manual
+        # /admin/reload) or a failed load is retried on the next tick
+        if latest and latest != seen and _reload(latest):
+            seen = latest
+
+def start_reload(version: Optional[str] = None) -> dict:
+    if _reload_lock.locked():
+        raise HTTPException(409, "a reload is already in progress")
+    threading.Thread(target=_reload, args=(version,), daemon=True).start()
+    return {"current": model.version, "requested": version or "CURRENT"}
+
+# Pool workers reload in two steps so that the pool moves as a whole:
+# prepare_reload() loads the bundle on the side without serving it (and
+# keeps the reload lock), then the front calls finish_reload(True) on
+# every worker once all of them have it, or finish_reload(False) to drop
+# it everywhere if one failed, so no worker is left on another version.
+_staged: Optional[ServingModel] = None
+
+def prepare_reload(version: Optional[str] = None) -> dict:
+    global _staged
+    if not _reload_lock.acquire(blocking=False):
+        return {"ok": False, "error": "a reload is already in progress"}
+    reload_status.update(state="loading", version=version or "CURRENT", error=None)
+    try:
+        _staged = _load_model(version)
+    except Exception as exc:
+        reload_status.update(state="failed", error=repr(exc))
+        _reload_lock.release()
+        return {"ok": False, "error": repr(exc)}
+    return {"ok": True, "version": _staged.version}
+
+def finish_reload(commit: bool) -> str:
+    # version served afterwards; a no-op on a worker whose prepare failed
+    global model, _staged
+    if _staged is not None:
+        if commit:
+            model = _staged
+            reload_status.update(state="idle", version=model.version)
+        else:
+            reload_status.update(state="failed", version=model.version,
+                                 error="rolled back: another worker failed to load")
+        _staged = None
+        _reload_lock.release()
+    return model.version
+
+def worker_info() -> dict:
+    predictor = model.predictor
+    return {"pid": os.getpid(), "version": model.version, "predictor": PREDICTOR,
+            "reload": reload_status, "vehicles": len(states),
+            "cache": cache.stats() if cache is not None else None,
+            "batching": batcher.stats() if batcher is not None else None,
+            "cascade": predictor.stats() if isinstance(predictor, CascadePredictor) else None}
+
+@app.post("/admin/reload", status_code=202)
+async def reload_model(version: Optional[str] = None):
+    if version is not None and (os.path.basename(version) != version or version.startswith(".")):
+        raise HTTPException(400, f"invalid bundle version {version!r}")
+    if pool is not None:
+        prepared = await pool.broadcast("prepare", version)
+        ok = all(r["ok"] for r in prepared)
+        served = await pool.broadcast("finish", ok)
+        if not ok:
+            i, error = next((i, r["error"]) for i, r in enumerate(prepared) if not r["ok"])
+            raise HTTPException(409 if "in progress" in error else 500,
+                                f"worker {i}: {error}; every worker stays on {served[0]}")
+        return {"current": served[0], "workers": served, "requested": version or "CURRENT"}
+    return start_reload(version)
+
+@app.get("/admin/model")
+async def model_info():
+    if pool is not None:
+        workers = await pool.broadcast("info")
+        return {"version": workers[0]["version"], "predictor": PREDICTOR,
+                "workers": [{k: w[k] for k in ("pid", "version", "reload", "vehicles")}
+                            for w in workers]}
+    return {"version": model.version, "predictor": PREDICTOR, "reload": reload_status}
+
+NOT_ENOUGH_POINTS = "need at least 2 GPS points to predict"
+
+def _decode(m: ServingModel, P: np.ndarray):
+    # calibrated probabilities → (labels, aggressive scores), one per row
+    labels = m.classes[P.argmax(axis=1)]
+    for lbl, n in zip(*np.unique(labels, return_counts=True)):
+        PREDICTIONS.inc(str(lbl), amount=int(n))
+    return labels, 1.0 - P[:, m.normal_idx]
+
+def _observe_drift(m: ServingModel, X: np.ndarray, P: np.ndarray) -> None:
+    if m.drift is not None:
+        t0 = time.perf_counter()
+        m.drift.update(X, P.argmax(axis=1))
+        STAGE.observe(time.perf_counter() - t0, "drift")
+
+def drift_snapshot() -> Optional[dict]:
+    m = model
+    if m is None or m.drift is None:
+        return None
+    return {"version": m.version, "reference": m.drift.reference, "live": m.drift.counts()}
+
+def _drift_psi() -> Optional[dict]:
+    m = model
+    if m is None or m.drift is None:
+        return None
+    return {(f,): v["psi"] for f, v in m.drift.report()["features"].items()}
+
+def _score_points(m: ServingModel, points: list) -> list:
+    # points: (vehicle_id, lat, lon, timestamp) tuples. Windows advance point
+    # by point in input order, then every ready row goes through the model
+    # in a single predict_proba call. Returns (label, score, proba) per point,
+    # None where the vehicle does not have two points yet. Re-sent points
+    # are answered from the cache and never reach the window.
+    X = np.empty((len(points), N_FEATURES))
+    ready = np.zeros(len(points), dtype=bool)
+    results = [None] * len(points)
+    owned, waiting = [], []
+    t_add = t_feat = 0.0
+    perf_counter = time.perf_counter
+    try:
+        for i, point in enumerate(points):
+            if cache is not None:
+                key = cache_key(*point)
+                status, val = cache.claim(key)
+                if status == HIT:
+                    results[i] = val
+                    continue
+                if status == PENDING:
+                    waiting.append((i, val))
+                    continue
+                owned.append((i, key, val))
+            vehicle_id, lat, lon, ts = point
+            state = states.get(vehicle_id)
+            with state.lock:
+                t0 = perf_counter()
+                state.add_point(lat, lon, ts)
+                t1 = perf_counter()
+                if len(state) >= 2:
+                    state.features(out=X[i])
+                    ready[i] = True
+                    t_feat += perf_counter() - t1
+                t_add += t1 - t0
+
+        if t_add:
+            # per-call totals: one observation per batch, not per point
+            STAGE.observe(t_add, "add_point")
+            STAGE.observe(t_feat, "features")
+        if ready.any():
+            t0 = perf_counter()
+            P = _scoring(m).predict_proba(X[ready])
+            t1 = perf_counter()
+            labels, scores = _decode(m, P)
+            for j, i in enumerate(np.flatnonzero(ready)):
+                results[i] = (str(labels[j]), float(scores[j]), P[j].tolist())
+                _log_sample(results[i])
+            STAGE.observe(t1 - t0, "predict_proba")
+            STAGE.observe(perf_counter() - t1, "decode")
+            _observe_drift(m, X[ready], P)
+    except BaseException as exc:
+        for _, key, fut in owned:
+            cache.fail(key, fut, exc)
+        raise
+
+    for i, key, fut in owned:
+        cache.resolve(key, fut, results[i])
+    # duplicates in flight elsewhere (or earlier in this same batch)
+    for i, fut in waiting:
+        results[i] = fut.result()
+    return results
+
+async def _predict_one(m: ServingModel, point: tuple):
+    vehicle_id, lat, lon, ts = point
+    state = states.get(vehicle_id)
+    X = np.empty((1, N_FEATURES))
+    with state.lock:
+        t0 = time.perf_counter()
+        state.add_point(lat, lon, ts)
+        t1 = time.perf_counter()
+        ready = len(state) >= 2
+        if ready:
+            state.features(out=X[0])
+        t2 = time.perf_counter()
+    STAGE.observe(t1 - t0, "add_point")
+    if not ready:
+        return None
+    STAGE.observe(t2 - t1, "features")
+
+    # the feature update above is a few µs; the model call is what must stay
+    # off the event loop, either batched or on the threadpool
+    if batcher is not None:
+        # scored by the predictor of the model this request started on
+        P = (await batcher.submit(X[0], _scoring(m).predict_proba))[None, :]
+    else:
+        P = await run_in_threadpool(_scoring(m).predict_proba, X)
+    t3 = time.perf_counter()
+    labels, scores = _decode(m, P)
+    res = (str(labels[0]), float(scores[0]), P[0].tolist())
+    STAGE.observe(t3 - t2, "predict_proba")
+    STAGE.observe(time.perf_counter() - t3, "decode")
+    _observe_drift(m, X, P)
+    _log_sample(res)
+    return res
+
+async def _predict_cached(m: ServingModel, point: tuple):
+    key = cache_key(*point)
+    status, val = cache.claim(key)
+    if status == HIT:
+        return val
+    if status == PENDING:
+        return await asyncio.wrap_future(val)
+    try:
+        res = await _predict_one(m, point)
+    except BaseException as exc:
+        cache.fail(key, val, exc)
+        raise
+    cache.resolve(key, val, res)
+    return res
+
+async def _score_via_pool(points: list) -> list:
+    t0 = time.perf_counter()
+    scored = await pool.score(points)
+    STAGE.observe(time.perf_counter() - t0, "pool")
+    return scored
+
+# Responses are serialised here rather than by FastAPI so that the
+# "serialize" stage can be timed; response_model still documents them.
 @app.post("/predict", response_model=PredictionResponse)
-def predict(payload: GpsPayload):
-    df = builder.add_point(payload.latitude, payload.longitude, payload.timestamp)
-
-    if len(df) < 2:
-        raise HTTPException(400, "need at least 2 GPS points to predict")
-
-    # build all the same rolling and time-of-day features
-    feats = df.copy()
-    for w in (2, 4, 8):
-        W = make_windows(df, w=w)
-        for col in W.columns:
-            feats[col] = W[col]
-    for w in (2, 4, 8):
-        feats[f"head_mean_{w}s"] = (
-            df["heading_change"].rolling(w, 1).mean().bfill().ffill()
-        )
-        feats[f"head_var_{w}s"]  = (
-            df["heading_change"].rolling(w, 1).var().bfill().ffill()
-        )
-    tod = (df["timestamp"].dt.hour * 3600 +
-           df["timestamp"].dt.minute * 60 +
-           df["timestamp"].dt.second)
-    feats["tod_sin"] = np.sin(2 * np.pi * tod / 86_400)
-    feats["tod_cos"] = np.cos(2 * np.pi * tod / 86_400)
-
-    # only the newest row goes to the model
-    X = feats.iloc[[-1]].drop(
-        columns = [
-            "lat", "lon", "timestamp",
-            "speed", "acceleration", "jerk", "dist", "heading"
-        ],
-        errors = "ignore"
-    )
-
-    proba = calibrator.predict_proba(X.values)[0]
-    idx_n = list(label_encoder.classes_).index("Normal")
-    score = float(1.0 - proba[idx_n])
-    lbl   = label_encoder.inverse_transform([proba.argmax()])[0]
-
-    print(f"[predict] lbl={lbl!r}, score={score:.3f}, proba={proba.tolist()}")
-
-    return PredictionResponse(predicted_event=lbl, aggressive_score=score, proba=proba.tolist())
-
-# ─── 6) Optional “python main.py” entry point ───────────────────────
+async def predict(payload: GpsPayload, request: Request):
+    _observe_parse(request)
+    point = (payload.vehicle_id, payload.latitude, payload.longitude, payload.timestamp)
+    async with _admitted():
+        if pool is not None:
+            res = (await _score_via_pool([point]))[0]
+        elif cache is not None:
+            res = await _predict_cached(model, point)
+        else:
+            res = await _predict_one(model, point)
+    if res is None:
+        REJECTED.inc("not_enough_points")
+        raise HTTPException(400, NOT_ENOUGH_POINTS)
+
+    t0 = time.perf_counter()
+    lbl, score, proba = res
+    body = PredictionResponse(predicted_event=lbl, aggressive_score=score,
+                              proba=proba).model_dump_json()
+    STAGE.observe(time.perf_counter() - t0, "serialize")
+    return Response(body, media_type="application/json")
+
+@app.post("/predict_batch", response_model=BatchPredictionResponse,
+          response_model_exclude_none=True)
+async def predict_batch(payload: BatchPayload, request: Request):
+    _observe_parse(request)
+    points = [(r.vehicle_id, r.latitude, r.longitude, r.timestamp) for r in payload.records]
+    async with _admitted():
+        if pool is not None:
+            scored = await _score_via_pool(points)
+        else:
+            scored = await run_in_threadpool(_score_points, model, points)
+
+    t0 = time.perf_counter()
+    n_rejected = sum(res is None for res in scored)
+    if n_rejected:
+        REJECTED.inc("not_enough_points", amount=n_rejected)
+    body = BatchPredictionResponse(results=[
+        BatchItem(error=NOT_ENOUGH_POINTS) if res is None else
+        BatchItem(predicted_event=res[0], aggressive_score=res[1], proba=res[2])
+        for res in scored]).model_dump_json(exclude_none=True)
+    STAGE.observe(time.perf_counter() - t0, "serialize")
+    return Response(body, media_type="application/json")
+
+async def _per_worker(section: str) -> dict:
+    workers = await pool.broadcast("info")
+    return {"workers": [{"enabled": True, **w[section]} if w[section] else {"enabled": False}
+                        for w in workers]}
+
+# ─── Streaming: one WebSocket per vehicle ───────────────────────────
+# Messages are plain JSON without pydantic: a point is
+#   {"latitude": .., "longitude": .., "timestamp": ..}  or  [lat, lon, timestamp]
+# (timestamp as ISO-8601 or epoch seconds), and a message may also be a
+# list of points. Every point gets one reply, in order, tagged with its
+# 0-based position in the stream:
+#   {"seq": n, "predicted_event": .., "aggressive_score": .., "proba": [..]}
+#   {"seq": n, "error": ".."}
+# A receiver task feeds a bounded queue and a scorer task drains it, so a
+# burst (e.g. after a reconnect) is scored in one call and one slow client
+# only ever stalls its own connection. Serving this with uvicorn needs the
+# `websockets` (or `wsproto`) package.
+stream_stats = {"active": 0, "opened": 0, "points": 0, "slow_closed": 0}
+
+def _parse_point(vehicle_id: int, item) -> tuple:
+    if isinstance(item, dict):
+        lat, lon, ts = item["latitude"], item["longitude"], item["timestamp"]
+    else:
+        lat, lon, ts = item
+    # one convention for both formats, naive UTC, so a vehicle that mixes
+    # them never subtracts an aware timestamp from a naive one
+    if isinstance(ts, (int, float)):
+        ts = datetime.datetime.fromtimestamp(ts, datetime.timezone.utc)
+    else:
+        ts = datetime.datetime.fromisoformat(ts)
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (vehicle_id, float(lat), float(lon), ts)
+
+def _stream_reply(seq: int, res) -> str:
+    if isinstance(res, str):
+        REJECTED.inc("invalid_point")
+        return json.dumps({"seq": seq, "error": res})
+    if res is None:
+        REJECTED.inc("not_enough_points")
+        return json.dumps({"seq": seq, "error": NOT_ENOUGH_POINTS})
+    return json.dumps({"seq": seq, "predicted_event": res[0],
+                       "aggressive_score": res[1], "proba": res[2]})
+
+@app.websocket("/stream/{vehicle_id}")
+async def stream(ws: WebSocket, vehicle_id: int):
+    await ws.accept()
+    inbox: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE)
+    stream_stats["active"] += 1
+    stream_stats["opened"] += 1
+
+    async def receive():
+        seq = 0
+        while True:
+            try:
+                msg = json.loads(await ws.receive_text())
+            except ValueError as exc:
+                msg = [f"invalid JSON: {exc}"]
+            burst = isinstance(msg, list) and msg and isinstance(msg[0], (list, dict, str))
+            for item in (msg if burst else [msg]):
+                try:
+                    point = item if isinstance(item, str) else _parse_point(vehicle_id, item)
+                except (KeyError, TypeError, ValueError) as exc:
+                    point = f"invalid point: {exc!r}"
+                await inbox.put((seq, point))    # blocks while the scorer is behind
+                seq += 1
+
+    async def score():
+        while True:
+            batch = [await inbox.get()]
+            while not inbox.empty():
+                batch.append(inbox.get_nowait())
+            points = [p for _, p in batch if isinstance(p, tuple)]
+            failed = None
+            try:
+                if pool is not None:
+                    scored = iter(await _score_via_pool(points))
+                else:
+                    scored = iter(await run_in_threadpool(_score_points, model, points))
+            except Exception as exc:
+                # every point of this batch gets an error reply; the stream stays open
+                failed = f"scoring failed: {exc!r}"
+            stream_stats["points"] += len(points)
+            for seq, p in batch:
+                if failed is not None and isinstance(p, tuple):
+                    REJECTED.inc("scoring_error")
+                    reply = json.dumps({"seq": seq, "error": failed})
+                else:
+                    reply = _stream_reply(seq, next(scored) if isinstance(p, tuple) else p)
+                await asyncio.wait_for(ws.send_text(reply), STREAM_SEND_TIMEOUT_S)
+
+    tasks = [asyncio.create_task(receive()), asyncio.create_task(score())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        exc = next(iter(done)).exception()
+        if isinstance(exc, asyncio.TimeoutError):
+            stream_stats["slow_closed"] += 1
+            await ws.close(code=1013, reason="client is not reading its results")
+        elif exc is not None and not isinstance(exc, WebSocketDisconnect):
+            await ws.close(code=1011)
+            raise exc
+    finally:
+        for t in tasks:
+            t.cancel()
+        stream_stats["active"] -= 1
+
+@app.get("/metrics")
+async def metrics():
+    collections, labels = [registry.collect()], [{}]
+    if pool is not None:
+        for i, families in enumerate(await pool.broadcast("metrics")):
+            collections.append(families)
+            labels.append({"worker": str(i)})
+    return Response(render(collections, labels), media_type="text/plain; version=0.0.4")
+
+# Divergence of live traffic from the training data, per model input and
+# for the predicted class mix (see driftSketch.report); with worker
+# processes their sketches are summed first.
+@app.get("/drift")
+async def drift():
+    if pool is not None:
+        snaps = [s for s in await pool.broadcast("drift") if s is not None]
+        snaps = [s for s in snaps if snaps and s["version"] == snaps[0]["version"]]
+    else:
+        snaps = [s for s in [drift_snapshot()] if s is not None]
+    if not snaps:
+        return {"enabled": False}
+    live = merge_drift([s["live"] for s in snaps])
+    return {"enabled": True, "version": snaps[0]["version"], "window": DRIFT_WINDOW,
+            **drift_report(snaps[0]["reference"], live)}
+
+@app.get("/stats/stream")
+def streaming_stats():
+    return stream_stats
+
+@app.get("/stats/batching")
+async def batching_stats():
+    if pool is not None:
+        return await _per_worker("batching")
+    if batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **batcher.stats()}
+
+@app.get("/stats/cache")
+async def cache_stats():
+    if pool is not None:
+        return await _per_worker("cache")
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+@app.get("/stats/admission")
+async def admission_stats():
+    if gate is None:
+        return {"enabled": False}
+    return {"enabled": True, "retry_after_s": ADMIT_RETRY_AFTER_S,
+            "degraded_predictor": DEGRADED_PREDICTOR or None, **gate.stats()}
+
+@app.get("/stats/cascade")
+async def cascade_stats():
+    if pool is not None:
+        return await _per_worker("cascade")
+    predictor = model.predictor
+    if not isinstance(predictor, CascadePredictor):
+        return {"enabled": False}
+    return {"enabled": True, **predictor.stats()}
+
+# ─── 5) Optional “python main.py” entry point ───────────────────────
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=SERVE_WORKERS,
+                    help="worker processes, vehicles sharded by vehicle_id")
+    args = ap.parse_args()
+    if args.workers > 1:
+        os.environ["SERVE_WORKERS"] = str(args.workers)
+        uvicorn.run("main:app", host="0.0.0.0", port=8000)
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
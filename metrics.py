@@ -0,0 +1,188 @@
+import time
+import bisect
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+# ─── Minimal Prometheus-style metrics ────────────────────────────────
+# Just enough of the exposition format for the predictor: cumulative
+# histograms, counters and callback gauges, all keyed by label values.
+# Recording is a bisect and a few additions under a per-metric lock, so it
+# is cheap enough for every request stage. collect() returns plain tuples
+# that can cross a process boundary; render() merges any number of
+# collections (e.g. one per serving worker) into one text page.
+
+# seconds; stage timings range from µs (window update) to ~100 ms (model)
+LATENCY_BUCKETS = (5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+                   1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series: dict = {}
+        self._lock = threading.Lock()
+
+    def _labels(self, values: tuple) -> dict:
+        return dict(zip(self.labelnames, values))
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0.0) + amount
+
+    def collect(self) -> list:
+        with self._lock:
+            return [("_total", self._labels(k), v) for k, v in self._series.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (),
+                 buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def collect(self) -> list:
+        out = []
+        with self._lock:
+            series = [(k, list(c), total, n) for k, (c, total, n) in self._series.items()]
+        for key, counts, total, n in series:
+            labels = self._labels(key)
+            cum = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                cum += c
+                out.append(("_bucket", {**labels, "le": _fmt(le)}, cum))
+            out.append(("_sum", labels, total))
+            out.append(("_count", labels, n))
+        return out
+
+
+class Gauge(_Metric):
+    # value read from fn() at scrape time; fn returns a number, or a dict of
+    # label-value tuples -> number for a labelled gauge
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable, labelnames: tuple = ()):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def collect(self) -> list:
+        value = self.fn()
+        if value is None:
+            return []
+        if isinstance(value, dict):
+            return [("", self._labels(k), v) for k, v in value.items()]
+        return [("", {}, value)]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: "OrderedDict[str, _Metric]" = OrderedDict()
+
+    def _add(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name!r} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable, labelnames: tuple = ()) -> Gauge:
+        return self._add(Gauge(name, help, fn, labelnames))
+
+    def collect(self) -> list:
+        # [(name, kind, help, [(suffix, labels, value), ...]), ...]
+        return [(m.name, m.kind, m.help, m.collect()) for m in self._metrics.values()]
+
+
+def render(collections: Iterable, extra_labels: Optional[Iterable[dict]] = None) -> str:
+    # collections: Registry.collect() results; extra_labels (same length)
+    # tags every sample of the matching collection, e.g. {"worker": "0"}
+    extra_labels = list(extra_labels) if extra_labels is not None else None
+    families: "OrderedDict[str, list]" = OrderedDict()
+    for i, families_i in enumerate(collections):
+        extra = extra_labels[i] if extra_labels is not None else {}
+        for name, kind, help, samples in families_i:
+            fam = families.setdefault(name, [kind, help, []])
+            fam[2].extend((suffix, {**extra, **labels}, v) for suffix, labels, v in samples)
+
+    lines = []
+    for name, (kind, help, samples) in families.items():
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            lines.append(f"{name}{suffix}{_fmt_labels(labels)} {_fmt(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+def _fmt_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return "{" + body + "}"
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+# ─── Pure ASGI timer: request start time and end-to-end latency ──────
+# Stamps scope["t_start"] before anything else runs, so handlers can time
+# body parsing + validation as (handler entry - t_start), and observes the
+# whole request once the last body chunk has been sent.
+class RequestTimer:
+    def __init__(self, app, histogram: Histogram, paths: tuple = ()):
+        self.app = app
+        self.histogram = histogram
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = scope["t_start"] = time.perf_counter()
+        path = scope["path"]
+        if self.paths and path not in self.paths:
+            return await self.app(scope, receive, send)
+
+        status = {"code": 0}
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                self.histogram.observe(time.perf_counter() - t0, path, str(status["code"]))
+
+        await self.app(scope, receive, timed_send)
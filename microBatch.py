@@ -0,0 +1,132 @@
+import time
+import asyncio
+from collections import deque
+from typing import Callable, Optional
+
+import numpy as np
+
+
+# ─── Coalesces concurrent single-row predictions into one model call ─
+# Requests that arrive while a batch is open (up to max_batch rows or
+# max_wait_ms after the first one) are stacked and scored by a single
+# predict_fn call in a worker thread; each caller gets back its own row.
+# A caller may pass its own predict_fn (e.g. the model it started on, so
+# a hot reload between submit and flush cannot mix two models); rows are
+# then scored in one call per distinct function, in arrival order.
+class MicroBatcher:
+    def __init__(self,
+                 predict_fn: Callable[[np.ndarray], np.ndarray],
+                 n_features: int,
+                 max_batch: int = 64,
+                 max_wait_ms: float = 2.0,
+                 stats_window: int = 10_000):
+        if max_batch < 1:
+            raise ValueError("max_batch must be >= 1")
+        self.predict_fn = predict_fn
+        self.n_features = n_features
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.batches = 0
+        self.rows = 0
+        self.max_seen = 0
+        self._sizes = deque(maxlen=stats_window)
+        self._delays = deque(maxlen=stats_window)   # seconds spent queued
+
+    async def submit(self, row: np.ndarray,
+                     predict_fn: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> np.ndarray:
+        if self._task is None:
+            self._start()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, fut, time.perf_counter(), predict_fn or self.predict_fn))
+        return await fut
+
+    def _start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        pending = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(pending) < self.max_batch:
+            # drain whatever is already queued without yielding
+            try:
+                pending.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return pending
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = await self._collect()
+            t_dispatch = time.perf_counter()
+            groups: dict = {}
+            for item in pending:
+                self._delays.append(t_dispatch - item[2])
+                groups.setdefault(item[3], []).append(item)
+            self._record(len(pending))
+
+            for predict_fn, group in groups.items():
+                X = np.empty((len(group), self.n_features))
+                for i, (row, _, _, _) in enumerate(group):
+                    X[i] = row
+                try:
+                    P = await loop.run_in_executor(None, predict_fn, X)
+                except Exception as exc:   # fan the failure out, keep serving
+                    for _, fut, _, _ in group:
+                        if not fut.done():
+                            fut.set_exception(exc)
+                    continue
+                for i, (_, fut, _, _) in enumerate(group):
+                    if not fut.done():     # caller may have gone away
+                        fut.set_result(P[i])
+
+    def _record(self, size: int) -> None:
+        self.batches += 1
+        self.rows += size
+        self.max_seen = max(self.max_seen, size)
+        self._sizes.append(size)
+
+    def stats(self) -> dict:
+        sizes = np.fromiter(self._sizes, float) if self._sizes else np.zeros(1)
+        delays = np.fromiter(self._delays, float) * 1000 if self._delays else np.zeros(1)
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "rows": self.rows,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batch_size": {
+                "mean": float(sizes.mean()),
+                "p50": float(np.percentile(sizes, 50)),
+                "p95": float(np.percentile(sizes, 95)),
+                "max": self.max_seen,
+            },
+            "queue_delay_ms": {
+                "mean": float(delays.mean()),
+                "p50": float(np.percentile(delays, 50)),
+                "p95": float(np.percentile(delays, 95)),
+                "p99": float(np.percentile(delays, 99)),
+            },
+        }
@@ -0,0 +1,169 @@
+import os
+import json
+import shutil
+import pathlib
+import datetime
+from typing import Optional, Sequence
+
+import xgboost as xgb
+
+from predictors import (TempScaler, FusedEnsemble, CascadePredictor, BoosterModel,
+                        member_booster)
+
+# ─── Versioned model bundle ──────────────────────────────────────────
+# artifacts/
+#   CURRENT                 ← name of the active version (swapped atomically)
+#   20250601_101500/
+#     manifest.json         ← temperature, classes, feature order, file list
+#     member_00.ubj …       ← every fold model, trimmed to best_iteration
+#     ensemble_fused.ubj    ← all members merged (FusedEnsemble)
+#     cascade_cheap.ubj     ← optional, cascade first stage
+#     student.ubj           ← optional, distilled model
+#     drift_reference.json  ← optional, training-data sketch (driftSketch.py)
+#
+# Everything is native XGBoost UBJSON, so loading needs neither pickle nor
+# a matching TempScaler class, and only the files the selected predictor
+# actually uses are ever read.
+BUNDLE_ROOT    = "artifacts"
+MANIFEST       = "manifest.json"
+CURRENT        = "CURRENT"
+BUNDLE_FORMAT  = 1
+PREDICTORS     = ("fused", "ensemble", "cascade", "student", "single")
+
+
+def save_bundle(calib: TempScaler,
+                classes: Sequence[str],
+                feature_order: Sequence[str],
+                root: str = BUNDLE_ROOT,
+                fused: Optional[FusedEnsemble] = None,
+                cheap: Optional[FusedEnsemble] = None,
+                cascade: Optional[dict] = None,
+                student: Optional[FusedEnsemble] = None,
+                drift: Optional[dict] = None,
+                version: Optional[str] = None,
+                activate: bool = True) -> pathlib.Path:
+    root = pathlib.Path(root)
+    version = version or f"{datetime.datetime.now():%Y%m%d_%H%M%S}"
+    final = root / version
+    if final.exists():
+        raise FileExistsError(f"bundle {final} already exists")
+    tmp = root / f".tmp-{version}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    members = []
+    for i, m in enumerate(calib.models):
+        name = f"member_{i:02d}.ubj"
+        member_booster(m).save_model(str(tmp / name))
+        members.append(name)
+
+    fused = fused or FusedEnsemble.from_temp_scaler(calib)
+    fused.save(str(tmp / "ensemble_fused.ubj"))
+
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": version,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "temperature": calib.T,
+        "classes": [str(c) for c in classes],
+        "feature_order": list(feature_order),
+        "ensemble": {"members": members, "fused": "ensemble_fused.ubj",
+                     "n_trees": fused.n_trees},
+    }
+    if cheap is not None and cascade is not None:
+        cheap.save(str(tmp / "cascade_cheap.ubj"))
+        manifest["cascade"] = {"cheap": "cascade_cheap.ubj", **cascade}
+    if student is not None:
+        student.save(str(tmp / "student.ubj"))
+        manifest["student"] = {"model": "student.ubj", "n_trees": student.n_trees}
+    if drift is not None:
+        (tmp / "drift_reference.json").write_text(json.dumps(drift), encoding="utf-8")
+        manifest["drift"] = "drift_reference.json"
+
+    (tmp / MANIFEST).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    os.replace(tmp, final)
+    if activate:
+        set_current(version, root)
+    return final
+
+
+def set_current(version: str, root: str = BUNDLE_ROOT) -> None:
+    root = pathlib.Path(root)
+    if not (root / version / MANIFEST).exists():
+        raise FileNotFoundError(f"no bundle {version!r} under {root}")
+    tmp = root / f".{CURRENT}.tmp"
+    tmp.write_text(version, encoding="utf-8")
+    os.replace(tmp, root / CURRENT)
+
+
+def current_version(root: str = BUNDLE_ROOT) -> Optional[str]:
+    try:
+        return (pathlib.Path(root) / CURRENT).read_text(encoding="utf-8").strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class ModelBundle:
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.manifest = json.loads((self.path / MANIFEST).read_text(encoding="utf-8"))
+        if self.manifest.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"{self.path}: unsupported bundle format "
+                             f"{self.manifest.get('format')!r}")
+
+    @classmethod
+    def current(cls, root: str = BUNDLE_ROOT) -> Optional["ModelBundle"]:
+        version = current_version(root)
+        return cls(pathlib.Path(root) / version) if version else None
+
+    @property
+    def version(self) -> str:
+        return self.manifest["version"]
+
+    @property
+    def classes(self) -> list:
+        return self.manifest["classes"]
+
+    @property
+    def feature_order(self) -> list:
+        return self.manifest["feature_order"]
+
+    def _file(self, name: str) -> str:
+        return str(self.path / name)
+
+    def drift_reference(self) -> Optional[dict]:
+        if "drift" not in self.manifest:
+            return None
+        return json.loads((self.path / self.manifest["drift"]).read_text(encoding="utf-8"))
+
+    def predictor(self, kind: str = "fused"):
+        m = self.manifest
+        if kind == "fused":
+            return FusedEnsemble.load(self._file(m["ensemble"]["fused"]))
+        if kind == "ensemble":
+            members = [BoosterModel(xgb.Booster(model_file=self._file(f)))
+                       for f in m["ensemble"]["members"]]
+            scaler = TempScaler(members)
+            scaler.T = m["temperature"]
+            return scaler
+        if kind == "student":
+            if "student" not in m:
+                raise ValueError(f"bundle {self.version} has no student model")
+            return FusedEnsemble.load(self._file(m["student"]["model"]))
+        if kind == "single":
+            # one calibrated fold model: the cascade's first stage if the
+            # bundle has one, else the first member at the ensemble's T
+            if "cascade" in m:
+                return FusedEnsemble.load(self._file(m["cascade"]["cheap"]))
+            scaler = TempScaler([BoosterModel(xgb.Booster(
+                model_file=self._file(m["ensemble"]["members"][0])))])
+            scaler.T = m["temperature"]
+            return scaler
+        if kind == "cascade":
+            if "cascade" not in m:
+                raise ValueError(f"bundle {self.version} has no cascade")
+            c = m["cascade"]
+            return CascadePredictor(FusedEnsemble.load(self._file(c["cheap"])),
+                                    self.predictor("fused"),
+                                    self.classes.index("Normal"), c["lo"], c["hi"])
+        raise ValueError(f"unknown predictor {kind!r}, expected one of {PREDICTORS}")
@@ -0,0 +1,112 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Hashable, Tuple
+
+# ─── Idempotent results for re-sent GPS fixes ────────────────────────
+# Retried HTTP calls and trackers replaying fixes after a connectivity drop
+# deliver the same (vehicle_id, timestamp, lat, lon) more than once. Adding
+# such a duplicate to the vehicle window would corrupt speed/acceleration
+# (dt collapses to the 1 s fallback) and cost another model call, so the
+# first result is kept here and handed back for every repeat.
+#
+# A key is claimed before the point is scored: concurrent duplicates of a
+# fix that is still being scored wait on the claim's Future instead of
+# scoring it a second time. In-flight claims are kept apart from the
+# results and are never evicted, so a fix that is still being scored
+# cannot lose its claim to the cap. Results expire ttl_seconds after they
+# were scored and the cache never holds more than max_entries of them
+# (oldest go first, so insertion order is also expiry order).
+HIT, PENDING, MISS = "hit", "pending", "miss"
+
+
+def cache_key(vehicle_id: Hashable, lat: float, lon: float, ts) -> tuple:
+    return (vehicle_id, ts, lat, lon)
+
+
+class PredictionCache:
+    def __init__(self,
+                 max_entries: int = 100_000,
+                 ttl_seconds: float = 300.0,
+                 clock=time.monotonic):
+        if max_entries < 1:
+            raise ValueError("max_entries must be >= 1")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        # key -> (stored_at, Future); a done Future holds the cached result
+        self._entries: "OrderedDict[tuple, Tuple[float, Future]]" = OrderedDict()
+        self._pending: "dict[tuple, Future]" = {}    # claimed, not resolved yet
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted_ttl = 0
+        self.evicted_full = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def claim(self, key: tuple) -> Tuple[str, Any]:
+        # (HIT, result) | (PENDING, Future of the in-flight result) |
+        # (MISS, Future): after a MISS the caller owns the key and must
+        # resolve() or fail() the returned Future
+        now = self._clock()
+        with self._lock:
+            self._evict(now)
+            fut = self._pending.get(key)
+            if fut is None:
+                entry = self._entries.get(key)
+                fut = entry[1] if entry is not None else None
+            if fut is not None:
+                self.hits += 1
+                if fut.done():
+                    return HIT, fut.result()
+                return PENDING, fut
+            self.misses += 1
+            fut = self._pending[key] = Future()
+        return MISS, fut
+
+    def resolve(self, key: tuple, fut: Future, result: Any) -> None:
+        # the claim becomes a cached result (and only now counts to the cap)
+        fut.set_result(result)
+        now = self._clock()
+        with self._lock:
+            if self._pending.get(key) is fut:
+                del self._pending[key]
+                self._entries[key] = (now, fut)
+                self._entries.move_to_end(key)
+                self._evict(now)
+
+    def fail(self, key: tuple, fut: Future, exc: BaseException) -> None:
+        # failures are not cached: waiters see the error, the next retry rescores
+        with self._lock:
+            if self._pending.get(key) is fut:
+                del self._pending[key]
+        fut.set_exception(exc)
+
+    def clear(self) -> None:
+        # in-flight claims stay: their owners still resolve or fail them
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"entries": len(self._entries), "pending": len(self._pending),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evicted_ttl": self.evicted_ttl, "evicted_full": self.evicted_full}
+
+    def _evict(self, now: float) -> None:
+        entries = self._entries
+        while entries:
+            key, (stored_at, fut) = next(iter(entries.items()))
+            if len(entries) > self.max_entries:
+                self.evicted_full += 1
+            elif now - stored_at > self.ttl_seconds:
+                self.evicted_ttl += 1
+            else:
+                break
+            entries.popitem(last=False)
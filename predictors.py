@@ -0,0 +1,362 @@
+import json
+import time
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from functools import partial
+from typing import Optional, Sequence
+
+import numpy as np
+import xgboost as xgb
+from scipy.special import softmax
+from scipy.optimize import minimize
+
+EPS = 1e-9
+
+
+# ─── Temperature-scaled fold ensemble (shared by training and serving) ─
+def _nll(proba: np.ndarray, y_true: np.ndarray) -> float:
+    eps = 1e-9
+    row_idx = np.arange(len(y_true))
+    return -np.log(proba[row_idx, y_true] + eps).mean()
+
+
+def array_fingerprint(X) -> tuple:
+    # content key of a feature matrix: shape, dtype, column names, values
+    cols = tuple(map(str, X.columns)) if hasattr(X, "columns") else None
+    a = np.ascontiguousarray(X.to_numpy() if hasattr(X, "to_numpy") else X)
+    return a.shape, a.dtype.str, cols, hashlib.blake2b(a, digest_size=16).hexdigest()
+
+
+# Averaged log-probabilities (before the temperature) of the last matrices
+# scored, keyed by array_fingerprint and evicted least-recently-used once
+# they hold more than cache_bytes. Off by default: serving scores new rows
+# on every call. Training turns it on so fitting T, the reports and the
+# metrics run the ensemble once per split. Pickles carry neither the
+# cached logits nor the setting.
+class TempScaler:
+    def __init__(self, models, cache_bytes: int = 0):
+        self.models = models
+        self.T = 1.0
+        self.cache_bytes = cache_bytes
+        self._reset_cache()
+
+    def _reset_cache(self):
+        self._cache: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_hits = self.cache_misses = 0
+
+    def __getstate__(self):
+        return {"models": self.models, "T": self.T}
+
+    def __setstate__(self, state):
+        self.models, self.T = state["models"], state["T"]
+        self.cache_bytes = 0
+        self._reset_cache()
+
+    def _avg_proba(self, X):
+        return np.mean([m.predict_proba(X) for m in self.models], axis=0)
+
+    def _avg_logits(self, X):
+        if not self.cache_bytes:
+            return np.log(self._avg_proba(X) + EPS)
+        key = array_fingerprint(X)
+        with self._cache_lock:
+            logits = self._cache.get(key)
+            if logits is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return logits
+        logits = np.log(self._avg_proba(X) + EPS)
+        logits.flags.writeable = False      # shared by every later caller
+        with self._cache_lock:
+            self.cache_misses += 1
+            if logits.nbytes <= self.cache_bytes:
+                self._cache[key] = logits
+                used = sum(v.nbytes for v in self._cache.values())
+                while used > self.cache_bytes:
+                    used -= self._cache.popitem(last=False)[1].nbytes
+        return logits
+
+    def fit(self, X_val, y_val):
+        logits = self._avg_logits(X_val)
+
+        obj = partial(
+            lambda t, lg, y: _nll(softmax(lg / t, axis=1), y),
+            lg=logits,
+            y=y_val,
+        )
+
+        result = minimize(obj, x0=[1.0], bounds=[(0.05, 10.0)])
+        self.T = float(result.x[0])
+        return self
+
+    def predict_proba(self, X):
+        logits = self._avg_logits(X) / self.T
+        return softmax(logits, axis=1)
+
+    def predict(self, X):
+        return self.predict_proba(X).argmax(axis=1)
+
+    @property
+    def feature_names(self) -> Optional[list]:
+        return member_booster(self.models[0]).feature_names
+
+
+class BoosterModel:
+    # predict_proba facade over a native multi-class booster, so boosters
+    # loaded from a bundle can sit in a TempScaler like XGBClassifiers
+    def __init__(self, booster: xgb.Booster):
+        self.booster = booster
+
+    def get_booster(self) -> xgb.Booster:
+        return self.booster
+
+    def predict_proba(self, X) -> np.ndarray:
+        return self.booster.inplace_predict(X)
+
+
+def member_booster(model) -> xgb.Booster:
+    # Booster restricted to the trees predict_proba actually uses, i.e. up to
+    # best_iteration when the member was fitted with early stopping.
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    try:
+        best = model.best_iteration
+    except AttributeError:
+        best = None
+    if best is not None and best + 1 < booster.num_boosted_rounds():
+        booster = booster[: best + 1]
+    return booster
+
+
+# ─── All members merged into one booster, scored in a single pass ────
+# Member m's trees are re-labelled into output groups m*C .. m*C+C-1 of a
+# single multi-class booster, so one inplace_predict returns every
+# member's margins side by side. Softmax per member, averaging, log and
+# temperature then reproduce TempScaler.predict_proba exactly, without
+# 15 separate DMatrix conversions and predict calls.
+class FusedEnsemble:
+    def __init__(self, booster: xgb.Booster, n_members: int, n_class: int,
+                 T: float, offsets: np.ndarray, n_trees: Optional[int] = None):
+        self.booster = booster
+        self.n_members = n_members
+        self.n_class = n_class
+        self.n_trees = n_trees
+        self.T = float(T)
+        self.offsets = np.asarray(offsets, dtype=np.float64).reshape(n_members, n_class)
+
+    @property
+    def feature_names(self) -> Optional[list]:
+        return self.booster.feature_names
+
+    @classmethod
+    def from_temp_scaler(cls, scaler: TempScaler) -> "FusedEnsemble":
+        boosters = [member_booster(m) for m in scaler.models]
+        n_class = int(json.loads(boosters[0].save_config())
+                      ["learner"]["learner_model_param"]["num_class"])
+        fused, n_trees = _merge_boosters(boosters, n_class)
+
+        # whatever each member adds on top of its trees (base_score /
+        # intercept) is recovered by comparing margins on a probe row
+        probe = np.zeros((1, fused.num_features()), dtype=np.float32)
+        merged = fused.inplace_predict(probe, predict_type="margin")
+        merged = np.asarray(merged, dtype=np.float64).reshape(len(boosters), n_class)
+        native = np.stack([np.asarray(b.inplace_predict(probe, predict_type="margin"),
+                                      dtype=np.float64).reshape(n_class)
+                           for b in boosters])
+        return cls(fused, len(boosters), n_class, scaler.T, native - merged, n_trees)
+
+    def _member_margins(self, X) -> np.ndarray:
+        margin = self.booster.inplace_predict(X, predict_type="margin")
+        margin = np.asarray(margin, dtype=np.float64)
+        return margin.reshape(len(margin), self.n_members, self.n_class) + self.offsets
+
+    def _avg_logits(self, X) -> np.ndarray:
+        proba = softmax(self._member_margins(X), axis=2).mean(axis=1)
+        return np.log(proba + EPS)
+
+    def predict_proba(self, X) -> np.ndarray:
+        return softmax(self._avg_logits(X) / self.T, axis=1)
+
+    def predict(self, X) -> np.ndarray:
+        return self.predict_proba(X).argmax(axis=1)
+
+    def save(self, path: str) -> None:
+        self.booster.set_attr(fused_ensemble=json.dumps({
+            "n_members": self.n_members,
+            "n_class": self.n_class,
+            "T": self.T,
+            "offsets": self.offsets.ravel().tolist(),
+            "n_trees": self.n_trees,
+        }))
+        self.booster.save_model(path)
+
+    @classmethod
+    def load(cls, path: str) -> "FusedEnsemble":
+        booster = xgb.Booster(model_file=path)
+        meta = json.loads(booster.attr("fused_ensemble"))
+        return cls(booster, meta["n_members"], meta["n_class"], meta["T"],
+                   meta["offsets"], meta.get("n_trees"))
+
+
+def _merge_boosters(boosters: Sequence[xgb.Booster], n_class: int):
+    models = [json.loads(b.save_raw("json")) for b in boosters]
+    out = models[0]
+    learner = out["learner"]
+    gbm = learner["gradient_booster"]["model"]
+
+    trees, tree_info, indptr = [], [], [0]
+    for m, model in enumerate(models):
+        src = model["learner"]["gradient_booster"]["model"]
+        if src["gbtree_model_param"]["num_parallel_tree"] != "1":
+            raise ValueError("fusing boosters with num_parallel_tree > 1 is not supported")
+        for tree, group in zip(src["trees"], src["tree_info"]):
+            tree["id"] = len(trees)
+            trees.append(tree)
+            tree_info.append(m * n_class + group)
+        base = indptr[-1]
+        indptr.extend(base + p for p in src["iteration_indptr"][1:])
+
+    n_out = len(models) * n_class
+    gbm["trees"] = trees
+    gbm["tree_info"] = tree_info
+    gbm["iteration_indptr"] = indptr
+    gbm["gbtree_model_param"]["num_trees"] = str(len(trees))
+    learner["learner_model_param"]["num_class"] = str(n_out)
+    learner["learner_model_param"]["base_score"] = "[" + ",".join(["0E0"] * n_out) + "]"
+    learner["objective"]["softmax_multiclass_param"]["num_class"] = str(n_out)
+    learner["attributes"] = {}
+
+    fused = xgb.Booster()
+    fused.load_model(bytearray(json.dumps(out).encode()))
+    return fused, len(trees)
+
+
+# ─── Cascade: cheap model first, full ensemble only when unsure ─────
+# Rows whose cheap "Normal" probability lands inside [lo, hi] are
+# re-scored by the full ensemble; everything outside the band keeps the
+# cheap answer. lo > hi means the band is empty (never escalate).
+class CascadePredictor:
+    def __init__(self, cheap, full, normal_idx: int, lo: float, hi: float):
+        self.cheap = cheap
+        self.full = full
+        self.normal_idx = normal_idx
+        self.lo = float(lo)
+        self.hi = float(hi)
+        self.rows = 0
+        self.escalated = 0
+        self._lock = threading.Lock()
+
+    @property
+    def feature_names(self) -> Optional[list]:
+        return self.full.feature_names
+
+    def predict_proba(self, X) -> np.ndarray:
+        P = self.cheap.predict_proba(X)
+        p_normal = P[:, self.normal_idx]
+        esc = (p_normal >= self.lo) & (p_normal <= self.hi)
+        n_esc = int(esc.sum())
+        if n_esc:
+            P[esc] = self.full.predict_proba(np.asarray(X)[esc])
+        with self._lock:
+            self.rows += len(P)
+            self.escalated += n_esc
+        return P
+
+    def predict(self, X) -> np.ndarray:
+        return self.predict_proba(X).argmax(axis=1)
+
+    def stats(self) -> dict:
+        return {"lo": self.lo, "hi": self.hi,
+                "rows": self.rows, "escalated": self.escalated,
+                "escalation_rate": self.escalated / self.rows if self.rows else 0.0}
+
+
+def fit_cascade_band(P_cheap: np.ndarray, P_full: np.ndarray, normal_idx: int,
+                     target: float = 0.99, grid: int = 200) -> dict:
+    # Narrowest contiguous band of cheap p(Normal) to escalate so that the
+    # cascade's labels agree with the full ensemble on >= target of rows.
+    # Rows are sorted by p(Normal); any band is a slice [i, j) of that
+    # order, and prefix sums of cheap/full disagreement score every slice.
+    p = P_cheap[:, normal_idx]
+    n = len(p)
+    order = np.argsort(p, kind="stable")
+    p_sorted = p[order]
+    disagree = (P_cheap.argmax(axis=1) != P_full.argmax(axis=1))[order]
+    cum = np.concatenate([[0], np.cumsum(disagree)])
+
+    cuts = np.unique(np.linspace(0, n, grid + 1).astype(int))
+    i, j = np.meshgrid(cuts, cuts, indexing="ij")
+    agreement = 1.0 - (cum[-1] - (cum[j] - cum[i])) / n
+    escalation = (j - i) / n
+    ok = (i <= j) & (agreement >= target)
+    # full escalation (i=0, j=n) always qualifies, so ok is never empty
+    cand = np.flatnonzero(ok)
+    best = cand[np.lexsort((-agreement.flat[cand], escalation.flat[cand]))[0]]
+    bi, bj = i.flat[best], j.flat[best]
+
+    if bi == bj:
+        lo, hi = 1.0, 0.0
+    else:
+        lo, hi = float(p_sorted[bi]), float(p_sorted[bj - 1])
+    esc = (p >= lo) & (p <= hi)
+    labels = np.where(esc, P_full.argmax(axis=1), P_cheap.argmax(axis=1))
+    return {"lo": lo, "hi": hi, "target": target,
+            "agreement": float((labels == P_full.argmax(axis=1)).mean()),
+            "escalation_rate": float(esc.mean())}
+
+
+# ─── CLI: build temp_scal_fused.ubj, check parity, time both paths ───
+def bench_ms(fn, X, reps: int = 20) -> float:
+    # median wall time of fn(X) in milliseconds
+    fn(X)                                   # warm-up
+    times = []
+    for _ in range(reps):
+        t = time.perf_counter()
+        fn(X)
+        times.append(time.perf_counter() - t)
+    return float(np.median(times)) * 1000
+
+
+def main(argv=None):
+    import os
+    import pandas as pd
+    from joblib import load
+
+    ap = argparse.ArgumentParser(description="Fuse temp_scal.pkl into one booster")
+    ap.add_argument("--scaler", default="temp_scal.pkl")
+    ap.add_argument("--out", default="temp_scal_fused.ubj")
+    ap.add_argument("--data", default="telemetry.csv",
+                    help="rows used for the parity check (random rows if missing)")
+    ap.add_argument("--atol", type=float, default=1e-5)
+    ap.add_argument("--reps", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    scaler = load(args.scaler)
+    fused = FusedEnsemble.from_temp_scaler(scaler)
+
+    n_feat = fused.booster.num_features()
+    if os.path.exists(args.data):
+        X = pd.read_csv(args.data, nrows=4096).drop(columns=["EventType"]).values
+    else:
+        X = np.random.default_rng(0).normal(size=(4096, n_feat))
+
+    diff = np.abs(fused.predict_proba(X) - scaler.predict_proba(X)).max()
+    print(f"parity: max |Δproba| = {diff:.2e} over {len(X)} rows")
+    if diff > args.atol:
+        raise SystemExit(f"fused ensemble differs from TempScaler by {diff:.2e} > {args.atol}")
+
+    for n in (1, 1024):
+        Xb = np.ascontiguousarray(X[:n])
+        t_ref = bench_ms(scaler.predict_proba, Xb, args.reps)
+        t_fus = bench_ms(fused.predict_proba, Xb, args.reps)
+        print(f"batch {n:>5}: TempScaler {t_ref:8.3f} ms | fused {t_fus:8.3f} ms"
+              f" | x{t_ref / t_fus:5.1f}")
+
+    fused.save(args.out)
+    print(f"saved {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import inspect
+import pathlib
+import datetime
+from typing import Any, Callable, Iterable, Optional, Tuple
+
+import joblib
+
+# ─── Fingerprinted pipeline-stage cache ──────────────────────────────
+# .stage_cache/
+#   ensemble/                  ← one directory per stage
+#     3f9c…/                   ← fingerprint of the stage's inputs
+#       meta.json              ← run id, inputs, created, seconds
+#       result.pkl             ← whatever the stage returned (joblib)
+#
+# A stage's inputs are plain JSON values: the data hash, its parameters,
+# code_version() of the functions it runs, and the run id of every stage
+# it consumes. A stage whose fingerprint already has an entry is loaded
+# instead of recomputed. The run id (fingerprint + creation time) rather
+# than the fingerprint is passed downstream, so recomputing a stage on
+# purpose (force) also invalidates everything built from its old output.
+CACHE_DIR = os.getenv("STAGE_CACHE_DIR", ".stage_cache")
+
+
+def fingerprint(value) -> str:
+    blob = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(blob.encode(), digest_size=12).hexdigest()
+
+
+def code_version(*objs) -> str:
+    # hash of the source of functions, classes or modules a stage runs
+    h = hashlib.blake2b(digest_size=8)
+    for obj in objs:
+        h.update(inspect.getsource(obj).encode())
+    return h.hexdigest()
+
+
+class StageCache:
+    def __init__(self, root: str = CACHE_DIR, force: Iterable[str] = ()):
+        self.root = pathlib.Path(root)
+        self.force = set(force)
+
+    def _entry(self, name: str, inputs: dict) -> pathlib.Path:
+        return self.root / name / fingerprint(inputs)
+
+    def peek(self, name: str, inputs: dict) -> Optional[dict]:
+        # meta of the stored entry for these inputs, None if stale
+        meta = self._entry(name, inputs) / "meta.json"
+        if name in self.force or not meta.exists():
+            return None
+        return json.loads(meta.read_text(encoding="utf-8"))
+
+    def run(self, name: str, inputs: dict, compute: Callable[[], Any]) -> Tuple[Any, str]:
+        # (result, run id): loaded when fresh, else computed and stored
+        entry = self._entry(name, inputs)
+        meta = self.peek(name, inputs)
+        if meta is not None:
+            print(f"[{name}] cached {meta['id']}  (built {meta['created']}, "
+                  f"{meta['seconds']:.1f} s)")
+            return joblib.load(entry / "result.pkl"), meta["id"]
+
+        t = time.perf_counter()
+        result = compute()
+        secs = time.perf_counter() - t
+
+        tmp = entry.with_name(f".tmp-{entry.name}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        joblib.dump(result, tmp / "result.pkl")
+        meta = {"id": f"{entry.name}.{time.time_ns():x}",
+                "stage": name,
+                "inputs": inputs,
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "seconds": secs}
+        (tmp / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+        self.force.discard(name)
+        print(f"[{name}] computed {meta['id']}  ({secs:.1f} s)")
+        return result, meta["id"]
@@ -0,0 +1,5 @@
+import sys
+import pathlib
+
+# the modules live at the repository root, not in a package
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
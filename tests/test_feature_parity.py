@@ -0,0 +1,113 @@
+import json
+
+import numpy as np
+import pytest
+
+import vehicleState
+from featureSpec import (LAYOUT, FEATURE_COLUMNS, MANIFEST_PATH, WINDOWS, check_layout,
+                         check_manifest, incremental_features, manifest,
+                         vectorised_features, _tracks)
+
+RTOL = 1e-9
+
+
+def assert_parity(a: np.ndarray, b: np.ndarray, columns=range(len(FEATURE_COLUMNS))):
+    # same missing values, and relative differences within RTOL
+    for j in columns:
+        name = FEATURE_COLUMNS[j]
+        assert np.array_equal(np.isnan(a[:, j]), np.isnan(b[:, j])), f"{name}: NaN pattern"
+        ok = ~np.isnan(a[:, j])
+        rel = np.abs(a[ok, j] - b[ok, j]) / np.maximum(np.abs(a[ok, j]), 1.0)
+        assert rel.max(initial=0.0) <= RTOL, f"{name} differs by {rel.max():.2e}"
+
+
+@pytest.fixture(scope="module")
+def tracks():
+    # 8 tracks of 300 points (the first a single point) and the incremental
+    # executor's rows for each
+    return [(t, incremental_features(*t)) for t in _tracks(8, 300)]
+
+
+# ─── Executors ───────────────────────────────────────────────────────
+@pytest.mark.parametrize("window", WINDOWS)
+@pytest.mark.parametrize("chunk", [1, 7, 100, 10_000])
+def test_batch_features_match_feature_builder(tracks, window, chunk):
+    columns = [i for i, c in enumerate(LAYOUT) if c.window == window]
+    assert columns
+    for (lat, lon, t), expected in tracks:
+        assert_parity(expected, vectorised_features(lat, lon, t, chunk), columns)
+
+
+@pytest.mark.parametrize("chunk", [1, 100])
+def test_point_features_match_feature_builder(tracks, chunk):
+    columns = [i for i, c in enumerate(LAYOUT) if c.window is None]
+    for (lat, lon, t), expected in tracks:
+        assert_parity(expected, vectorised_features(lat, lon, t, chunk), columns)
+
+
+def test_first_point_is_not_scored(tracks):
+    for _, X in tracks:
+        assert np.isnan(X[0]).all()
+        assert not np.isnan(X[1:, [c.window is None for c in LAYOUT]]).any()
+
+
+# ─── Running-sum resync ──────────────────────────────────────────────
+def test_resync_wraps_around_the_ring():
+    # past two real resyncs: the rebuilt sums carry on where the running
+    # ones left off
+    lat, lon, t = _tracks(2, 2 * vehicleState._RESYNC_EVERY + 17, seed=1)[1]
+    assert_parity(incremental_features(lat, lon, t), vectorised_features(lat, lon, t, 1000))
+
+
+@pytest.mark.parametrize("every", [3, 5, 8, 9])
+def test_resync_at_every_ring_offset(monkeypatch, every):
+    # resyncs landing on every slot of the 8-point ring, including
+    # before the ring first wraps
+    lat, lon, t = _tracks(2, 120, seed=2)[1]
+    without = incremental_features(lat, lon, t)
+    monkeypatch.setattr(vehicleState, "_RESYNC_EVERY", every)
+    with_resync = incremental_features(lat, lon, t)
+    assert_parity(without, with_resync)
+    assert_parity(with_resync, vectorised_features(lat, lon, t, 50))
+
+
+# ─── Layout and manifest ─────────────────────────────────────────────
+def test_manifest_file_matches_spec():
+    check_manifest()
+    stored = json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
+    assert stored["columns"] == list(FEATURE_COLUMNS)
+    assert stored["windows"] == list(WINDOWS)
+
+
+def test_check_layout_accepts_the_layout():
+    check_layout(FEATURE_COLUMNS, "test")
+    check_layout(list(FEATURE_COLUMNS), "test")
+
+
+@pytest.mark.parametrize("columns, why", [
+    (FEATURE_COLUMNS[1:], "missing"),
+    (FEATURE_COLUMNS + ("extra",), "unexpected"),
+    (FEATURE_COLUMNS[1:] + FEATURE_COLUMNS[:1], "another order"),
+])
+def test_check_layout_rejects(columns, why):
+    with pytest.raises(ValueError, match=why):
+        check_layout(columns, "test")
+
+
+def test_check_manifest_rejects_reordered_columns(tmp_path):
+    stored = manifest()
+    stored["columns"] = stored["columns"][::-1]
+    path = tmp_path / "feature_manifest.json"
+    path.write_text(json.dumps(stored), encoding="utf-8")
+    with pytest.raises(ValueError, match="another order"):
+        check_manifest(path)
+
+
+def test_check_manifest_rejects_changed_definitions(tmp_path):
+    stored = manifest()
+    stored["spec"][0][2] = "changed"
+    path = tmp_path / "feature_manifest.json"
+    path.write_text(json.dumps(stored), encoding="utf-8")
+    with pytest.raises(ValueError, match="definitions changed"):
+        check_manifest(path)
+
@@ -1,29 +1,72 @@
-import io, sys, warnings, gc, datetime, json, pathlib, joblib, optuna
+import io, os, sys, warnings, gc, datetime, json, pathlib, argparse, joblib, optuna, foldMatrices
 import numpy as np, pandas as pd, matplotlib.pyplot as plt, seaborn as sns
 from optuna.pruners import HyperbandPruner
-from scipy.special import softmax
+from optuna.storages import JournalStorage
+from optuna.storages.journal import JournalFileBackend
+from optuna.study import MaxTrialsCallback
+from optuna.trial import TrialState
 from sklearn.preprocessing import LabelEncoder
 from sklearn.utils.class_weight import compute_class_weight
 from sklearn.model_selection import StratifiedKFold
 from sklearn.metrics import f1_score, confusion_matrix, classification_report, accuracy_score
 from xgboost import XGBClassifier
-from scipy.optimize import minimize
-from functools import partial
+from scipy.special import softmax
+
+from predictors import TempScaler, FusedEnsemble, BoosterModel, EPS, fit_cascade_band, bench_ms
+from foldMatrices import FoldMatrices, booster_params, fit_booster, weighted_matrix
+from modelBundle import save_bundle
+from trainingData import load_cached, source_hash
+from stageCache import StageCache, code_version, fingerprint
+from trainScheduler import cpu_budget, split_budget, run_parallel
+from featureSpec import check_layout
+from driftSketch import build_reference
 
 
 warnings.filterwarnings("ignore")
 sns.set_style("whitegrid")
 
 
+DATA_PATH    = "telemetry.csv"
 RANDOM_STATE = 42
 CV_FOLDS     = 5
 N_TRIALS     = 30
-OPTUNA_JOBS  = 4
+OPTUNA_JOBS  = 4        # tuning worker processes sharing the study
+STUDY_NAME   = "aggressive-driver-xgb"   # + fingerprint of data and search space
+STUDY_JOURNAL = os.getenv("OPTUNA_JOURNAL", "optuna_journal.log")
+CASCADE_TARGET = 0.99   # min label agreement of cascade vs full ensemble (valid)
+DISTILL_MAX_TREES = 500 # student budget: total trees (rounds × classes)
+DISTILL_MAX_DEPTH = 6
+DISTILL_LABEL_WEIGHT = 0.0  # share of one-hot label in the student targets (opt-in mix)
+TOP_K        = 3
+LOGIT_CACHE_BYTES = 512 << 20   # ensemble logits kept per calibrated model while evaluating
+CURVE_SIZES  = np.linspace(0.1, 1.0, 10)
+
+
+def load_data(path=DATA_PATH):
+    # float32 view over the memory-mapped cache (trainingData.py): row
+    # ranges (X.iloc[:t]) stay views, only fold index sets get copied
+    X, codes, columns, classes = load_cached(path)
+    check_layout(columns, path)
+    X = pd.DataFrame(X, columns=columns, copy=False)
+    return X, pd.Series(pd.Categorical.from_codes(codes, classes), name="EventType")
+
+
+def load_split(path=DATA_PATH):
+    # (X, label encoder, train, valid, test, class weights); chronological
+    # 70/15/15 split, each part an (X, y) pair
+    X,y_raw=load_data(path)
+    le=LabelEncoder().fit(y_raw)
+    y=le.transform(y_raw)
+    N=len(X)
+    t,v=int(.7*N), int(.85*N)
+    cls_w = compute_class_weight('balanced',classes=np.unique(y),y=y)
+    return X, le, (X.iloc[:t],y[:t]), (X.iloc[t:v],y[t:v]), (X.iloc[v:],y[v:]), cls_w
 
 
-def load_data(path="telemetry.csv"):
-    df = pd.read_csv(path)
-    return df.drop(columns=["EventType"]), df["EventType"]
+def train_folds(X_tr, y_tr, cls_w):
+    # one quantized matrix per CV fold, reused by every trial and the ensemble
+    cv = StratifiedKFold(n_splits=CV_FOLDS, shuffle=True, random_state=RANDOM_STATE)
+    return FoldMatrices(X_tr, y_tr, cls_w, cv.split(X_tr, y_tr))
 
 
 def plot_conf_matrix(y_true, y_pred, labels, title, cmap="Blues"):
@@ -86,89 +129,55 @@ def plot_separate_learning_curves(sizes, oof_curve, va_curve, te_curve):
     plt.close()
 
 
-def _nll(proba: np.ndarray, y_true: np.ndarray) -> float:
-    eps = 1e-9
-    row_idx = np.arange(len(y_true))
-    return -np.log(proba[row_idx, y_true] + eps).mean()
-
-
-class TempScaler:
-    def __init__(self, models):
-        self.models = models
-        self.T = 1.0
-
-    def _avg_proba(self, X):
-        return np.mean([m.predict_proba(X) for m in self.models], axis=0)
-
-    def _avg_logits(self, X):
-        eps = 1e-9
-        return np.log(self._avg_proba(X) + eps)
-
-    def fit(self, X_val, y_val):
-        logits = self._avg_logits(X_val)
-
-        obj = partial(
-            lambda t, lg, y: _nll(softmax(lg / t, axis=1), y),
-            lg=logits,
-            y=y_val,
-        )
-
-        result = minimize(obj, x0=[1.0], bounds=[(0.05, 10.0)])
-        self.T = float(result.x[0])
-        return self
-
-    def predict_proba(self, X):
-        logits = self._avg_logits(X) / self.T
-        return softmax(logits, axis=1)
-
-    def predict(self, X):
-        return self.predict_proba(X).argmax(axis=1)
-
+def distill_student(X, teacher_proba, n_class, n_jobs=-1):
+    # Soft-label distillation: every row is repeated once per class with
+    # that class as label and the teacher's probability as weight, so the
+    # student's multi-class log-loss is the cross-entropy to the teacher.
+    keep = teacher_proba >= 1e-4
+    rows, cls = np.nonzero(keep)
+    student = XGBClassifier(
+        tree_method="hist",
+        n_estimators=max(1, DISTILL_MAX_TREES // n_class),
+        max_depth=DISTILL_MAX_DEPTH,
+        learning_rate=0.1,
+        subsample=0.8,
+        colsample_bytree=0.9,
+        objective="multi:softprob",
+        num_class=n_class,
+        random_state=RANDOM_STATE,
+        n_jobs=n_jobs,
+    )
+    student.fit(X.iloc[rows], cls, sample_weight=teacher_proba[rows, cls], verbose=False)
+    return student
 
-def make_objective(X, y, row_w):
-    uniq_y = np.unique(y)
-    kfold = StratifiedKFold(CV_FOLDS, shuffle=True, random_state=RANDOM_STATE)
 
+def make_objective(folds, n_class, nthread=-1):
     def obj(trial):
         # ─── hyper‑parameter space ──────────────────────────────────────
-        params = {
-            "tree_method"      : "hist",
-            "n_estimators"     : trial.suggest_int   ("n_estimators",   900, 1600, step=100),
-            "max_depth"        : trial.suggest_int   ("max_depth",        6,    9),
-            "learning_rate"    : trial.suggest_float("lr",             0.06, 0.12, log=True),
-            "subsample"        : trial.suggest_float("subsample",      0.70, 0.85),
-            "colsample_bytree" : trial.suggest_float("col_bt",         0.75, 0.92),
-            "min_child_weight" : trial.suggest_float("mcw",             1.0,  6.0, log=True),
-            "gamma"            : trial.suggest_float("gamma",          0.05, 0.40),
-            "reg_alpha"        : trial.suggest_float("alpha",           0.0,  1.5),
-            "reg_lambda"       : trial.suggest_float("lambda",          1.0,  5.0),
-            "grow_policy"      : trial.suggest_categorical("grow", ["depthwise", "lossguide"]),
-            "objective"        : "multi:softprob",
-            "num_class"        : len(uniq_y),
-            "random_state"     : RANDOM_STATE,
-            "n_jobs"           : -1,
-            "eval_metric"      : "mlogloss",
-            "early_stopping_rounds": 50,
-        }
-
-        # ─── cross‑validated weighted F1 ────────────────────────────────
+        trial.suggest_int   ("n_estimators",   900, 1600, step=100)
+        trial.suggest_int   ("max_depth",        6,    9)
+        trial.suggest_float("lr",             0.06, 0.12, log=True)
+        trial.suggest_float("subsample",      0.70, 0.85)
+        trial.suggest_float("col_bt",         0.75, 0.92)
+        trial.suggest_float("mcw",             1.0,  6.0, log=True)
+        trial.suggest_float("gamma",          0.05, 0.40)
+        trial.suggest_float("alpha",           0.0,  1.5)
+        trial.suggest_float("lambda",          1.0,  5.0)
+        trial.suggest_categorical("grow", ["depthwise", "lossguide"])
+        params, rounds = booster_params(trial.params, n_class, RANDOM_STATE, nthread)
+
+        # ─── cross‑validated weighted F1 on the shared fold matrices ────
         fold_scores = []
-        for tr_idx, va_idx in kfold.split(X, y):
-            model = XGBClassifier(**params)
-            model.fit(
-                X.iloc[tr_idx],
-                y[tr_idx],
-                sample_weight=row_w[y[tr_idx]],
-                eval_set=[(X.iloc[va_idx], y[va_idx])],
-                verbose=False,
-            )
+        for k in range(len(folds)):
+            booster, fold = folds.train(k, params, rounds, early_stopping_rounds=50)
 
             fold_scores.append(
-                f1_score(y[va_idx], model.predict(X.iloc[va_idx]), average="weighted")
+                f1_score(fold.y_valid, booster.inplace_predict(fold.X_valid).argmax(1),
+                         average="weighted")
             )
 
-            # report to Optuna for pruning
-            trial.report(np.mean(fold_scores), step=model.best_iteration)
+            # report to Optuna for pruning: one step per finished fold
+            trial.report(np.mean(fold_scores), step=k)
             if trial.should_prune():
                 raise optuna.TrialPruned()
 
@@ -176,91 +185,272 @@ def make_objective(X, y, row_w):
 
     return obj
 
-def main():
-    # ── capture everything that gets printed ────────────────────────────
-    capture_buf = io.StringIO()
-    sys_stdout_orig = sys.stdout
-    sys.stdout = capture_buf
 
-    X,y_raw=load_data()
-    le=LabelEncoder().fit(y_raw)
-    y=le.transform(y_raw)
-    N=len(X)
-    t,v=int(.7*N), int(.85*N)
-    X_tr,y_tr=X.iloc[:t],y[:t]
-    X_va,y_va=X.iloc[t:v],y[t:v]
-    X_te,y_te=X.iloc[v:],y[v:]
-    cls_w = compute_class_weight('balanced',classes=np.unique(y),y=y)
+# ─── Persistent study ───────────────────────────────────────────────
+# Trials live in a journal file, so an interrupted run resumes with the
+# remaining trials and several processes (tuning workers, or
+# `--tune-only` from another shell) can work on the same study. The study
+# name carries a fingerprint of the data and the search space (see
+# study_name), so new data or a new space starts a new study.
+# The journal has no heartbeats: trials left RUNNING by a killed process
+# are failed by main() before it tunes (see fail_stale_trials), so don't
+# start main() while --tune-only workers are still running.
+_DONE = (TrialState.COMPLETE, TrialState.PRUNED)
+
+
+def split_version():
+    # what fixes the rows every stage trains and scores on: the 70/15/15
+    # split, the CV folds and their seed
+    return {"folds": CV_FOLDS, "seed": RANDOM_STATE,
+            "code": code_version(load_data, load_split, train_folds)}
+
 
-    study = optuna.create_study(
+def study_name(data_hash):
+    return f"{STUDY_NAME}-" + fingerprint({
+        "data": data_hash, "split": split_version(),
+        "code": code_version(make_objective, load_study, _tune_worker, foldMatrices),
+    })[:10]
+
+
+def load_study(name, seed=RANDOM_STATE):
+    # every process gets its own sampler seed, so they don't propose the
+    # same parameters; the pruner only depends on the study and trial
+    return optuna.create_study(
+        study_name=name,
+        storage=JournalStorage(JournalFileBackend(STUDY_JOURNAL)),
+        load_if_exists=True,
         direction='maximize',
         sampler=optuna.samplers.TPESampler(
             multivariate=True,
-            seed=RANDOM_STATE
+            seed=seed
         ),
         pruner=HyperbandPruner(
-            min_resource=200,
-            max_resource=1600,
+            min_resource=1,
+            max_resource=CV_FOLDS,
             reduction_factor=3
         )
     )
-    study.optimize(
-        make_objective(X_tr,y_tr,cls_w),
-        n_trials=N_TRIALS,
-        n_jobs=OPTUNA_JOBS,
-        show_progress_bar=False
-    )
-    topK = 3
+
+
+def fail_stale_trials(study):
+    stale = study.get_trials(deepcopy=False, states=(TrialState.RUNNING,))
+    for t in stale:
+        study.tell(t.number, state=TrialState.FAIL)
+    return len(stale)
+
+
+# ─── Process-pool tasks ─────────────────────────────────────────────
+# Workers load the memory-mapped split once (pool initializer); inline
+# runs reuse the parent's split and its already-built fold matrices.
+_WORKER = {}
+
+
+def _init_worker(path):
+    split = load_split(path)
+    _WORKER.update(split=split, folds=train_folds(*split[2], split[5]))
+
+
+def _tune_worker(name, i, n_trials, nthread):
+    # join the study and run trials until n_trials are complete or pruned
+    study = load_study(name, RANDOM_STATE + i)
+    remaining = n_trials - len(study.get_trials(deepcopy=False, states=_DONE))
+    if remaining > 0:
+        n_class = len(_WORKER["split"][1].classes_)
+        study.optimize(make_objective(_WORKER["folds"], n_class, nthread),
+                       n_trials=remaining,
+                       callbacks=[MaxTrialsCallback(n_trials, states=_DONE)],
+                       show_progress_bar=False)
+    return len(study.get_trials(deepcopy=False, states=_DONE))
+
+
+def _ensemble_fold(k, trial_params, nthread):
+    # fold k of every top-K trial: [(booster, OOF probas of fold k)]
+    n_class = len(_WORKER["split"][1].classes_)
+    folds = _WORKER["folds"]
+    out = []
+    for tp in trial_params:
+        params, rounds = booster_params(tp, n_class, RANDOM_STATE, nthread)
+        booster, fold = folds.train(k, params, rounds, early_stopping_rounds=80)
+        out.append((booster, booster.inplace_predict(fold.X_valid)))
+    return out
+
+
+def _curve_point(frac, trial_params, nthread):
+    # (Train OOF, Valid, Test) weighted F1 of the best trial on the first
+    # frac of the training rows
+    X, le, (X_tr, y_tr), (X_va, y_va), (X_te, y_te), cls_w = _WORKER["split"]
+    n_class = len(le.classes_)
+    params, rounds = booster_params(trial_params, n_class, RANDOM_STATE, nthread)
+    n = int(len(X_tr) * frac)
+
+    cv = StratifiedKFold(n_splits=CV_FOLDS, shuffle=True,
+                         random_state=RANDOM_STATE)
+    oof = np.zeros((n, n_class))
+    y_sub = y_tr[:n]
+    X_sub = X_tr.iloc[:n]
+    sub_folds = FoldMatrices(X_sub, y_sub, cls_w, cv.split(X_sub, y_sub))
+
+    for k in range(len(sub_folds)):
+        m, fold = sub_folds.train(k, params, rounds)
+        oof[fold.valid_idx] = m.inplace_predict(fold.X_valid)
+
+    m_full = fit_booster(params, rounds, weighted_matrix(X_sub, y_sub, cls_w))
+
+    return (f1_score(y_sub, oof.argmax(1), average='weighted'),
+            f1_score(y_va, m_full.inplace_predict(X_va).argmax(1), average='weighted'),
+            f1_score(y_te, m_full.inplace_predict(X_te).argmax(1), average='weighted'))
+
+
+# ─── Pipeline stages ────────────────────────────────────────────────
+# Cached stages (tune → ensemble → calibrate → student, tune → curves)
+# persist their results in the StageCache under a fingerprint of the
+# data, their parameters, the code they run and the upstream run ids;
+# report (metrics, plots) and save (pickles, bundle, run log) are cheap
+# and always recomputed from those results.
+STAGES = ("tune", "ensemble", "calibrate", "student", "curves", "report", "save")
+NEEDS  = {
+    "tune"     : (),
+    "ensemble" : ("tune",),
+    "calibrate": ("ensemble",),
+    "student"  : ("ensemble", "calibrate"),
+    "curves"   : ("tune",),
+    "report"   : ("tune", "ensemble", "calibrate", "student"),
+    "save"     : ("tune", "calibrate", "student"),
+}
+
+
+def with_needs(stages):
+    out = set()
+    todo = list(stages)
+    while todo:
+        st = todo.pop()
+        if st not in out:
+            out.add(st)
+            todo.extend(NEEDS[st])
+    return [st for st in STAGES if st in out]
+
+
+def stage_tune(name, budget):
+    tune_workers, tune_threads = split_budget(OPTUNA_JOBS, budget)
+    study = load_study(name)
+    stale = fail_stale_trials(study)
+    done = len(study.get_trials(deepcopy=False, states=_DONE))
+    print(f"Study {name} ({STUDY_JOURNAL}): {done}/{N_TRIALS} trials done"
+          + (f", {stale} interrupted trial(s) marked failed" if stale else "")
+          + f"  |  tuning {tune_workers} worker(s) × {tune_threads} thread(s)")
+    run_parallel(_tune_worker,
+                 [(name, i, N_TRIALS, tune_threads) for i in range(tune_workers)],
+                 tune_workers, "tuning",
+                 names=[f"worker {i}" for i in range(tune_workers)],
+                 initializer=_init_worker, initargs=(DATA_PATH,))
+    study = load_study(name)
     best_trials = sorted(
-        study.trials,
+        study.get_trials(deepcopy=False, states=(TrialState.COMPLETE,)),
         key=lambda t: t.value,
         reverse=True
-    )[:topK]
+    )[:TOP_K]
+    if not best_trials:
+        # every trial pruned or failed (e.g. a resumed journal that was
+        # already at N_TRIALS): nothing to build an ensemble from
+        raise RuntimeError(f"study {name} in {STUDY_JOURNAL} has no completed trial; "
+                           f"raise N_TRIALS or start over with --fresh")
+    return {"best_value": study.best_value, "best_params": study.best_params,
+            "top_params": [t.params for t in best_trials]}
 
-    print(f"Optuna best OOF‑CV F1: {study.best_value:.4f}  |  "f"building ensemble from top‑{topK} trials")
 
+def stage_ensemble(tune, budget):
     # ── 5‑fold × top‑K parameter ensembles – accumulate probas ──
-    cv = StratifiedKFold(n_splits=CV_FOLDS, shuffle=True, random_state=RANDOM_STATE)
+    # one task per fold (its matrices are built once, then shared by the
+    # top-K fits); members are collected trial-major as before
+    X, le, (X_tr, y_tr), _, _, _ = _WORKER["split"]
     n_class = len(le.classes_)
+    top = tune["top_params"]
+    workers, threads = split_budget(CV_FOLDS, budget)
+    per_fold = run_parallel(_ensemble_fold,
+                            [(k, top, threads) for k in range(CV_FOLDS)],
+                            workers, "ensemble",
+                            names=[f"fold {k}" for k in range(CV_FOLDS)],
+                            initializer=_init_worker, initargs=(DATA_PATH,))
 
     models = []
     oof_probas = np.zeros((len(y_tr), n_class), dtype=float)
 
-    for trial in best_trials:
-        bp = dict(trial.params,
-                  objective='multi:softprob',
-                  num_class=n_class,
-                  n_jobs=-1,
-                  random_state=RANDOM_STATE)
-
-        for tr_idx, va_idx in cv.split(X_tr, y_tr):
-            mdl = XGBClassifier(
-                **bp,
-                eval_metric='mlogloss',
-                early_stopping_rounds=80
-            )
-            mdl.fit(
-                X_tr.iloc[tr_idx], y_tr[tr_idx],
-                sample_weight=cls_w[y_tr[tr_idx]],
-                eval_set=[(X_tr.iloc[va_idx], y_tr[va_idx])],
-                verbose=False
-            )
+    for j in range(len(top)):
+        for k in range(CV_FOLDS):
+            booster, proba = per_fold[k][j]
+            booster.set_param({"nthread": budget})
 
             # accumulate *probabilities* (later averaged)
-            oof_probas[va_idx] += mdl.predict_proba(X_tr.iloc[va_idx])
-            models.append(mdl)
+            oof_probas[_WORKER["folds"].folds[k][1]] += proba
+            models.append(BoosterModel(booster))
+
+    oof_probas /= len(top)
+    return {"models": models, "oof_probas": oof_probas}
+
+
+def evaluating(scaler):
+    # a TempScaler loaded from a pickle comes without its logit cache
+    scaler.cache_bytes = LOGIT_CACHE_BYTES
+    return scaler
 
-    oof_probas /= (topK)
-    oof_preds = oof_probas.argmax(1)
+
+def stage_calibrate(ensemble):
+    X, le, _, (X_va, y_va), _, _ = _WORKER["split"]
+    models = ensemble["models"]
+
+    # ── Calibration on validation slice
+    calib=TempScaler(models, cache_bytes=LOGIT_CACHE_BYTES).fit(X_va,y_va)
+
+    # ── Cascade: one calibrated fold model, full ensemble only inside the band
+    normal_idx = list(le.classes_).index("Normal")
+    cheap = TempScaler(models[:1], cache_bytes=LOGIT_CACHE_BYTES).fit(X_va, y_va)
+    cascade = fit_cascade_band(cheap.predict_proba(X_va), calib.predict_proba(X_va),
+                               normal_idx, target=CASCADE_TARGET)
+    return {"calib": calib, "cheap": cheap, "cascade": cascade}
+
+
+def stage_student(ensemble, calibrate, budget, label_weight=DISTILL_LABEL_WEIGHT):
+    # ── Distilled single-model student (alternate serving artifact)
+    # targets: the ensemble's out-of-fold probabilities on X_tr at the
+    # calibrated temperature, i.e. what the teacher serves for rows it did
+    # not train on (its in-sample output on X_tr is overconfident);
+    # label_weight > 0 mixes in the one-hot labels, which pulls the
+    # student toward the labels and away from the OOF mistakes
+    X, le, (X_tr, y_tr), (X_va, y_va), _, _ = _WORKER["split"]
+    n_class = len(le.classes_)
+    teacher = softmax(np.log(ensemble["oof_probas"] + EPS) / calibrate["calib"].T, axis=1)
+    targets = label_weight * np.eye(n_class)[y_tr] + (1 - label_weight) * teacher
+    model = distill_student(X_tr, targets, n_class, budget)
+    return TempScaler([model]).fit(X_va, y_va)
+
+
+def stage_curves(tune, budget):
+    # ── Unified learning‑curve  (Train‑OOF, Valid, Test) ────────────────────
+    workers, threads = split_budget(len(CURVE_SIZES), budget)
+    points = run_parallel(_curve_point,
+                          [(frac, tune["top_params"][0], threads) for frac in CURVE_SIZES],
+                          workers, "learning curve",
+                          names=[f"frac {frac:.1f}" for frac in CURVE_SIZES],
+                          initializer=_init_worker, initargs=(DATA_PATH,))
+    return [list(c) for c in zip(*points)]
+
+
+def stage_report(r, label_weight=DISTILL_LABEL_WEIGHT):
+    X, le, (X_tr,y_tr), (X_va,y_va), (X_te,y_te), _ = _WORKER["split"]
+    calib = evaluating(r["calibrate"]["calib"])
+    cascade = r["calibrate"]["cascade"]
+    print(f"Optuna best OOF‑CV F1: {r['tune']['best_value']:.4f}  |  "
+          f"ensemble from top‑{len(r['tune']['top_params'])} trials")
 
     # ── Train‑OOF report & confusion matrix
+    oof_preds = r["ensemble"]["oof_probas"].argmax(1)
     print("\n[Train (OOF)]")
     print(classification_report(y_tr,oof_preds,target_names=le.classes_,digits=4))
     plot_conf_matrix(y_tr,oof_preds,le.classes_,"Train (OOF) Confusion")
     f1_tr=f1_score(y_tr,oof_preds,average='weighted')
 
-    # ── Calibration on validation slice
-    calib=TempScaler(models).fit(X_va,y_va)
+    print(f"\nCascade band p(Normal) in [{cascade['lo']:.4f}, {cascade['hi']:.4f}]  |  "
+          f"agreement={cascade['agreement']:.4f}  escalation={cascade['escalation_rate']:.3f}")
 
     def report(X_,y_,tag):
         yp=calib.predict(X_)
@@ -273,57 +463,151 @@ def main():
     f1_te=report(X_te,y_te,"Test")
     plot_final_f1(f1_tr,f1_va,f1_te)
 
-    # ── Unified learning‑curve  (Train‑OOF, Valid, Test) ────────────────────
-    sizes = np.linspace(0.1, 1.0, 10)
-
-    oof_curve, va_curve, te_curve = [], [], []
-
-    best_bp = dict(best_trials[0].params,
-                   objective='multi:softprob',
-                   num_class=n_class,
-                   n_jobs=-1,
-                   random_state=RANDOM_STATE)
-
-    for frac in sizes:
-        n = int(len(X_tr) * frac)
-
-        cv = StratifiedKFold(n_splits=CV_FOLDS, shuffle=True,
-                             random_state=RANDOM_STATE)
-        oof = np.zeros((n, n_class))
-        y_sub = y_tr[:n]
-        X_sub = X_tr.iloc[:n]
-
-        for tr_idx, va_idx in cv.split(X_sub, y_sub):
-            m = XGBClassifier(**best_bp, early_stopping_rounds=None)
-            m.fit(X_sub.iloc[tr_idx], y_sub[tr_idx],
-                  sample_weight=cls_w[y_sub[tr_idx]],
-                  verbose=False)
-
-            oof[va_idx] = m.predict_proba(X_sub.iloc[va_idx])
-
-        oof_pred = oof.argmax(1)
-        oof_curve.append(f1_score(y_sub, oof_pred, average='weighted'))
-
-        m_full = XGBClassifier(**best_bp, early_stopping_rounds=None)
-        m_full.fit(X_sub, y_sub, sample_weight=cls_w[y_sub], verbose=False)
-
-        va_curve.append(f1_score(y_va, m_full.predict(X_va), average='weighted'))
-        te_curve.append(f1_score(y_te, m_full.predict(X_te), average='weighted'))
-
-    plt.figure(figsize=(8, 6))
-    plt.plot(sizes, oof_curve, marker='o', label='Train OOF F1')
-    plt.plot(sizes, va_curve, marker='o', label='Validation F1')
-    plt.plot(sizes, te_curve, marker='o', label='Test F1')
-
-    plot_separate_learning_curves(sizes, oof_curve, va_curve, te_curve)
+    if "student" in r:
+        student = evaluating(r["student"])
+        fused_calib, fused_student = FusedEnsemble.from_temp_scaler(calib), FusedEnsemble.from_temp_scaler(student)
+        x1 = X_va.values[:1]
+        print(f"\n[Student]  trees={fused_student.n_trees} vs ensemble={fused_calib.n_trees}  "
+              f"(max_trees={DISTILL_MAX_TREES}, max_depth={DISTILL_MAX_DEPTH}, "
+              f"label_weight={label_weight})  |  "
+              f"1-row latency {bench_ms(fused_student.predict_proba, x1):.3f} ms "
+              f"vs {bench_ms(fused_calib.predict_proba, x1):.3f} ms")
+        for tag, X_, y_ in (("Valid", X_va, y_va), ("Test", X_te, y_te)):
+            yp_c, yp_s = calib.predict(X_), student.predict(X_)
+            f1_c, f1_s = f1_score(y_, yp_c, average='weighted'), f1_score(y_, yp_s, average='weighted')
+            acc_c, acc_s = accuracy_score(y_, yp_c), accuracy_score(y_, yp_s)
+            print(f"  {tag:<5}  F1 {f1_s:0.4f} (Δ {f1_s - f1_c:+0.4f})  "
+                  f"Acc {acc_s:0.4f} (Δ {acc_s - acc_c:+0.4f})  "
+                  f"agrees with ensemble {np.mean(yp_s == yp_c):0.4f}")
+
+    if "curves" in r:
+        oof_curve, va_curve, te_curve = r["curves"]
+        plot_separate_learning_curves(CURVE_SIZES, oof_curve, va_curve, te_curve)
 
     acc_va = accuracy_score(y_va, calib.predict(X_va))
     acc_te = accuracy_score(y_te, calib.predict(X_te))
 
+    print(f"\n[Ensemble] {calib.cache_misses} scoring passes, {calib.cache_hits} reused")
     print("\n================    FINAL ACCURACIES   ================")
     print(f"Validation : {acc_va:0.4f}")
     print(f"Test       : {acc_te:0.4f}")
     print("========================================================\n")
+    return {"f1_tr": f1_tr, "acc_va": acc_va, "acc_te": acc_te}
+
+
+def stage_save(r):
+    X, le, (_, y_tr), (_, y_va), (X_te, y_te), _ = _WORKER["split"]
+    c = r["calibrate"]
+    # what live traffic is compared against: the held-out test rows (not
+    # trained or calibrated on) and the class mix the ensemble predicts
+    # for them; a table with the same count of every class was balanced
+    # by the generator, so its reference is marked as such (driftSketch)
+    balanced = np.ptp(np.bincount(np.concatenate([y_tr, y_va, y_te]))) == 0
+    drift = build_reference(X_te, evaluating(c["calib"]).predict(X_te), le.classes_, X.columns,
+                            class_balanced=balanced)
+    joblib.dump(r["ensemble"]["models"], "xgb_folds.pkl")
+    joblib.dump(c["calib"], "temp_scal.pkl")
+    joblib.dump(le, "label_encoder.pkl")
+    student = r.get("student")
+    return save_bundle(c["calib"], le.classes_, X.columns,
+                       cheap=FusedEnsemble.from_temp_scaler(c["cheap"]), cascade=c["cascade"],
+                       student=FusedEnsemble.from_temp_scaler(student) if student else None,
+                       drift=drift)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Tune, train and save the aggressive-driving ensemble")
+    ap.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES),
+                    help="stages to run; the stages they need are loaded from the "
+                         "stage cache, or recomputed if stale (default: all)")
+    ap.add_argument("--force", nargs="+", choices=STAGES, default=[],
+                    help="recompute these cached stages (and so everything downstream)")
+    ap.add_argument("--list", action="store_true",
+                    help="show which cached stages are fresh, then exit")
+    ap.add_argument("--fresh", action="store_true",
+                    help=f"discard the stored study ({STUDY_JOURNAL}) and tune from scratch")
+    ap.add_argument("--tune-only", action="store_true",
+                    help="join the stored study as one more tuning worker, then exit")
+    ap.add_argument("--distill-label-weight", type=float, default=DISTILL_LABEL_WEIGHT,
+                    help="share of one-hot labels mixed into the student's targets "
+                         "(default: pure ensemble probabilities)")
+    ap.add_argument("--worker", type=int, default=OPTUNA_JOBS,
+                    help="sampler seed offset of a --tune-only worker")
+    args = ap.parse_args(argv)
+
+    data_hash = source_hash(DATA_PATH)
+    name = study_name(data_hash)
+
+    if args.fresh:
+        try:
+            optuna.delete_study(study_name=name,
+                                storage=JournalStorage(JournalFileBackend(STUDY_JOURNAL)))
+        except KeyError:
+            pass
+        args.force.append("tune")
+
+    # inputs of every cached stage, upstream run ids filled in as they resolve;
+    # "code" is the source of the stage and of everything it calls that
+    # is not already behind an upstream id
+    split = split_version()
+    inputs = {
+        "tune"     : lambda ids: {"study": name, "n_trials": N_TRIALS, "top_k": TOP_K,
+                                  "code": code_version(stage_tune)},
+        "ensemble" : lambda ids: {"tune": ids["tune"], "split": split,
+                                  "code": code_version(stage_ensemble, _ensemble_fold, foldMatrices)},
+        "calibrate": lambda ids: {"ensemble": ids["ensemble"], "split": split,
+                                  "target": CASCADE_TARGET,
+                                  "code": code_version(stage_calibrate, TempScaler, fit_cascade_band)},
+        "student"  : lambda ids: {"calibrate": ids["calibrate"], "split": split,
+                                  "max_trees": DISTILL_MAX_TREES, "max_depth": DISTILL_MAX_DEPTH,
+                                  "label_weight": args.distill_label_weight,
+                                  "code": code_version(stage_student, distill_student, TempScaler)},
+        "curves"   : lambda ids: {"tune": ids["tune"], "split": split,
+                                  "sizes": CURVE_SIZES.tolist(),
+                                  "code": code_version(stage_curves, _curve_point, foldMatrices)},
+    }
+    cache = StageCache(force=args.force)
+
+    if args.list:
+        ids = {}
+        for st in inputs:
+            meta = None
+            if all(dep in ids for dep in NEEDS[st]):
+                meta = cache.peek(st, inputs[st](ids))
+            if meta is not None:
+                ids[st] = meta["id"]
+            print(f"{st:<10} {'fresh  ' + meta['id'] if meta else 'stale'}")
+        return
+
+    # the data is loaded only once something is going to be computed
+    _init_worker(DATA_PATH)
+    if args.tune_only:
+        done = _tune_worker(name, args.worker, N_TRIALS, split_budget(OPTUNA_JOBS)[1])
+        print(f"study {name}: {done}/{N_TRIALS} trials complete or pruned")
+        return
+
+    # ── capture everything that gets printed ────────────────────────────
+    capture_buf = io.StringIO()
+    sys_stdout_orig = sys.stdout
+    sys.stdout = capture_buf
+
+    budget = cpu_budget()
+    print(f"CPU budget {budget}  |  data {data_hash}  |  stages {' '.join(with_needs(args.stages))}")
+
+    compute = {
+        "tune"     : lambda r: stage_tune(name, budget),
+        "ensemble" : lambda r: stage_ensemble(r["tune"], budget),
+        "calibrate": lambda r: stage_calibrate(r["ensemble"]),
+        "student"  : lambda r: stage_student(r["ensemble"], r["calibrate"], budget,
+                                             args.distill_label_weight),
+        "curves"   : lambda r: stage_curves(r["tune"], budget),
+    }
+    r, ids = {}, {}
+    for st in with_needs(args.stages):
+        if st in compute:
+            r[st], ids[st] = cache.run(st, inputs[st](ids), lambda: compute[st](r))
+    metrics = stage_report(r, args.distill_label_weight) if "report" in args.stages else None
+    bundle = stage_save(r) if "save" in args.stages else None
 
     sys.stdout = sys_stdout_orig
 
@@ -333,22 +617,23 @@ def main():
     run_file = log_dir / f"run_{datetime.datetime.now():%Y%m%d_%H%M%S}.txt"
     run_file.write_text(capture_buf.getvalue(), encoding="utf-8")
 
-    summary_line = (
-        f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S}\t"
-        f"OOF_F1={f1_tr:0.4f}\tValid={acc_va:0.4f}\tTest={acc_te:0.4f}\t"
-        f"Best_F1={study.best_value:0.4f}\t"
-        f"Best_params={json.dumps(study.best_params, separators=(',', ':'))}"
-    )
-    (log_dir / "run_summary.tsv").open("a", encoding="utf-8").write(summary_line + "\n")
+    if metrics is not None:
+        tune = r["tune"]
+        summary_line = (
+            f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S}\t"
+            f"OOF_F1={metrics['f1_tr']:0.4f}\tValid={metrics['acc_va']:0.4f}\tTest={metrics['acc_te']:0.4f}\t"
+            f"Best_F1={tune['best_value']:0.4f}\t"
+            f"Best_params={json.dumps(tune['best_params'], separators=(',', ':'))}"
+        )
+        (log_dir / "run_summary.tsv").open("a", encoding="utf-8").write(summary_line + "\n")
 
-    (log_dir / "best_params.json").write_text(
-        json.dumps(study.best_params, indent=2), encoding="utf-8"
-    )
+        (log_dir / "best_params.json").write_text(
+            json.dumps(tune["best_params"], indent=2), encoding="utf-8"
+        )
 
-    joblib.dump(models, "xgb_folds.pkl")
-    joblib.dump(calib, "temp_scal.pkl")
-    joblib.dump(le, "label_encoder.pkl")
-    print("\n💾 models & scaler saved")
+    if bundle is not None:
+        print(f"\n💾 models & scaler saved  |  serving bundle {bundle}")
+    print(f"run log {run_file}")
     gc.collect()
 
 if __name__=="__main__":
@@ -0,0 +1,71 @@
+import os
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Optional, Sequence, Tuple
+
+# ─── CPU budget for the training script ──────────────────────────────
+# Every parallel stage gets the same core budget and splits it as
+# workers × threads-per-model, e.g. 4 concurrent trials × N/4 XGBoost
+# threads, instead of stacking n_jobs=-1 boosters on top of several
+# concurrent trials. TRAIN_CPUS overrides the budget (default: the CPUs
+# this process may run on).
+MIN_THREADS = 2             # per model, below this XGBoost's hist scales badly
+
+
+def cpu_budget() -> int:
+    env = os.getenv("TRAIN_CPUS")
+    if env:
+        return max(1, int(env))
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:                  # not on Linux
+        return os.cpu_count() or 1
+
+
+def split_budget(n_tasks: int, budget: Optional[int] = None,
+                 min_threads: int = MIN_THREADS) -> Tuple[int, int]:
+    # (workers, threads per worker) with workers × threads <= budget
+    budget = budget or cpu_budget()
+    workers = max(1, min(n_tasks, budget // min_threads))
+    return workers, max(1, budget // workers)
+
+
+def _timed(fn: Callable, args: tuple):
+    t = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - t, os.getpid()
+
+
+def run_parallel(fn: Callable, tasks: Sequence[tuple], workers: int, label: str,
+                 names: Optional[Sequence[str]] = None,
+                 initializer: Optional[Callable] = None, initargs: tuple = ()) -> list:
+    # fn(*task) for every task, results in task order. With more than one
+    # worker the tasks go to a spawn-context process pool (fn and the
+    # initializer must be importable module-level functions); with one
+    # they run inline, in this process, without the initializer.
+    # Per-task wall time is printed as each task finishes.
+    names = names or [str(i) for i in range(len(tasks))]
+    t0 = time.perf_counter()
+    results = [None] * len(tasks)
+
+    def log(i, secs, pid):
+        print(f"  [{label}] {names[i]:<16} {secs:8.1f} s  (pid {pid})")
+
+    if workers <= 1:
+        for i, args in enumerate(tasks):
+            results[i], secs, pid = _timed(fn, args)
+            log(i, secs, pid)
+    else:
+        with ProcessPoolExecutor(workers, mp_context=mp.get_context("spawn"),
+                                 initializer=initializer, initargs=initargs) as ex:
+            futures = {ex.submit(_timed, fn, args): i for i, args in enumerate(tasks)}
+            for fut in as_completed(futures):
+                i = futures[fut]
+                results[i], secs, pid = fut.result()
+                log(i, secs, pid)
+
+    print(f"  [{label}] {len(tasks)} tasks on {workers} worker(s) in "
+          f"{time.perf_counter() - t0:.1f} s")
+    return results
+
@@ -0,0 +1,216 @@
+import os
+import json
+import shutil
+import hashlib
+import pathlib
+import argparse
+from typing import Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+# ─── Typed, memory-mapped training-data cache ────────────────────────
+# .data_cache/
+#   telemetry-1a2b3c4d/        ← one entry per source path
+#     meta.json                ← source stat + content hash, columns, classes
+#     X.npy                    ← float32 features, (rows, features), C order
+#     y.npy                    ← int8 label codes into meta["classes"] (sorted)
+#
+# The source (telemetry CSV, or a Parquet/Arrow file or fleet directory)
+# is parsed once, chunk by chunk, straight into the .npy files; later runs
+# np.load(mmap_mode="r") them, so loading costs no parsing and the pages
+# are shared with the OS cache instead of copied into the process.
+# An entry is reused while the source's size + mtime are unchanged; if
+# they changed the content hash decides (a touched but identical file
+# keeps its cache).
+CACHE_DIR    = os.getenv("DATA_CACHE_DIR", ".data_cache")
+CACHE_FORMAT = 1
+LABEL        = "EventType"
+NON_FEATURES = (LABEL, "vehicle_id")
+CHUNK_ROWS   = 500_000
+_HASH_BLOCK  = 8 << 20
+
+
+def _source_files(path: pathlib.Path) -> list:
+    if path.is_dir():
+        return sorted(p for p in path.iterdir() if p.is_file() and not p.name.startswith("."))
+    return [path]
+
+
+def _stat(files: list) -> list:
+    return [[f.name, f.stat().st_size, f.stat().st_mtime_ns] for f in files]
+
+
+def content_hash(files: list) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for f in files:
+        h.update(f.name.encode() + b"\0")
+        with open(f, "rb") as fh:
+            while block := fh.read(_HASH_BLOCK):
+                h.update(block)
+    return h.hexdigest()
+
+
+def _entry_dir(path: pathlib.Path, cache_dir: str) -> pathlib.Path:
+    key = hashlib.blake2b(str(path.resolve()).encode(), digest_size=4).hexdigest()
+    return pathlib.Path(cache_dir) / f"{path.stem}-{key}"
+
+
+# ─── Source readers: DataFrames of at most CHUNK_ROWS rows ──────────
+def is_csv(path: pathlib.Path) -> bool:
+    return path.is_file() and path.suffix == ".csv"
+
+
+def open_columnar(path: pathlib.Path):
+    # pyarrow dataset over a Parquet / Arrow file or a directory of parts
+    # (shared with bulkScore.py)
+    import pyarrow.dataset as ds
+    path = pathlib.Path(path)
+    fmt = "ipc" if any(f.suffix == ".arrow" for f in _source_files(path)) else "parquet"
+    return ds.dataset(str(path), format=fmt)
+
+
+def _count_rows(path: pathlib.Path) -> int:
+    if not is_csv(path):
+        return open_columnar(path).count_rows()
+    lines, last = 0, b"\n"
+    with open(path, "rb") as fh:
+        while block := fh.read(_HASH_BLOCK):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    return lines - 1 + (last != b"\n")        # minus header, plus unterminated last line
+
+
+def _columns(path: pathlib.Path) -> list:
+    if is_csv(path):
+        return list(pd.read_csv(path, nrows=0).columns)
+    return open_columnar(path).schema.names
+
+
+def _frames(path: pathlib.Path, features: list) -> Iterator[pd.DataFrame]:
+    if is_csv(path):
+        yield from pd.read_csv(path, chunksize=CHUNK_ROWS,
+                               dtype={c: np.float32 for c in features})
+    else:
+        for batch in open_columnar(path).to_batches(columns=features + [LABEL],
+                                                batch_size=CHUNK_ROWS):
+            yield batch.to_pandas()
+
+
+# ─── Build / load ────────────────────────────────────────────────────
+def _build(path: pathlib.Path, entry: pathlib.Path, meta: dict) -> None:
+    tmp = entry.with_name(f".tmp-{entry.name}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    features = [c for c in _columns(path) if c not in NON_FEATURES]
+    n = _count_rows(path)
+    X = np.lib.format.open_memmap(tmp / "X.npy", mode="w+", dtype=np.float32,
+                                  shape=(n, len(features)))
+    y = np.lib.format.open_memmap(tmp / "y.npy", mode="w+", dtype=np.int8, shape=(n,))
+
+    # labels get codes in order of appearance, renumbered to sorted order
+    # (what LabelEncoder would produce) once every class has been seen
+    seen: dict = {}
+    a = 0
+    for df in _frames(path, features):
+        b = a + len(df)
+        X[a:b] = df[features].to_numpy(np.float32)
+        cats = pd.Categorical(df[LABEL])
+        lut = np.array([seen.setdefault(str(c), len(seen)) for c in cats.categories],
+                       dtype=np.int8)
+        y[a:b] = lut[cats.codes]
+        a = b
+    if a != n:
+        raise ValueError(f"{path}: counted {n} rows but parsed {a}")
+    if len(seen) > np.iinfo(np.int8).max:
+        raise ValueError(f"{path}: too many classes ({len(seen)})")
+
+    classes = sorted(seen)
+    remap = np.empty(len(seen), dtype=np.int8)
+    for name, code in seen.items():
+        remap[code] = classes.index(name)
+    for a in range(0, n, CHUNK_ROWS):
+        y[a:a + CHUNK_ROWS] = remap[y[a:a + CHUNK_ROWS]]
+    X.flush()
+    y.flush()
+    del X, y
+
+    meta.update(format=CACHE_FORMAT, rows=n, columns=features, classes=classes)
+    (tmp / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    shutil.rmtree(entry, ignore_errors=True)
+    os.replace(tmp, entry)
+
+
+def load_cached(path="telemetry.csv", cache_dir: str = CACHE_DIR,
+                rebuild: bool = False) -> Tuple[np.ndarray, np.ndarray, list, list]:
+    # (X float32 memmap, y int8 codes memmap, feature names, class names)
+    path = pathlib.Path(path)
+    files = _source_files(path)
+    entry = _entry_dir(path, cache_dir)
+    stat = _stat(files)
+
+    meta = None
+    if not rebuild and (entry / "meta.json").exists():
+        meta = json.loads((entry / "meta.json").read_text(encoding="utf-8"))
+        if meta.get("format") != CACHE_FORMAT:
+            meta = None
+        elif meta["stat"] != stat:
+            if meta["hash"] == content_hash(files):
+                meta["stat"] = stat
+                (entry / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+            else:
+                meta = None
+    if meta is None:
+        meta = {"source": str(path.resolve()), "stat": stat, "hash": content_hash(files)}
+        _build(path, entry, meta)
+
+    X = np.load(entry / "X.npy", mmap_mode="r")
+    y = np.load(entry / "y.npy", mmap_mode="r")
+    return X, y, meta["columns"], meta["classes"]
+
+
+def source_hash(path="telemetry.csv", cache_dir: str = CACHE_DIR) -> str:
+    # content hash of the source without parsing it: the cached one while
+    # the source's size + mtime match the cache entry, else hashed afresh
+    path = pathlib.Path(path)
+    files = _source_files(path)
+    meta = _entry_dir(path, cache_dir) / "meta.json"
+    if meta.exists():
+        meta = json.loads(meta.read_text(encoding="utf-8"))
+        if meta.get("stat") == _stat(files):
+            return meta["hash"]
+    return content_hash(files)
+
+
+def main(argv=None):
+    import time
+    import resource
+    ap = argparse.ArgumentParser(description="Build / time the training-data cache")
+    ap.add_argument("path", nargs="?", default="telemetry.csv")
+    ap.add_argument("--cache-dir", default=CACHE_DIR)
+    ap.add_argument("--rebuild", action="store_true")
+    ap.add_argument("--compare", action="store_true",
+                    help="also time pd.read_csv of the source (run it last: peak RSS is per process)")
+    args = ap.parse_args(argv)
+
+    def rss_mb():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    t = time.perf_counter()
+    X, y, cols, classes = load_cached(args.path, args.cache_dir, args.rebuild)
+    print(f"cache   {time.perf_counter() - t:7.2f} s  {X.shape[0]:,} rows × {len(cols)}  "
+          f"classes={classes}  peak RSS {rss_mb():,.0f} MB")
+    t = time.perf_counter()
+    X, y, cols, classes = load_cached(args.path, args.cache_dir)
+    np.asarray(X).sum(axis=0)                # touch every page once
+    print(f"reload  {time.perf_counter() - t:7.2f} s  (incl. one full pass over X)  "
+          f"peak RSS {rss_mb():,.0f} MB")
+    if args.compare and is_csv(pathlib.Path(args.path)):
+        t = time.perf_counter()
+        pd.read_csv(args.path)
+        print(f"read_csv {time.perf_counter() - t:6.2f} s  peak RSS {rss_mb():,.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
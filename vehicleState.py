@@ -0,0 +1,250 @@
+import math
+import time
+import datetime
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+import numpy as np
+
+from featureSpec import (PLAN, WINDOWS, FEATURE_COLUMNS, N_FEATURES, DAY, R_EARTH,  # noqa: F401
+                         OP_MEAN, OP_SUM, OP_STRAIGHT, OP_WMEAN, OP_WVAR,
+                         haversine_scalar, bearing_deg)
+
+
+# Columns kept per GPS point in the ring buffer.
+POINT_COLUMNS = ("lat", "lon", "speed", "acceleration",
+                 "jerk", "dist", "heading", "heading_change")
+_LAT, _LON, _SPEED, _ACC, _JERK, _DIST, _HEAD, _HEAD_CHG = range(len(POINT_COLUMNS))
+_N_COLS = len(POINT_COLUMNS)
+
+
+# ─── Compiled from featureSpec.PLAN ─────────────────────────────────
+# The spec's per-point series as ring columns, then which columns carry a
+# running sum, a non-zero count or a sliding Welford mean / M2 in every
+# window, and how each output column is read off those.
+_RING = {"acc": _ACC, "jerk": _JERK, "dist": _DIST, "hc": _HEAD_CHG}
+_SUM_COLS = tuple(_RING[s] for s in PLAN.sum_sources)
+_NZ_COLS  = tuple(_RING[s] for s in PLAN.nz_sources)
+_VAR_COLS = tuple(_RING[s] for s in PLAN.var_sources)
+_NZ_OF    = tuple(PLAN.nz_sources.index(s) if s in PLAN.nz_sources else -1
+                  for s in PLAN.sum_sources)                  # sum index → nz index
+_POINT_OPS = tuple((j, _RING.get(src), fn) for j, src, fn in PLAN.point_ops)
+
+
+# ─── Streaming window features of one vehicle ───────────────────────
+# Keeps the last max_window points in a flat ring buffer and, for every
+# rolling window, the running sums / counts / Welford stats PLAN asks
+# for, so a new point costs O(1) regardless of history length. Running
+# sums are rebuilt from the ring every _RESYNC_EVERY points to keep float
+# drift bounded.
+_RESYNC_EVERY = 4096
+
+
+class FeatureBuilder:
+    __slots__ = ("max_window", "windows", "n_seen", "last_seen", "lock",
+                 "_ring", "_ts", "_sum", "_nz", "_mean", "_m2", "_out")
+
+    def __init__(self, max_window: int = 8):
+        if max(WINDOWS) > max_window:
+            raise ValueError(f"max_window must be >= {max(WINDOWS)}")
+        self.max_window = max_window
+        self.windows = WINDOWS
+        self.n_seen = 0                      # points ever added
+        self.last_seen = 0.0                 # store clock, used for TTL
+        self.lock = threading.Lock()         # serialises updates of one vehicle
+        self._ring = array("d", bytes(8 * max_window * _N_COLS))
+        self._ts: list = [None] * max_window
+        k = len(self.windows)
+        self._sum  = [[0.0] * len(_SUM_COLS) for _ in range(k)]
+        self._nz   = [[0] * len(_NZ_COLS) for _ in range(k)]
+        self._mean = [[0.0] * len(_VAR_COLS) for _ in range(k)]
+        self._m2   = [[0.0] * len(_VAR_COLS) for _ in range(k)]
+        self._out = np.empty(N_FEATURES)
+
+    def __len__(self) -> int:
+        return min(self.n_seen, self.max_window)
+
+    def add_point(self, lat: float, lon: float, ts: datetime.datetime) -> None:
+        ring, W, n = self._ring, self.max_window, self.n_seen
+        if n == 0:
+            # initialize dynamic fields to zero on first point
+            speed = acc = j = d = heading = heading_change = 0.0
+        else:
+            p = ((n - 1) % W) * _N_COLS
+            dt = (ts - self._ts[(n - 1) % W]).total_seconds() or 1.0
+            d = haversine_scalar(ring[p + _LAT], ring[p + _LON], lat, lon)
+            speed = d / dt
+            acc   = (speed - ring[p + _SPEED]) / dt
+            j     = (acc - ring[p + _ACC]) / dt
+
+            heading = bearing_deg(ring[p + _LAT], ring[p + _LON], lat, lon)
+            raw_delta = heading - ring[p + _HEAD]
+            heading_change = (raw_delta + 180) % 360 - 180
+        point = (lat, lon, speed, acc, j, d, heading, heading_change)
+
+        # slide every window before the new point overwrites the oldest slot
+        for k, w in enumerate(self.windows):
+            sums, nz, means, m2 = self._sum[k], self._nz[k], self._mean[k], self._m2[k]
+            if n < w:
+                c = n + 1
+                for i, col in enumerate(_SUM_COLS):
+                    sums[i] += point[col]
+                for i, col in enumerate(_NZ_COLS):
+                    nz[i] += point[col] != 0.0
+                for i, col in enumerate(_VAR_COLS):
+                    x = point[col]
+                    delta = x - means[i]
+                    means[i] += delta / c
+                    m2[i] += delta * (x - means[i])
+            else:
+                q = ((n - w) % W) * _N_COLS
+                for i, col in enumerate(_SUM_COLS):
+                    sums[i] += point[col] - ring[q + col]
+                for i, col in enumerate(_NZ_COLS):
+                    nz[i] += (point[col] != 0.0) - (ring[q + col] != 0.0)
+                for i, col in enumerate(_VAR_COLS):
+                    x, old = point[col], ring[q + col]
+                    old_mean = means[i]
+                    new_mean = old_mean + (x - old) / w
+                    m2[i] += (x - old) * (x - new_mean + old - old_mean)
+                    means[i] = new_mean
+
+        s = (n % W) * _N_COLS
+        ring[s:s + _N_COLS] = array("d", point)
+        self._ts[n % W] = ts
+        self.n_seen = n + 1
+        if self.n_seen % _RESYNC_EVERY == 0:
+            self._resync()
+
+    def _resync(self) -> None:
+        ring, W, n = self._ring, self.max_window, self.n_seen
+        for k, w in enumerate(self.windows):
+            rows = [((n - 1 - i) % W) * _N_COLS for i in range(min(n, w))]
+            self._sum[k] = [sum(ring[r + col] for r in rows) for col in _SUM_COLS]
+            self._nz[k] = [sum(ring[r + col] != 0.0 for r in rows) for col in _NZ_COLS]
+            for i, col in enumerate(_VAR_COLS):
+                xs = [ring[r + col] for r in rows]
+                mean = sum(xs) / len(xs)
+                self._mean[k][i] = mean
+                self._m2[k][i] = sum((x - mean) ** 2 for x in xs)
+
+    def features(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        # Writes the newest point's feature vector (FEATURE_COLUMNS order)
+        # into `out`; without `out` the builder's own buffer is reused, so
+        # copy it before the next add_point if you need to keep it.
+        if self.n_seen == 0:
+            raise ValueError("no points added yet")
+        if out is None:
+            out = self._out
+        ring, W, n = self._ring, self.max_window, self.n_seen
+        cur = ((n - 1) % W) * _N_COLS
+
+        for k, w in enumerate(self.windows):
+            c = min(n, w)
+            sums = self._sum[k]
+            for j, op, i in PLAN.window_ops[k]:
+                if op == OP_MEAN:
+                    out[j] = sums[i] / c
+                elif op == OP_SUM:
+                    out[j] = sums[i]
+                elif op == OP_WMEAN:
+                    out[j] = self._mean[k][i]
+                elif op == OP_WVAR:
+                    out[j] = self._m2[k][i] / (c - 1) if c > 1 else math.nan
+                elif self._nz[k][_NZ_OF[i]] == 0:           # OP_STRAIGHT
+                    out[j] = 0.0
+                else:
+                    first = ((n - c) % W) * _N_COLS
+                    direct = haversine_scalar(ring[first + _LAT], ring[first + _LON],
+                                              ring[cur + _LAT], ring[cur + _LON])
+                    out[j] = direct / sums[i]
+
+        ts = self._ts[(n - 1) % W]
+        tod = ts.hour * 3600 + ts.minute * 60 + ts.second
+        for j, col, fn in _POINT_OPS:
+            x = tod if col is None else ring[cur + col]
+            if fn == "day_sin":
+                x = math.sin(2 * math.pi * x / DAY)
+            elif fn == "day_cos":
+                x = math.cos(2 * math.pi * x / DAY)
+            out[j] = x
+        return out
+
+    @classmethod
+    def nbytes_estimate(cls, max_window: int = 8) -> int:
+        # ring + timestamp slots + per-window stats + output row + object overhead
+        per_window = len(_SUM_COLS) + len(_NZ_COLS) + 2 * len(_VAR_COLS)
+        return (max_window * (_N_COLS * 8 + 8 + 48)
+                + len(WINDOWS) * (per_window * 32 + 4 * 64) + N_FEATURES * 8 + 512)
+
+
+# ─── Keyed, bounded store of per-vehicle windows ────────────────────
+class VehicleStateStore:
+    def __init__(self,
+                 max_vehicles: int = 10_000,
+                 ttl_seconds: float = 900.0,
+                 max_window: int = 8,
+                 clock=time.monotonic):
+        if max_vehicles < 1:
+            raise ValueError("max_vehicles must be >= 1")
+        self.max_vehicles = max_vehicles
+        self.ttl_seconds = ttl_seconds
+        self.max_window = max_window
+        self._clock = clock
+        self._states: "OrderedDict[Hashable, FeatureBuilder]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted_ttl = 0
+        self.evicted_lru = 0
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, key) -> bool:
+        return key in self._states
+
+    def get(self, key: Hashable) -> FeatureBuilder:
+        now = self._clock()
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = FeatureBuilder(self.max_window)
+                self._states[key] = state
+            else:
+                self._states.move_to_end(key)
+            state.last_seen = now
+            self._evict(now)
+        return state
+
+    def peek(self, key: Hashable) -> Optional[FeatureBuilder]:
+        return self._states.get(key)
+
+    def drop(self, key: Hashable) -> None:
+        with self._lock:
+            self._states.pop(key, None)
+
+    def evict_idle(self) -> None:
+        with self._lock:
+            self._evict(self._clock())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._states.clear()
+
+    def nbytes(self) -> int:
+        return len(self._states) * FeatureBuilder.nbytes_estimate(self.max_window)
+
+    def _evict(self, now: float) -> None:
+        # least-recently-used entries sit at the front, so both the TTL and the
+        # hard cap only ever need to look at the head of the ordered dict
+        states = self._states
+        while states:
+            key, state = next(iter(states.items()))
+            if len(states) > self.max_vehicles:
+                self.evicted_lru += 1
+            elif now - state.last_seen > self.ttl_seconds:
+                self.evicted_ttl += 1
+            else:
+                break
+            states.popitem(last=False)
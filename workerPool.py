@@ -0,0 +1,289 @@
+import os
+import time
+import zlib
+import queue
+import asyncio
+import argparse
+import itertools
+import threading
+import multiprocessing as mp
+from concurrent.futures import Future
+from typing import Hashable, Optional
+
+# ─── Vehicle-affinity worker pool ────────────────────────────────────
+# Feature windows live in process memory, so every point of a vehicle has
+# to reach the same process. The front process (the FastAPI app) hashes
+# vehicle_id to one of N spawned workers and ships points over a pipe;
+# each worker owns the VehicleStateStore and model for its shard and
+# scores everything that queued up on its pipe in one predictor call.
+#
+# Front-proxy alternative: run N independent single-worker services and
+# have the proxy route on a vehicle header, e.g. nginx
+#     upstream ml { hash $http_x_vehicle_id consistent; server …:8001; … }
+# with the C# client sending X-Vehicle-Id. Any scheme works as long as
+# the same vehicle always lands on the same process.
+
+
+def shard_of(vehicle_id: Hashable, n_workers: int) -> int:
+    if vehicle_id is None:
+        return 0
+    if isinstance(vehicle_id, int):
+        return vehicle_id % n_workers
+    # str(): Python's hash() is salted per process, crc32 is stable
+    return zlib.crc32(str(vehicle_id).encode()) % n_workers
+
+
+# ─── Worker side ─────────────────────────────────────────────────────
+def _worker_main(conn, idx: int) -> None:
+    try:
+        import main as service
+        # spawn may already have imported main through the parent's script,
+        # so force single-process mode on the module itself
+        service.SERVE_WORKERS = 1
+        service._load_artifacts()
+    except Exception as exc:
+        conn.send(("ready", idx, False, repr(exc)))
+        return
+    conn.send(("ready", idx, True, service.model.version))
+
+    # replies come from this loop and from reload threads
+    send_lock = threading.Lock()
+
+    def reply(req_id, ok, payload):
+        with send_lock:
+            conn.send((req_id, ok, payload))
+
+    def prepare(req_id, version):
+        reply(req_id, True, service.prepare_reload(version))
+
+    while True:
+        try:
+            msgs = [conn.recv()]
+            while conn.poll():              # coalesce whatever is queued
+                msgs.append(conn.recv())
+        except (EOFError, OSError):
+            return
+
+        points, spans = [], []
+        for kind, req_id, body in msgs:
+            if kind == "score":
+                spans.append((req_id, len(points), len(points) + len(body)))
+                points.extend(body)
+            elif kind == "prepare":
+                # loads on a side thread; this worker keeps scoring meanwhile
+                threading.Thread(target=prepare, args=(req_id, body), daemon=True).start()
+            elif kind == "finish":
+                reply(req_id, True, service.finish_reload(body))
+            elif kind == "info":
+                reply(req_id, True, service.worker_info())
+            elif kind == "metrics":
+                reply(req_id, True, service.registry.collect())
+            elif kind == "drift":
+                reply(req_id, True, service.drift_snapshot())
+            elif kind == "mode":                # one-way, from ShardedPool.tell
+                service.set_degraded(body)
+            elif kind == "stop":
+                return
+
+        if points:
+            try:
+                res = service._score_points(service.model, points)
+            except Exception as exc:
+                for req_id, _, _ in spans:
+                    reply(req_id, False, repr(exc))
+                continue
+            for req_id, a, b in spans:
+                reply(req_id, True, res[a:b])
+
+
+# ─── Front side ──────────────────────────────────────────────────────
+class WorkerError(RuntimeError):
+    pass
+
+
+# Requests go out through one writer thread per worker: a worker only
+# drains its pipe between scoring batches, so a busy one can fill the
+# pipe buffer, and conn.send() would then block whoever called it (the
+# event loop). The outbox keeps each worker's messages in order.
+class ShardedPool:
+    def __init__(self, n_workers: int, start_timeout: float = 120.0):
+        if n_workers < 1:
+            raise ValueError("n_workers must be >= 1")
+        self.n_workers = n_workers
+        self.start_timeout = start_timeout
+        self._ids = itertools.count()
+        self._pending: dict = {}             # req_id -> Future
+        self._owner: dict = {}               # req_id -> worker index
+        self._pending_lock = threading.Lock()
+        self._conns, self._outboxes, self._procs = [], [], []
+
+    def start(self) -> "ShardedPool":
+        ctx = mp.get_context("spawn")
+        for i in range(self.n_workers):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=_worker_main, args=(child, i),
+                               name=f"predict-worker-{i}", daemon=True)
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._outboxes.append(queue.SimpleQueue())
+            self._procs.append(proc)
+
+        for i, conn in enumerate(self._conns):
+            if not conn.poll(self.start_timeout):
+                raise WorkerError(f"worker {i} did not start in {self.start_timeout}s")
+            try:
+                _, idx, ok, detail = conn.recv()
+            except EOFError:
+                raise WorkerError(f"worker {i} exited during start-up") from None
+            if not ok:
+                raise WorkerError(f"worker {idx} failed to load: {detail}")
+            threading.Thread(target=self._read, args=(i,), daemon=True).start()
+            threading.Thread(target=self._write, args=(i,), daemon=True).start()
+        return self
+
+    def _write(self, i: int) -> None:
+        conn, outbox = self._conns[i], self._outboxes[i]
+        while True:
+            msg = outbox.get()
+            if msg is None:
+                return
+            try:
+                conn.send(msg)
+            except (OSError, ValueError) as exc:
+                # worker is gone (its reader fails what was already sent)
+                with self._pending_lock:
+                    fut = self._pending.pop(msg[1], None)
+                    self._owner.pop(msg[1], None)
+                if fut is not None:
+                    fut.set_exception(WorkerError(f"worker {i}: {exc!r}"))
+
+    def _read(self, i: int) -> None:
+        conn = self._conns[i]
+        while True:
+            try:
+                req_id, ok, payload = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._pending_lock:
+                fut = self._pending.pop(req_id, None)
+                self._owner.pop(req_id, None)
+            if fut is not None:
+                if ok:
+                    fut.set_result(payload)
+                else:
+                    fut.set_exception(WorkerError(payload))
+        # worker is gone: fail whatever was still waiting on it
+        with self._pending_lock:
+            dead = [r for r, w in self._owner.items() if w == i]
+            futs = [self._pending.pop(r) for r in dead]
+            for r in dead:
+                del self._owner[r]
+        for fut in futs:
+            fut.set_exception(WorkerError(f"worker {i} exited"))
+
+    def _send(self, worker: int, kind: str, body) -> Future:
+        fut: Future = Future()
+        req_id = next(self._ids)
+        with self._pending_lock:
+            self._pending[req_id] = fut
+            self._owner[req_id] = worker
+        self._outboxes[worker].put((kind, req_id, body))
+        return fut
+
+    def submit(self, worker: int, points: list) -> Future:
+        return self._send(worker, "score", points)
+
+    async def score(self, points: list) -> list:
+        # points: (vehicle_id, lat, lon, ts) tuples; results come back in
+        # input order, each shard's slice keeping its relative order
+        by_worker: dict = {}
+        for i, p in enumerate(points):
+            by_worker.setdefault(shard_of(p[0], self.n_workers), []).append(i)
+        futs = {w: asyncio.wrap_future(self.submit(w, [points[i] for i in idx]))
+                for w, idx in by_worker.items()}
+        out = [None] * len(points)
+        for w, res in zip(futs, await asyncio.gather(*futs.values())):
+            for i, r in zip(by_worker[w], res):
+                out[i] = r
+        return out
+
+    async def broadcast(self, kind: str, body=None) -> list:
+        return await asyncio.gather(*(asyncio.wrap_future(self._send(w, kind, body))
+                                      for w in range(self.n_workers)))
+
+    def tell(self, kind: str, body=None) -> None:
+        # one-way message to every worker, no reply expected
+        for outbox in self._outboxes:
+            outbox.put((kind, -1, body))
+
+    def close(self) -> None:
+        for outbox in self._outboxes:
+            outbox.put(("stop", -1, None))
+            outbox.put(None)                 # ends the writer thread
+        for proc in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+
+
+# ─── Throughput benchmark: 1 … N workers ─────────────────────────────
+def _synthetic_points(n_vehicles: int, n_points: int, seed: int = 0) -> list:
+    import datetime
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    t0 = datetime.datetime(2025, 1, 1, 8, 0, 0)
+    lat = 45.0 + rng.normal(0, 0.05, n_vehicles)
+    lon = 9.0 + rng.normal(0, 0.05, n_vehicles)
+    points = []
+    for k in range(n_points):
+        v = k % n_vehicles
+        lat[v] += rng.normal(0, 1e-4)
+        lon[v] += rng.normal(0, 1e-4)
+        ts = t0 + datetime.timedelta(seconds=k // n_vehicles)
+        points.append((v, float(lat[v]), float(lon[v]), ts))
+    return points
+
+
+async def _drive(pool: ShardedPool, points: list, batch: int, concurrency: int) -> float:
+    chunks = [points[i:i + batch] for i in range(0, len(points), batch)]
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(chunk):
+        async with sem:
+            await pool.score(chunk)
+
+    t = time.perf_counter()
+    # chunks of one wave go out together; waves stay ordered so every
+    # vehicle's points still arrive in time order
+    for i in range(0, len(chunks), concurrency):
+        await asyncio.gather(*(one(c) for c in chunks[i:i + concurrency]))
+    return time.perf_counter() - t
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Throughput scaling of the sharded predictor")
+    ap.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--vehicles", type=int, default=2_000)
+    ap.add_argument("--points", type=int, default=40_000)
+    ap.add_argument("--batch", type=int, default=64, help="points per request")
+    ap.add_argument("--concurrency", type=int, default=32, help="requests in flight")
+    args = ap.parse_args(argv)
+
+    points = _synthetic_points(args.vehicles, args.points)
+    base: Optional[float] = None
+    print(f"{'workers':>7} {'points/s':>12} {'speed-up':>9}")
+    for n in range(1, args.max_workers + 1):
+        pool = ShardedPool(n).start()
+        try:
+            asyncio.run(_drive(pool, points[:args.batch * n], args.batch, args.concurrency))  # warm-up
+            elapsed = asyncio.run(_drive(pool, points, args.batch, args.concurrency))
+        finally:
+            pool.close()
+        rate = len(points) / elapsed
+        base = base or rate
+        print(f"{n:>7} {rate:>12,.0f} {rate / base:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()